@@ -0,0 +1,164 @@
+import gzip
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Final, Optional
+
+from yandex_music import Client, Playlist, TrackShort
+
+LIKES_TARGET: Final = 'likes'
+SNAPSHOT_SUFFIX: Final = '.json.gz'
+
+# track_id -> [album_id, timestamp]
+State = dict[str, list[str]]
+
+
+class SnapshotStore:
+    """Versioned snapshots of one track list (likes or a playlist) stored as deltas keyed by revision.
+
+    Every file holds only the tracks added/removed since the previous revision, so the first file
+    is a full snapshot and each state is rebuilt by replaying the deltas up to the requested revision.
+    Replaying keeps old tracks in place and appends new ones; when the real order differs (tracks were
+    moved or inserted), the file also holds the full id order.
+    """
+    __slots__ = ('folder',)
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+
+    def revisions(self) -> list[int]:
+        if not self.folder.exists():
+            return []
+        return sorted(int(p.name[:-len(SNAPSHOT_SUFFIX)]) for p in self.folder.glob('*' + SNAPSHOT_SUFFIX))
+
+    def read(self, revision: int) -> dict:
+        with gzip.open(self.folder / f'{revision}{SNAPSHOT_SUFFIX}', 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def state(self, revision: Optional[int] = None) -> tuple[State, dict]:
+        state = State()
+        meta = {}
+        for rev in self.revisions():
+            if revision is not None and rev > revision:
+                break
+            snapshot = self.read(rev)
+            for id in snapshot['removed']:
+                state.pop(id, None)
+            for id, album_id, timestamp in snapshot['added']:
+                state[id] = [album_id, timestamp]
+            if 'order' in snapshot:
+                state = {id: state[id] for id in snapshot['order'] if id in state}
+            meta = snapshot
+        if revision is not None and meta.get('revision') != revision:
+            raise KeyError(f'revision {revision} not found in {self.folder}')
+        return state, meta
+
+    def save(self, revision: int, tracks: list[TrackShort], **meta) -> tuple[int, int]:
+        prev, _ = self.state()
+        added = [[str(t.id), str(t.album_id or ''), t.timestamp or ''] for t in tracks
+                 if prev.get(str(t.id)) != [str(t.album_id or ''), t.timestamp or '']]
+        order = list(dict.fromkeys(str(t.id) for t in tracks))
+        current = set(order)
+        removed = [id for id in prev if id not in current]
+        replayed = [id for id in prev if id in current] + [id for id in order if id not in prev]
+        if order != replayed:
+            meta['order'] = order
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self.folder / f'{revision}{SNAPSHOT_SUFFIX}'
+        tmp = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump({'revision': revision, 'created': datetime.now().isoformat(timespec='seconds'),
+                       'count': len(tracks), 'added': added, 'removed': removed, **meta},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        tmp.replace(path)
+        return len(added), len(removed)
+
+
+class Backup:
+    __slots__ = ('folder',)
+
+    def __init__(self, cache_folder: Path) -> None:
+        self.folder = cache_folder / 'backup'
+
+    def store(self, target: str) -> SnapshotStore:
+        if target == LIKES_TARGET:
+            return SnapshotStore(self.folder / LIKES_TARGET)
+        return SnapshotStore(self.folder / 'playlists' / target)
+
+    def targets(self) -> list[str]:
+        targets = [LIKES_TARGET] if (self.folder / LIKES_TARGET).exists() else []
+        playlists = self.folder / 'playlists'
+        if playlists.exists():
+            targets.extend(sorted((p.name for p in playlists.iterdir() if p.is_dir()), key=lambda k: int(k)))
+        return targets
+
+    def create(self, client: Client, jobs: int) -> None:
+        likes_store = self.store(LIKES_TARGET)
+        revisions = likes_store.revisions()
+        last = revisions[-1] if revisions else 0
+        likes = client.users_likes_tracks(if_modified_since_revision=last)
+        if not likes or likes.revision == last:
+            print(f'likes: up to date (revision {last})')
+        else:
+            added, removed = likes_store.save(likes.revision, likes.tracks)
+            print(f'likes: revision {likes.revision} +{added} -{removed}')
+
+        changed = list[tuple[Playlist, SnapshotStore]]()
+        for playlist in client.users_playlists_list():
+            store = self.store(str(playlist.kind))
+            revisions = store.revisions()
+            if revisions and revisions[-1] == playlist.revision:
+                print(f'{playlist.title} ({playlist.kind}): up to date (revision {playlist.revision})')
+                continue
+            changed.append((playlist, store))
+
+        # only changed playlists are fetched, and those concurrently
+        with ThreadPoolExecutor(max(1, jobs)) as executor:
+            fetched = executor.map(lambda ps: ps[0].fetch_tracks(), changed)
+            for (playlist, store), tracks in zip(changed, fetched):
+                added, removed = store.save(playlist.revision or 0, tracks, title=playlist.title)
+                print(f'{playlist.title} ({playlist.kind}): revision {playlist.revision} +{added} -{removed}')
+
+    def show_list(self) -> None:
+        for target in self.targets():
+            store = self.store(target)
+            for rev in store.revisions():
+                snapshot = store.read(rev)
+                title = f' {snapshot["title"]}' if 'title' in snapshot else ''
+                print(f'{target}{title} revision {rev} {snapshot["created"]}'
+                      f' {snapshot["count"]} tracks +{len(snapshot["added"])} -{len(snapshot["removed"])}')
+
+    def diff(self, target: str, rev_from: Optional[int], rev_to: Optional[int]) -> None:
+        store = self.store(target)
+        revisions = store.revisions()
+        if not revisions:
+            print(f'No backups for {target}')
+            return
+        if rev_to is None:
+            rev_to = revisions[-1]
+        if rev_from is None:
+            older = [r for r in revisions if r < rev_to]
+            rev_from = older[-1] if older else rev_to
+
+        old, _ = store.state(rev_from)
+        new, _ = store.state(rev_to)
+        print(f'{target}: revision {rev_from} -> {rev_to}')
+        for id, (album_id, timestamp) in new.items():
+            if id not in old:
+                print(f'+ {id}:{album_id}' if album_id else f'+ {id}', timestamp)
+        for id, (album_id, timestamp) in old.items():
+            if id not in new:
+                print(f'- {id}:{album_id}' if album_id else f'- {id}', timestamp)
+
+    def restore(self, target: str, revision: Optional[int], client: Optional[Client]) -> list[TrackShort]:
+        state, meta = self.store(target).state(revision)
+        tracks = [TrackShort(id, timestamp, album_id or None, client=client)
+                  for id, (album_id, timestamp) in state.items()]
+        if target == LIKES_TARGET:
+            tracks.sort(key=lambda t: t.timestamp, reverse=True)  # newest first, same as users_likes_tracks
+        print(f'Restored {target}{" " + meta["title"] if "title" in meta else ""}'
+              f' revision {meta.get("revision")}: {len(tracks)} tracks', file=sys.stderr)  # keeps --export-list clean
+        return tracks
@@ -0,0 +1,143 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import time
+from typing import Final, NamedTuple, Optional
+
+from store import LocalStore
+
+TEMP_MIN_AGE: Final = 10 * 60  # seconds, younger temp files may belong to a running download
+TEMP_SUFFIXES: Final = ('.part', '.tmp')
+# track file name without `.mp3`, as older versions downloaded to: `[<volume>-<index>]_<title>_<track id>`,
+# ids are numbers, or UUIDs for user uploads
+LEGACY_TEMP = re.compile(r'(?:\d+-\d+)?_.+_(?:\d+|[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12})')
+LOSSY_SUFFIX: Final = '.lossy'  # cold tier: re-encoded copy, cache: marker next to a track restored from one
+MIN_DURATION_RATIO: Final = 0.95
+MAX_JUNK: Final = 4096  # bytes allowed before the first frame
+
+# MPEG audio layer III
+BITRATES_V1: Final = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+BITRATES_V2: Final = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+SAMPLE_RATES: Final = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class Mp3Scan(NamedTuple):
+    frames: int
+    seconds: float
+    problem: Optional[str]
+
+
+class Broken(NamedTuple):
+    path: Path
+    track_id: Optional[str]  # `id:album_id` parsed from the cache path
+    problem: str
+
+
+def scan_mp3(data: bytes) -> Mp3Scan:
+    """Walks MPEG layer III frame headers, reports truncated frames and garbage"""
+    pos = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)  # header, tag, footer
+    start = data.find(b'\xff', pos, pos + MAX_JUNK)
+    if start < 0:
+        return Mp3Scan(0, 0, 'no mp3 frames')
+    pos = start
+
+    frames = 0
+    seconds = 0.0
+    while pos + 4 <= len(data):
+        h = int.from_bytes(data[pos:pos + 4], 'big')
+        version, layer = (h >> 19) & 3, (h >> 17) & 3
+        bitrate_index, rate_index, padding = (h >> 12) & 0xf, (h >> 10) & 3, (h >> 9) & 1
+        if h >> 21 != 0x7ff or version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            break
+        mpeg1 = version == 3
+        bitrate = (BITRATES_V1 if mpeg1 else BITRATES_V2)[bitrate_index] * 1000
+        sample_rate = SAMPLE_RATES[version][rate_index]
+        samples = 1152 if mpeg1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+        if pos + length > len(data):
+            return Mp3Scan(frames, seconds, f'truncated in frame {frames + 1}')
+        frames += 1
+        seconds += samples / sample_rate
+        pos += length
+
+    if not frames:
+        return Mp3Scan(0, 0, 'no mp3 frames')
+    tail = data[pos:]
+    if tail and not (tail.startswith(b'TAG') and len(tail) == 128) and not tail.startswith(b'APETAGEX') \
+            and tail.strip(b'\0'):
+        return Mp3Scan(frames, seconds, f'{len(tail)} bytes of garbage after frame {frames}')
+    return Mp3Scan(frames, seconds, None)
+
+
+def is_temp(name: str) -> bool:
+    """Download temp file name: `<track>.mp3.part`, `.tmp`, or a legacy one (see LEGACY_TEMP)"""
+    return Path(name).suffix in TEMP_SUFFIXES or LEGACY_TEMP.fullmatch(name) is not None
+
+
+def track_id_from_path(path: Path) -> Optional[str]:
+    """`id:album_id` from `.../<year>_<album>_<album_id>/<pos>_<title>_<id>.mp3`"""
+    id = re.search(r'_([^_]+)$', path.stem)
+    album_id = re.search(r'_(\d+)$', path.parent.name)
+    if not id:
+        return None
+    return f'{id[1]}:{album_id[1]}' if album_id and album_id[1] != '0' else id[1]
+
+
+def verify_cache(cache_folder: Path, store: LocalStore, jobs: int) -> list[Broken]:
+    """Checks every cached track, removes old temp files. Broken files are deleted and returned"""
+    files = {path: (track_id, size) for track_id, path, size in store.files()}
+    tracks = list[Path]()
+    temps = 0
+    now = time()
+    for path in cache_folder.glob('*/*/*'):  # artist/album/file
+        if not path.is_file() or not re.search(r'_\d+$', path.parent.name):  # not an album folder (backup etc)
+            continue
+        if path.suffix == '.mp3':
+            tracks.append(path)
+        elif path.suffix == LOSSY_SUFFIX:  # marker, checked with its track
+            if not path.with_suffix('').exists():
+                path.unlink(True)
+        elif is_temp(path.name) and now - path.stat().st_mtime > TEMP_MIN_AGE:
+            path.unlink(True)
+            temps += 1
+    if temps:
+        print(f'removed {temps} temp file{"" if temps == 1 else "s"}')
+
+    track_ids = {path: files[path][0] if path in files else track_id_from_path(path) for path in tracks}
+    durations = {id: data['duration_ms'] / 1000 for id, data in
+                 store.get_tracks(list({t.split(':')[0] for t in track_ids.values() if t})).items()
+                 if data.get('duration_ms')}
+
+    def check(path: Path) -> Optional[Broken]:
+        recorded = files.get(path)
+        track_id = track_ids[path]
+        size = path.stat().st_size
+        if path.with_name(path.name + LOSSY_SUFFIX).exists():
+            return Broken(path, track_id, 're-encoded in the cold tier')
+        if recorded and recorded[1] != size:
+            return Broken(path, track_id, f'size {size}, recorded {recorded[1]}')
+        scan = scan_mp3(path.read_bytes())
+        if scan.problem:
+            return Broken(path, track_id, scan.problem)
+        duration = durations.get(track_id.split(':')[0]) if track_id else None
+        if duration and scan.seconds < duration * MIN_DURATION_RATIO:
+            return Broken(path, track_id, f'{scan.seconds:.0f}s of {duration:.0f}s')
+        return None
+
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        broken = [b for b in executor.map(check, tracks) if b]
+
+    for path in files:
+        if not path.exists():
+            store.delete_file(files[path][0])
+    for b in broken:
+        print(f'{b.problem}: {b.path}')
+        b.path.unlink(True)
+        b.path.with_name(b.path.name + LOSSY_SUFFIX).unlink(True)
+        if b.track_id:
+            store.delete_file(b.track_id.split(':')[0])
+    print(f'{len(tracks)} file{"" if len(tracks) == 1 else "s"} checked, {len(broken)} broken')
+    return broken
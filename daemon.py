@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import secrets
+import socket
+import sys
+import threading
+import traceback
+from pathlib import Path
+from typing import Callable, Optional, TextIO, cast
+
+from ymc import EXIT_MARKER, PORT_FILE_NAME, server_address
+
+
+class ThreadLocalStream(io.TextIOBase):
+    """Stands in for sys.stdin/stdout/stderr and dispatches to the stream of the current session thread.
+
+    Worker threads (prefetch, downloads, post-processing) are shared by sessions and have no stream of their own.
+    Their output goes to the session while only one is running, to the daemon console while there are several.
+    """
+
+    def __init__(self, default: TextIO) -> None:
+        self._default = default
+        self._local = threading.local()
+        self._sessions = list[TextIO]()
+        self._lock = threading.Lock()
+
+    @property
+    def local(self) -> TextIO:
+        stream = getattr(self._local, 'stream', None)
+        if stream is not None:
+            return stream
+        sessions = self._sessions
+        return sessions[0] if len(sessions) == 1 else self._default
+
+    def set(self, stream: Optional[TextIO]) -> None:
+        with self._lock:
+            previous = getattr(self._local, 'stream', None)
+            if previous is not None:
+                self._sessions = [s for s in self._sessions if s is not previous]
+            if stream is not None:
+                self._sessions = self._sessions + [stream]  # replaced, `local` reads it without the lock
+            self._local.stream = stream
+
+    @property
+    def encoding(self) -> str:  # type: ignore[override]
+        return 'utf-8' if self.local is not self._default else self._default.encoding
+
+    def isatty(self) -> bool:
+        return self.local.isatty()
+
+    def fileno(self) -> int:
+        return self.local.fileno()  # session streams have no descriptor: io.UnsupportedOperation
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        return self.local.write(s)
+
+    def flush(self) -> None:
+        self.local.flush()
+
+    def readline(self, size: int = -1) -> str:  # type: ignore[override]
+        return self.local.readline(size)
+
+    def read(self, size: int = -1) -> str:
+        return self.local.read(size)
+
+
+class SessionOutput(io.TextIOBase):
+    """Unbuffered text output to the client socket. A closed connection only drops output."""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self.closed_by_peer = False
+
+    @property
+    def encoding(self) -> str:  # type: ignore[override]
+        return 'utf-8'
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if not self.closed_by_peer:
+            try:
+                self._sock.sendall(s.encode('utf-8', 'replace'))
+            except OSError:
+                self.closed_by_peer = True
+        return len(s)
+
+
+class SessionInput(io.TextIOBase):
+    """Client stdin. EOF means the client is gone, so the running playback loop is cancelled."""
+
+    def __init__(self, reader: TextIO) -> None:
+        self._reader = reader
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def readline(self, size: int = -1) -> str:  # type: ignore[override]
+        try:
+            line = self._reader.readline(size)
+        except (OSError, ValueError):
+            line = ''
+        if not line and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(_cancel_all_tasks)
+        return line
+
+    def read(self, size: int = -1) -> str:
+        return self._reader.read(size)
+
+
+def _cancel_all_tasks() -> None:
+    for task in asyncio.all_tasks():
+        task.cancel()
+
+
+def serve(cache_folder: Path, parse_args: Callable[[list[str]], argparse.Namespace],
+          run: Callable[[argparse.Namespace], None]) -> None:
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    family, address = server_address(cache_folder)
+    auth = secrets.token_hex(16)
+    port_file = cache_folder / PORT_FILE_NAME
+
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        Path(cast(str, address)).unlink(True)
+        old_umask = os.umask(0o177)  # socket is only for current user
+        try:
+            server.bind(address)
+        finally:
+            os.umask(old_umask)
+    else:
+        server.bind(address)
+        port_file.unlink(True)  # the mode below only applies to a new file
+        fd = os.open(port_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)  # token is only for current user
+        with open(fd, 'w') as f:
+            f.write(f'{server.getsockname()[1]} {auth}')
+    server.listen()
+
+    stdin, stdout, stderr = ThreadLocalStream(sys.stdin), ThreadLocalStream(sys.stdout), ThreadLocalStream(sys.stderr)
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr  # type: ignore[assignment]
+    stop = threading.Event()
+    print('Daemon is listening on', address, flush=True)
+
+    def session(conn: socket.socket) -> None:
+        reader = conn.makefile('r', encoding='utf-8', newline='\n')
+        out = SessionOutput(conn)
+        code = 0
+        try:
+            request = json.loads(reader.readline())
+            if family != socket.AF_UNIX and request.get('auth') != auth:
+                return
+
+            stdin.set(SessionInput(reader))
+            stdout.set(out)  # type: ignore[arg-type]
+            stderr.set(out)  # type: ignore[arg-type]
+            try:
+                args = parse_args(request['argv'])
+                if not args.cache_folder.is_absolute():
+                    args.cache_folder = Path(request['cwd']) / args.cache_folder
+                if args.mode == 'daemon':
+                    if args.playlist_name == 'stop':
+                        print('Daemon is stopping')
+                        stop.set()
+                        with socket.socket(family, socket.SOCK_STREAM) as wake:  # unblock accept()
+                            wake.connect(server.getsockname())
+                    else:
+                        print('Daemon is already running')
+                else:
+                    run(args)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                pass
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                stdin.set(None)
+                stdout.set(None)
+                stderr.set(None)
+            out.write(f'{EXIT_MARKER}{code}\n')
+        except Exception:
+            traceback.print_exc()
+        finally:
+            reader.close()
+            conn.close()
+
+    try:
+        while not stop.is_set():
+            conn, _ = server.accept()
+            if stop.is_set():
+                conn.close()
+                break
+            threading.Thread(target=session, args=(conn,), daemon=True).start()
+    finally:
+        server.close()
+        if family == socket.AF_UNIX:
+            Path(cast(str, address)).unlink(True)
+        else:
+            port_file.unlink(True)
+        sys.stdin, sys.stdout, sys.stderr = stdin._default, stdout._default, stderr._default
+
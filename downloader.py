@@ -0,0 +1,279 @@
+import os
+import threading
+import traceback
+from concurrent.futures import Future
+from pathlib import Path
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Callable, Final, Optional
+
+import requests
+from yandex_music.exceptions import YandexMusicError
+
+from transport import transport_of
+
+if TYPE_CHECKING:
+    from yandex_music import Track
+
+FOREGROUND: Final = 0  # track that is about to play
+NEXT: Final = 1        # next few tracks
+BACKGROUND: Final = 2  # sync, mirroring
+
+CLASS_LIMITS: Final = {FOREGROUND: 2, NEXT: 2, BACKGROUND: 2}  # concurrent downloads per class
+CHUNK_SIZE: Final = 64 * 1024
+MAX_ATTEMPTS: Final = 3
+CODEC: Final = 'mp3'
+BITRATE: Final = 192
+TEMP_SUFFIX: Final = '.part'
+
+
+class TokenBucket:
+    """Global byte rate limit shared by all downloads. rate 0: unlimited"""
+    __slots__ = ('rate', '_tokens', '_last', '_lock')
+
+    def __init__(self, rate: int) -> None:
+        self.rate = rate
+        self._tokens = float(rate)  # one second burst
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        if not self.rate:
+            return
+        with self._lock:  # tokens are taken in arrival order, the debt is slept off outside the lock
+            now = monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+
+
+class DownloadJob:
+    __slots__ = ('track', 'path', 'priority', 'seq', 'future', 'started', 'requests', 'cancelled')
+
+    def __init__(self, track: 'Track', path: Path, priority: int, seq: int) -> None:
+        self.track = track
+        self.path = path
+        self.priority = priority
+        self.seq = seq
+        self.future: Future[Optional[Path]] = Future()
+        self.started = False
+        self.requests = 1  # groups waiting for it
+        self.cancelled = False
+
+
+class Cancelled(Exception):
+    pass
+
+
+class DownloadScheduler:
+    """Downloads tracks to the cache by priority: FOREGROUND, then NEXT, then BACKGROUND.
+
+    There is one per process (a daemon shares it between sessions), so the bandwidth limit is global and
+    background work never competes with the track about to play, whoever asked for it.
+    Each class has its own concurrency limit. Downloads stream in chunks, between chunks a download waits
+    while a more urgent one is running. Requesting a path that is queued or downloading already only raises
+    its priority. Files go through the transport of the track's client.
+    `restore(path)` is tried first, it brings back files moved out of the cache (cold tier).
+    """
+    __slots__ = ('_restore', '_bucket', '_limits', '_cond', '_queue', '_jobs', '_active', '_seq',
+                 '_stop', '_threads')
+
+    def __init__(self, max_bandwidth: int = 0, restore: Optional[Callable[[Path], bool]] = None,
+                 limits: dict[int, int] = CLASS_LIMITS) -> None:
+        self._restore = restore
+        self._bucket = TokenBucket(max_bandwidth)
+        self._limits = limits
+        self._cond = threading.Condition()
+        self._queue = list[DownloadJob]()
+        self._jobs: dict[Path, DownloadJob] = {}
+        self._active = {p: 0 for p in limits}
+        self._seq = 0
+        self._stop = False
+        self._threads = [threading.Thread(target=self._worker, name=f'download-{i}', daemon=True)
+                         for i in range(sum(limits.values()))]
+        for t in self._threads:
+            t.start()
+
+    def request(self, track: 'Track', path: Path, priority: int) -> 'Future[Optional[Path]]':
+        """Future of the cached file path, None if the download failed or the scheduler is shut down"""
+        with self._cond:
+            if self._stop:
+                future: Future[Optional[Path]] = Future()
+                future.set_result(None)
+                return future
+            job = self._jobs.get(path)
+            if job is not None:
+                job.requests += 1
+                job.cancelled = False
+                if priority < job.priority:
+                    if job.started:
+                        self._active[job.priority] -= 1
+                        self._active[priority] += 1
+                    job.priority = priority
+                    self._cond.notify_all()
+                return job.future
+            if path.exists():
+                future = Future()
+                future.set_result(path)
+                return future
+            self._seq += 1
+            job = self._jobs[path] = DownloadJob(track, path, priority, self._seq)
+            self._queue.append(job)
+            self._cond.notify_all()
+            return job.future
+
+    def release(self, path: Path, future: 'Future[Optional[Path]]') -> None:
+        """Drops one request of `future`, the job is cancelled once nobody waits for it"""
+        with self._cond:
+            job = self._jobs.get(path)
+            if job is None or job.future is not future:
+                return
+            job.requests -= 1
+            if job.requests > 0:
+                return
+            if job.started:
+                job.cancelled = True  # between chunks
+                self._cond.notify_all()
+                return
+            if job not in self._queue:  # dropped by `shutdown`, resolved already
+                return
+            self._queue.remove(job)
+            del self._jobs[path]
+        job.future.set_result(None)
+
+    def shutdown(self) -> None:
+        """Drop queued jobs and abort running ones"""
+        with self._cond:
+            self._stop = True
+            queued, self._queue = self._queue, []
+            for job in queued:
+                del self._jobs[job.path]
+            self._cond.notify_all()
+        for job in queued:
+            job.future.set_result(None)
+        for t in self._threads:
+            t.join()
+
+    def _next_job(self) -> Optional[DownloadJob]:
+        runnable = [j for j in self._queue if self._active[j.priority] < self._limits[j.priority]]
+        return min(runnable, key=lambda j: (j.priority, j.seq), default=None)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stop and (job := self._next_job()) is None:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                assert job
+                self._queue.remove(job)
+                job.started = True
+                self._active[job.priority] += 1
+            try:
+                result = self._download(job)
+            except Cancelled:
+                result = None
+            except Exception:
+                print(f'download of {job.track.track_id} failed:')
+                traceback.print_exc()
+                result = None
+            with self._cond:
+                self._active[job.priority] -= 1
+                del self._jobs[job.path]
+                self._cond.notify_all()
+            job.future.set_result(result)
+
+    def _wait_turn(self, job: DownloadJob) -> None:
+        with self._cond:
+            while not self._stop and not job.cancelled and any(self._active[p] for p in range(job.priority)):
+                self._cond.wait()
+            if self._stop or job.cancelled:
+                raise Cancelled()
+
+    def _download(self, job: DownloadJob) -> Optional[Path]:
+        track = job.track
+        if self._restore and self._restore(job.path):
+            return job.path
+        job.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = job.path.with_name(job.path.name + TEMP_SUFFIX)
+        written = 0
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self._wait_turn(job)
+            try:
+                url = self._direct_link(track)
+                if url is None:
+                    print(f' no {CODEC} {BITRATE}kbps for {track.track_id}')
+                    return None
+                headers = {'Range': f'bytes={written}-'} if written else {}
+                with transport_of(track.client).get(url, headers=headers, stream=True) as resp:
+                    resp.raise_for_status()
+                    if written and resp.status_code != 206:  # no range support, start over
+                        written = 0
+                    expected = written + int(resp.headers.get('Content-Length', -written - 1))
+                    with open(tmp, 'ab' if written else 'wb') as f:
+                        for chunk in resp.iter_content(CHUNK_SIZE):
+                            self._wait_turn(job)
+                            self._bucket.consume(len(chunk))
+                            f.write(chunk)
+                            written += len(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())  # data must be on disk before the rename makes it a cache hit
+                    if expected >= 0 and written != expected:  # urllib3 does not check, resume with Range
+                        raise requests.exceptions.ChunkedEncodingError(f'got {written} of {expected} bytes')
+                tmp.replace(job.path)
+                return job.path
+            except Cancelled:
+                tmp.unlink(True)
+                raise
+            except (requests.RequestException, YandexMusicError, OSError) as e:
+                print(f' download {track.track_id} attempt {attempt}: {type(e).__name__} {e}')
+                track.download_info = None  # direct links expire
+                if attempt < MAX_ATTEMPTS:
+                    sleep(attempt)
+        tmp.unlink(True)
+        return None
+
+    @staticmethod
+    def _direct_link(track: 'Track') -> Optional[str]:
+        infos = track.download_info or track.get_download_info()
+        for info in infos:
+            if info.codec == CODEC and info.bitrate_in_kbps == BITRATE:
+                return info.direct_link or info.get_direct_link()
+        return None
+
+
+class DownloadGroup:
+    """Requests of one user of the scheduler (a playback session, a sync).
+
+    Callers get their own futures. `close` resolves the unfinished ones to None, so no callback of the group
+    runs after it (the resources they use may be closed next), and cancels jobs nobody else waits for.
+    """
+    __slots__ = ('scheduler', '_pending', '_lock')
+
+    def __init__(self, scheduler: DownloadScheduler) -> None:
+        self.scheduler = scheduler
+        self._pending: dict[Future[Optional[Path]], tuple[Path, Future[Optional[Path]]]] = {}
+        self._lock = threading.RLock()
+
+    def request(self, track: 'Track', path: Path, priority: int) -> 'Future[Optional[Path]]':
+        job_future = self.scheduler.request(track, path, priority)
+        future: Future[Optional[Path]] = Future()
+        with self._lock:
+            self._pending[future] = path, job_future
+        job_future.add_done_callback(lambda f: self._finish(future, f.result()))
+        return future
+
+    def close(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for future in pending:
+                future.set_result(None)
+        for path, job_future in pending.values():
+            self.scheduler.release(path, job_future)
+
+    def _finish(self, future: 'Future[Optional[Path]]', result: Optional[Path]) -> None:
+        with self._lock:  # callbacks run under it, `close` waits for them
+            if self._pending.pop(future, None) is not None:
+                future.set_result(result)
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Optional, TextIO
+
+from cachecheck import track_id_from_path
+from store import QUERY_CHUNK_SIZE, LocalStore
+
+# track_id, album_id, timestamp: a row of a backup snapshot or a stored playlist
+Entry = tuple[str, Optional[str], str]
+
+
+def _extinf(track_id: str, data: Optional[dict]) -> str:
+    if not data:
+        return f'#EXTINF:-1,{track_id}'
+    seconds = (data.get('duration_ms') or 0) // 1000 or -1
+    artists = ', '.join(a['name'] for a in data.get('artists') or () if a.get('name'))
+    title = data.get('title') or track_id
+    if data.get('version'):
+        title = f"{title} ({data['version']})"
+    return f'#EXTINF:{seconds},{artists} - {title}' if artists else f'#EXTINF:{seconds},{title}'
+
+
+def find_cached(cache_folder: Path, wanted: dict[str, Optional[str]]) -> dict[str, Path]:
+    """Cached files of `wanted` (track id -> album id), from file names: files the store has no record of.
+
+    One pass over the cache folder that only lists album folders of wanted albums (all of them if an album
+    id is unknown) and stops once everything is found.
+    """
+    albums = {album_id for album_id in wanted.values() if album_id}
+    any_album = None in wanted.values()
+    files = dict[str, Path]()
+    if not cache_folder.is_dir():
+        return files
+    for artist in os.scandir(cache_folder):
+        if not artist.is_dir():
+            continue
+        for album in os.scandir(artist.path):
+            match = re.search(r'_(\d+)$', album.name)
+            if not match or not album.is_dir() or not any_album and match[1] not in albums:
+                continue
+            for entry in os.scandir(album.path):
+                path = Path(entry.path)
+                if path.suffix == '.mp3' and (track_id := track_id_from_path(path)):
+                    if (id := track_id.split(':')[0]) in wanted:
+                        files[id] = path
+                        if len(files) == len(wanted):
+                            return files
+    return files
+
+
+def export_tracks(store: LocalStore, entries: Iterable[Entry], fmt: str, out: TextIO, title: str,
+                  cache_folder: Path, relative_to: Optional[Path] = None) -> tuple[int, int]:
+    """Writes a track list as M3U8 (cached files only) or JSONL (every track, stored metadata and file path).
+
+    Entries are consumed and written a chunk at a time, so memory does not grow with the list.
+    Files come from the store index, ids it misses are looked up in the chunk's album folders (`find_cached`).
+    Returns tracks written, tracks without a cached file.
+    """
+    if fmt == 'm3u8':
+        out.write(f'#EXTM3U\n#PLAYLIST:{title}\n')
+    written = missing = 0
+    it = iter(entries)
+    while chunk := list(islice(it, QUERY_CHUNK_SIZE)):
+        ids = [id for id, _, _ in chunk]
+        indexed = store.get_files(ids)
+        paths = dict[str, Optional[Path]]()
+        unindexed = dict[str, Optional[str]]()
+        for id, album_id, _ in chunk:
+            path = indexed.get(id)
+            if path is None or not path.exists():  # not indexed, or stale: moved to cold tier
+                unindexed[id] = album_id or None
+                path = None
+            paths[id] = path
+        if unindexed:
+            paths.update(find_cached(cache_folder, unindexed))
+        missing += sum(paths[id] is None for id in ids)
+        lines = list[str]()
+        if fmt == 'jsonl':
+            raw = store.get_tracks_json(ids)  # stored text as is, decoding all metadata is the slow part
+            for id, album_id, timestamp in chunk:
+                path = paths[id]
+                head = json.dumps({'track_id': id, 'album_id': album_id or None, 'timestamp': timestamp or None,
+                                   'path': str(path) if path else None}, ensure_ascii=False)
+                lines.append(f'{head[:-1]}, "track": {raw.get(id, "null")}}}')
+        else:
+            metadata = store.get_tracks([id for id in ids if paths[id]])
+            for id, _, _ in chunk:
+                if path := paths[id]:
+                    lines.append(_extinf(id, metadata.get(id)))
+                    lines.append(os.path.relpath(path, relative_to) if relative_to else str(path))
+        written += len(chunk) if fmt == 'jsonl' else len(lines) // 2
+        if lines:
+            lines.append('')
+            out.write('\n'.join(lines))
+    return written, missing
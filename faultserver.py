@@ -0,0 +1,266 @@
+import json
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+from typing import Final, NamedTuple, Optional
+from urllib.parse import parse_qs
+
+# API faults: bad-gateway, limited, unauthorized, reset. CDN faults: bad-gateway, ssl (per new connection), truncate
+API_FAULTS: Final = ('bad-gateway', 'limited', 'unauthorized', 'reset')
+CDN_FAULTS: Final = ('bad-gateway', 'ssl', 'truncate')
+BAD_GATEWAY_HTML: Final = b'<html><head><title>502 Bad Gateway</title></head>\r\n<body>\r\n' \
+                          b'<center><h1>502 Bad Gateway</h1></center>\r\n<hr><center>nginx</center>\r\n</body></html>'
+FRAME: Final = b'\xff\xfb\x90\x00' + bytes(413)  # MPEG1 layer III, 128kbps, 44100Hz
+FRAME_SECONDS: Final = 1152 / 44100
+SEND_CHUNK: Final = 16 * 1024
+
+
+class FaultMix(NamedTuple):
+    rates: dict[str, float]  # fault -> probability per request
+    latency: float = 0       # seconds added to every response
+    bandwidth: int = 0       # CDN bytes/s per connection, 0: unlimited
+
+
+SCENARIOS: Final = {
+    'clean': FaultMix({}),
+    'bad-gateway': FaultMix({'bad-gateway': 0.2}),
+    'limited': FaultMix({'limited': 0.2}),
+    'ssl': FaultMix({'ssl': 0.3}),
+    'truncate': FaultMix({'truncate': 0.3}),
+    'unauthorized': FaultMix({'unauthorized': 0.05}),
+    'slow': FaultMix({}, latency=0.3, bandwidth=512 * 1024),
+    'mixed': FaultMix({'bad-gateway': 0.05, 'limited': 0.05, 'reset': 0.05, 'ssl': 0.1, 'truncate': 0.1},
+                      latency=0.05, bandwidth=2 * 1024 * 1024),
+}
+
+
+class BenchResult(NamedTuple):
+    scenario: str
+    tracks: int
+    ok: int
+    seconds: float
+    recover: list[float]  # per track that hit a fault: first fault to completion
+    wasted: int           # CDN bytes sent that did not end up in cached files
+    faults: Counter
+
+    def __str__(self) -> str:
+        rate = self.ok / self.seconds * 60 if self.seconds else 0
+        recover = f'recover avg {sum(self.recover) / len(self.recover):.1f}s max {max(self.recover):.1f}s' \
+            if self.recover else 'no recoveries'
+        faults = ' '.join(f'{k}x{v}' for k, v in sorted(self.faults.items())) or 'none'
+        return f'{self.scenario}: {self.ok}/{self.tracks} tracks in {self.seconds:.1f}s, {rate:.1f} tracks/min, ' \
+               f'{recover}, wasted {self.wasted / 1024:.0f} KiB, faults: {faults}'
+
+
+class FaultServer:
+    """Local stand-in for the API and the download CDN that injects faults seen in the wild.
+
+    API (plain HTTP) serves account status, tracks, download info; CDN (TLS, self-signed) serves mp3 files
+    with Range support. Point a client at `base_url` with TLS verification off.
+    Play status sinks can be pointed at it too: play-audio, `/sink` (webhook), `/2.0/` (Last.fm API);
+    what they deliver is kept in `sink_events` and printed.
+    """
+    __slots__ = ('mix', 'track_ids', 'track_bytes', 'faults', 'cdn_bytes', 'sink_events', '_rng', '_lock', '_api',
+                 '_cdn', '_tmp', '_threads')
+
+    def __init__(self, mix: FaultMix, tracks: int, track_bytes: int = 1024 * 1024, port: int = 0,
+                 seed: int = 0) -> None:
+        if not shutil.which('openssl'):
+            raise RuntimeError('openssl is needed to make a certificate for the CDN')
+        self.mix = mix
+        self.track_ids = [str(i) for i in range(1, tracks + 1)]
+        self.track_bytes = FRAME * max(1, track_bytes // len(FRAME))
+        self.faults = list[tuple[float, str]]()  # monotonic time, fault
+        self.cdn_bytes = 0
+        self.sink_events = list[tuple[str, dict]]()  # sink, event
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tmp = TemporaryDirectory()
+        cert, key = Path(self._tmp.name) / 'cert.pem', Path(self._tmp.name) / 'key.pem'
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-keyout', str(key), '-out', str(cert)],
+                       check=True, capture_output=True)
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(cert, key)
+        self._api = _Server(('127.0.0.1', port), self, None)
+        self._cdn = _Server(('127.0.0.1', 0), self, ctx)
+        self._threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in (self._api, self._cdn)]
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._api.server_address[1]}'
+
+    @property
+    def cdn_host(self) -> str:
+        return f'127.0.0.1:{self._cdn.server_address[1]}'
+
+    def __enter__(self) -> 'FaultServer':
+        for t in self._threads:
+            t.start()
+        return self
+
+    def __exit__(self, *_) -> None:  # type: ignore[no-untyped-def]
+        for s in (self._api, self._cdn):
+            s.shutdown()
+            s.server_close()
+        self._tmp.cleanup()
+
+    def fault(self, allowed: tuple[str, ...]) -> Optional[str]:
+        with self._lock:
+            for name in allowed:
+                if self._rng.random() < self.mix.rates.get(name, 0):
+                    self.faults.append((monotonic(), name))
+                    return name
+        return None
+
+    def count_cdn(self, n: int) -> None:
+        with self._lock:
+            self.cdn_bytes += n
+
+    def sink(self, name: str, events: list[dict]) -> None:
+        with self._lock:
+            self.sink_events.extend((name, e) for e in events)
+        for e in events:
+            print(f'[{name}]', ' '.join(f'{k}={v}' for k, v in e.items()))
+
+    def track_json(self, id: str) -> dict:
+        return {'id': id, 'realId': id, 'title': f'Fault {id}', 'available': True,
+                'durationMs': int(len(self.track_bytes) // len(FRAME) * FRAME_SECONDS * 1000),
+                'artists': [{'id': 1, 'name': 'Fault Server'}],
+                'albums': [{'id': 1, 'title': 'Faults', 'year': 2021, 'trackPosition': {'volume': 1, 'index': id}}]}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], owner: FaultServer, tls: Optional[ssl.SSLContext]) -> None:
+        super().__init__(address, _Handler)
+        self.owner = owner
+        self.tls = tls
+
+    def finish_request(self, request, client_address) -> None:  # type: ignore[no-untyped-def]
+        if self.tls:  # handshake here, on the connection thread
+            if self.owner.fault(('ssl',)):
+                request.sendall(b'HTTP/1.1 400 Bad Request\r\n\r\n')  # not a TLS record
+                return
+            try:
+                request = self.tls.wrap_socket(request, server_side=True)
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: _Server
+
+    def log_message(self, format, *args) -> None:  # type: ignore[no-untyped-def]
+        pass
+
+    def do_GET(self) -> None:
+        self._handle()
+
+    def do_POST(self) -> None:
+        self._handle()
+
+    def _handle(self) -> None:
+        owner = self.server.owner
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if owner.mix.latency:
+            sleep(owner.mix.latency)
+        cdn = self.server.tls is not None
+        fault = owner.fault(tuple(f for f in (CDN_FAULTS if cdn else API_FAULTS) if f != 'ssl'))
+        if fault == 'bad-gateway':
+            return self._send(502, BAD_GATEWAY_HTML, 'text/html')
+        if fault == 'limited':
+            return self._send(429, b'limited', 'text/plain')
+        if fault == 'unauthorized':
+            return self._json(401, {'error': 'session-expired', 'error_description': 'fault server'})
+        if fault == 'reset':
+            self.close_connection = True
+            return
+        if cdn:
+            return self._mp3(fault == 'truncate')
+
+        path = self.path.split('?')[0]
+        if path == '/account/status':
+            return self._json(200, {'result': {
+                'account': {'now': '2021-01-01T00:00:00+00:00', 'serviceAvailable': True, 'uid': 1,
+                            'login': 'fault', 'firstName': 'Fault'},
+                'permissions': {'until': '2099-01-01T00:00:00+00:00', 'values': [], 'default': []}}})
+        if path == '/permission-alerts':
+            return self._json(200, {'result': {'alerts': []}})
+        if path == '/tracks':
+            ids = [t.split(':')[0] for v in parse_qs(body.decode()).get('track-ids', []) for t in v.split(',')]
+            known = set(owner.track_ids)
+            return self._json(200, {'result': [owner.track_json(id) for id in ids if id in known]})
+        if path == '/play-audio':
+            owner.sink('play-audio', [{k: v[0] for k, v in parse_qs(body.decode()).items()}])
+            return self._json(200, {'result': 'ok'})
+        if path == '/sink':
+            owner.sink('webhook', json.loads(body)['events'])
+            return self._json(200, {})
+        if path == '/2.0/':
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            if form.get('method') == 'track.scrobble':
+                n = len([k for k in form if k.startswith('timestamp[')])
+                owner.sink('lastfm', [{k[:k.index('[')]: form[k] for k in form if k.endswith(f'[{i}]')} for i in range(n)])
+                return self._json(200, {'scrobbles': {'@attr': {'accepted': n, 'ignored': 0}}})
+            owner.sink('lastfm', [{'now': form.get('artist'), 'track': form.get('track')}])
+            return self._json(200, {'nowplaying': {}})
+        if m := re.fullmatch(r'/tracks/([^/]+)/download-info', path):
+            id = m[1].split(':')[0]
+            return self._json(200, {'result': [{
+                'codec': 'mp3', 'bitrateInKbps': 192, 'gain': False, 'preview': False, 'direct': False,
+                'downloadInfoUrl': f'{owner.base_url}/download-info/{id}'}]})
+        if m := re.fullmatch(r'/download-info/([^/]+)', path):
+            xml = f'<?xml version="1.0" encoding="utf-8"?>\n<download-info><host>{owner.cdn_host}</host>' \
+                  f'<path>/{m[1]}.mp3</path><ts>0</ts><region>0</region><s>0</s></download-info>'
+            return self._send(200, xml.encode(), 'text/xml')
+        return self._json(404, {'error': 'not-found', 'error_description': path})
+
+    def _mp3(self, truncate: bool) -> None:
+        owner = self.server.owner
+        data = owner.track_bytes
+        start = 0
+        m = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if m and int(m[1]) < len(data):
+            start = int(m[1])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        end = start + (len(data) - start) // 2 if truncate else len(data)
+        bandwidth = owner.mix.bandwidth
+        for pos in range(start, end, SEND_CHUNK):
+            chunk = data[pos:min(pos + SEND_CHUNK, end)]
+            try:
+                self.wfile.write(chunk)
+            except OSError:
+                break
+            owner.count_cdn(len(chunk))
+            if bandwidth:
+                sleep(len(chunk) / bandwidth)
+        if truncate:
+            self.close_connection = True
+
+    def _json(self, status: int, obj: dict) -> None:
+        self._send(status, json.dumps(obj).encode(), 'application/json')
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,328 @@
+import asyncio
+import codecs
+import copy
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+from time import sleep, time
+from typing import Callable, Final, Optional, TextIO
+
+from yandex_music import Client, Search
+from yandex_music.base import YandexMusicObject
+
+SEARCH_CACHE_FILE_NAME: Final = 'search_cache.json'
+SEARCH_CACHE_TTL: Final = 24 * 60 * 60  # seconds
+DEBOUNCE_SECONDS: Final = 0.3
+SEARCH_TYPES: Final = ('all', 'track', 'album', 'artist')
+
+HELP: Final = 'type to search, Enter: pick, Ctrl-D: exit'
+LINE_HELP: Final = 'enter a query, then pick; EOF: exit'
+KEY: Final = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|O.|)|.', re.DOTALL)  # escape sequence, lone ESC or a char
+PICK_HELP: Final = 'empty*: best match, tN: track, bN: album, aN: artist, pN: playlist, r: refine'
+
+
+class SearchCache:
+    """query -> search results with TTL. Kept in memory and in `search_cache.json` as raw API dicts."""
+    __slots__ = ('path', 'ttl', '_raw', '_parsed', '_dirty', '_lock')
+
+    def __init__(self, cache_folder: Path, ttl: int = SEARCH_CACHE_TTL) -> None:
+        self.path = cache_folder / SEARCH_CACHE_FILE_NAME
+        self.ttl = ttl
+        self._parsed: dict[str, Search] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            raw: dict[str, list] = json.loads(self.path.read_text(encoding='utf-8'))
+            now = time()
+            self._raw = {k: v for k, v in raw.items() if now - v[0] < ttl}
+            self._dirty = len(self._raw) != len(raw)
+        except (FileNotFoundError, ValueError):
+            self._raw = {}
+
+    @staticmethod
+    def key(query: str, type_: str, nocorrect: bool) -> str:
+        return f'{type_}:{int(nocorrect)}:{" ".join(query.casefold().split())}'
+
+    def get(self, client: Client, key: str) -> Optional[Search]:
+        with self._lock:
+            entry = self._raw.get(key)
+            if entry is None or time() - entry[0] >= self.ttl:
+                return None
+            search = self._parsed.get(key)
+            if search is None:
+                search = self._parsed[key] = Search.de_json(entry[1], client)
+            return search
+
+    def put(self, key: str, search: Search) -> None:
+        with self._lock:
+            self._raw[key] = [time(), search.to_dict()]
+            self._parsed[key] = search
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._raw, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+            tmp.replace(self.path)
+            self._dirty = False
+
+
+def is_terminal(stream: TextIO) -> bool:
+    """True if single keys can be read from `stream`: not a pipe or a daemon session"""
+    try:
+        return stream.isatty() and stream.fileno() >= 0
+    except (AttributeError, OSError, ValueError):  # io.UnsupportedOperation is both of the last two
+        return False
+
+
+class KeyReader:
+    """Feeds single key presses from the terminal to an asyncio queue (cbreak mode on posix).
+
+    An escape sequence (arrow keys etc) is one item, so is a lone ESC.
+    """
+    __slots__ = ('_loop', '_queue', '_stdin', '_stop', '_thread', '_old_attrs')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: 'asyncio.Queue[str]', stdin: TextIO) -> None:
+        self._loop = loop
+        self._queue = queue
+        self._stdin = stdin
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._old_attrs = None
+
+    def __enter__(self) -> 'KeyReader':
+        if os.name != 'nt':
+            import termios
+            import tty
+            self._old_attrs = termios.tcgetattr(self._stdin.fileno())
+            tty.setcbreak(self._stdin.fileno())
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()  # polling, so it doesn't keep stdin after exit
+        if self._old_attrs is not None:
+            import termios
+            termios.tcsetattr(self._stdin.fileno(), termios.TCSADRAIN, self._old_attrs)
+
+    def _put(self, ch: str) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, ch)
+
+    def _run(self) -> None:
+        if os.name == 'nt':
+            import msvcrt
+            while not self._stop.is_set():
+                if msvcrt.kbhit():
+                    self._put(msvcrt.getwch())
+                else:
+                    sleep(0.02)
+            return
+
+        import select
+        fd = self._stdin.fileno()
+        decoder = codecs.getincrementaldecoder(self._stdin.encoding or 'utf-8')('replace')
+        while not self._stop.is_set():
+            if not select.select([fd], [], [], 0.05)[0]:
+                continue
+            data = os.read(fd, 64)
+            if not data:  # EOF
+                self._put('\x04')
+                return
+            for key in KEY.findall(decoder.decode(data)):  # a sequence comes in one read
+                self._put(key)
+
+
+def merge_results(results: dict[str, Optional[Search]]) -> Optional[Search]:
+    """Best match and playlists from type=all, more tracks/albums/artists from typed searches."""
+    all_ = results.get('all')
+    if all_ is None:
+        return None
+    merged = copy.copy(all_)
+    for type_ in SEARCH_TYPES[1:]:
+        typed = results.get(type_)
+        attr = type_ + 's'
+        if typed and typed[attr]:
+            setattr(merged, attr, typed[attr])
+    return merged
+
+
+def pick_result(search: Search, inp: str) -> Optional[tuple[str, YandexMusicObject]]:
+    if not inp:
+        if search.best and search.best.result:
+            return search.best.type, search.best.result
+        return None
+    m = re.fullmatch(r'([tbap])\s*(\d+)', inp)
+    if not m:
+        return None
+    attr = {'t': 'tracks', 'b': 'albums', 'a': 'artists', 'p': 'playlists'}[m[1]]
+    n = int(m[2])
+    res = search[attr]
+    if res is None or not 0 < n <= len(res.results):
+        return None
+    return res.type, res.results[n - 1]
+
+
+def interactive_search(client: Client, cache: SearchCache, nocorrect: bool,
+                       show: Callable[[Search], None]) -> tuple[str, YandexMusicObject]:
+    return asyncio.run(_interactive_search(client, cache, nocorrect, show))
+
+
+async def _interactive_search(client: Client, cache: SearchCache, nocorrect: bool,
+                              show: Callable[[Search], None]) -> tuple[str, YandexMusicObject]:
+    def search_sync(query: str, type_: str) -> Optional[Search]:
+        key = cache.key(query, type_, nocorrect)
+        search = cache.get(client, key)
+        if search is None:
+            search = client.search(query, nocorrect=nocorrect, type_=type_, playlist_in_best=False)
+            if search is not None:
+                cache.put(key, search)
+        return search
+
+    async def search_all(query: str) -> Optional[Search]:
+        # threads can't be interrupted: a cancelled query only has its results dropped
+        results = await asyncio.gather(*(asyncio.to_thread(search_sync, query, t) for t in SEARCH_TYPES))
+        return merge_results(dict(zip(SEARCH_TYPES, results)))
+
+    async def debounced(query: str) -> Optional[Search]:
+        await asyncio.sleep(DEBOUNCE_SECONDS)
+        return await search_all(query)
+
+    def render(search: Optional[Search]) -> None:
+        print()
+        if search is None:
+            print('Nothing found')
+        else:
+            show(search)
+
+    async def read_line() -> str:
+        line = await asyncio.to_thread(stdin.readline)
+        if not line:  # EOF
+            print()
+            raise KeyboardInterrupt()
+        return line.strip()
+
+    async def line_search() -> tuple[str, YandexMusicObject]:
+        """Without a terminal: a query per line, no search as you type"""
+        print(LINE_HELP)
+        while True:
+            print('search> ', end='', flush=True)
+            query = await read_line()
+            if not query:
+                continue
+            try:
+                search = await search_all(query)
+            except Exception as e:
+                print(f'{type(e).__name__} {e}')
+                continue
+            render(search)
+            while search:
+                print(f'pick ({PICK_HELP})> ', end='', flush=True)
+                inp = await read_line()
+                if inp == 'r':
+                    break
+                picked = pick_result(search, inp)
+                if picked:
+                    return picked
+                print(f'nothing to pick for "{inp}"')
+
+    def prompt() -> None:
+        if picking:
+            print(f'\r\x1b[K pick ({PICK_HELP})> {line}', end='', flush=True)
+        else:
+            print(f'\r\x1b[Ksearch> {line}', end='', flush=True)
+
+    keys = asyncio.Queue[str]()
+    task: Optional[asyncio.Task[Optional[Search]]] = None
+    shown: Optional[asyncio.Task[Optional[Search]]] = None
+    query = line = ''
+    picking = False
+    stdin = getattr(sys.stdin, 'local', sys.stdin)  # daemon sessions: the client's input, not a terminal
+    if not is_terminal(stdin):
+        return await line_search()
+    print(HELP)
+    with KeyReader(asyncio.get_running_loop(), keys, stdin):
+        prompt()
+        while True:
+            getter = asyncio.ensure_future(keys.get())
+            pending = {getter} if task is None or task is shown else {getter, task}
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            if task is not None and task in done and task is not shown:
+                shown = task
+                try:
+                    render(task.result())
+                except Exception as e:
+                    print(f'\n{type(e).__name__} {e}')
+                prompt()
+
+            if getter not in done:
+                getter.cancel()
+                continue
+            ch = getter.result()
+
+            if ch.startswith('\x1b'):  # escape sequences (arrows etc) and a lone ESC are ignored
+                continue
+
+            if ch in ('\x04', '\x03'):  # Ctrl-D, Ctrl-C
+                if task:
+                    task.cancel()
+                print()
+                raise KeyboardInterrupt()
+
+            elif ch in ('\r', '\n'):
+                if not picking:
+                    if not query:
+                        continue
+                    picking, line = True, ''
+                    if task is None or task is not shown:
+                        if task:
+                            task.cancel()
+                        task = asyncio.ensure_future(search_all(query))
+                    prompt()
+                    continue
+
+                if line.strip() == 'r':
+                    picking, line = False, query
+                    prompt()
+                    continue
+                try:
+                    search = await task if task else None
+                except Exception as e:
+                    print(f'\n{type(e).__name__} {e}')
+                    search = None
+                picked = pick_result(search, line.strip()) if search else None
+                if picked:
+                    print()
+                    return picked
+                print(f'\nnothing to pick for "{line.strip()}"')
+                line = ''
+                prompt()
+
+            elif ch in ('\x7f', '\b'):
+                line = line[:-1]
+                if not picking:
+                    query = line
+                prompt()
+
+            elif ch.isprintable():
+                line += ch
+                if not picking:
+                    query = line
+                prompt()
+
+            else:
+                continue
+
+            if not picking and ch not in ('\r', '\n'):
+                if task and task is not shown:
+                    task.cancel()
+                task = shown = None
+                if query.strip():
+                    task = asyncio.ensure_future(debounced(query))
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+import hashlib
+import json
 import os
 from random import random
 import re
@@ -11,34 +15,84 @@ import unicodedata
 from json.decoder import JSONDecodeError
 from pathlib import Path
 from textwrap import indent
-from time import sleep
+from threading import Lock
+from time import monotonic, sleep, time
 from types import SimpleNamespace
-from typing import TYPE_CHECKING, Callable, Final, Optional, TypeVar, Union, cast
+from typing import TYPE_CHECKING, Any, Callable, Final, NamedTuple, Optional, TypeVar, Union, cast
 
 # sys.path.append('~/source/pyt/yandex-music-api/')
-from yandex_music import Artist, Client, Playlist, SearchResult, Track, TrackShort
+from yandex_music import Artist, Client, Feed, Landing, Playlist, Search, SearchResult, Supplement, Track, TrackShort
 from yandex_music.album.album import Album
 from yandex_music.base import YandexMusicObject
 from yandex_music.exceptions import NetworkError as YMNetworkError, Unauthorized as YMApiUnauthorized, YandexMusicError
 from yandex_music.feed.generated_playlist import GeneratedPlaylist
+
+from trackformat import DEFAULT_FORMAT, DEFAULT_FORMAT_ID, LineWriter, TrackFormat, duration_str
+from tracklist import HYDRATE_CACHE_SIZE, TrackList
 if TYPE_CHECKING:
     from yandex_music.rotor.station_result import StationResult
+    from stats import PlayStats
+    from postprocess import PostProcessor
+    from store import LocalStore
+    from session import Session
+    from downloader import DownloadGroup, DownloadScheduler
+    from faultserver import BenchResult
+    from sinks import SinkHub
 
 T = TypeVar('T')
 
 MAX_ERRORS: Final = 3
-
-
-def handle_args() -> argparse.Namespace:
+SUPPLEMENT_PREFETCH: Final = 2  # current and next track
+ALICE_PREFETCH: Final = 8  # after-track shots fetched ahead
+TRACKS_CHUNK_SIZE: Final = 200  # track ids per client.tracks request
+ARTIST_TRACKS_PAGE_SIZE: Final = 250
+RESPONSE_CACHE_TTL: Final = 10 * 60  # seconds, for landing/feed and their pre-resolved playlists
+LIKES_CHUNK_SIZE: Final = 200  # track ids per users_likes_tracks_add/remove request
+BATCH_LIKES_CHECKPOINT: Final = 'batch_likes.json'
+LOCAL_SEARCH_LIMIT: Final = 500
+WELL_KNOWN_PLAYLISTS: Final = {  # personal-playlists, uid:kind
+    'playlistOfTheDay': '503646255:26954868',
+    'origin': '940441070:17870614',
+    'neverHeard': '692528232:114169885',
+    'recentTracks': '692529388:111791060',
+    'missedLikes': '460141773:108134812',
+    'kinopoisk': '1087766963:2441326',
+}
+SYNC_PLAYLISTS: Final = ('playlistOfTheDay', 'neverHeard', 'missedLikes', 'origin', 'kinopoisk')  # daily
+
+
+def parse_rate(s: str) -> int:
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kKmM]?)[bB]?', s.strip())
+    if not m:
+        raise argparse.ArgumentTypeError(f'invalid rate: {s!r}')
+    return int(float(m[1]) * {'': 1, 'k': 1024, 'm': 1024 * 1024}[m[2].lower()])
+
+
+def positive_int(s: str) -> int:
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {s!r}')
+    return n
+
+
+def seed_int(s: str) -> int:
+    n = int(s)
+    if not 0 <= n < 1 << 64:  # Permutation keys are 8 bytes
+        raise argparse.ArgumentTypeError(f'must be 0..2**64-1: {s!r}')
+    return n
+
+
+def handle_args(argv: Optional[list[str]] = None, load_token: bool = True) -> argparse.Namespace:
     DEFAULT_CACHE_FOLDER = Path(__file__).resolve().parent / '.YMcache'
     CONFIG_FILE_NAME = 'config'
 
     parser = argparse.ArgumentParser()
     parser.add_argument('mode', choices=('likes', 'l', 'playlist', 'p', 'search', 's', 'auto', 'a',
-                                         'radio', 'r', 'queue', 'q', 'feed', 'f', 'id'),
-                        help='operation mode')
+                                         'radio', 'r', 'queue', 'q', 'feed', 'f', 'id', 'backup', 'stats',
+                                         'daemon', 'cache', 'faults', 'sync', 'export'),
+                        help='operation mode. daemon: keep warm session for ymc.py (daemon stop: shut it down)')
     parser.add_argument('playlist_name', nargs='?',
-                        help='name of playlist or search term')
+                        help='name of playlist or search term (search without term is interactive)')
 
     auto__ = parser.add_argument_group('auto')
     auto__.add_argument('--auto-type', '-tt', choices=('personal-playlists', 'personalplaylists', 'promotions',
@@ -62,13 +116,86 @@ def handle_args() -> argparse.Namespace:
                         help='show %(metavar)s search results')
     search.add_argument('--search-no-correct', action='store_true',
                         help='no autocorrection for search')
-
+    search.add_argument('--local', action='store_true',
+                        help='search tracks in local metadata (titles, artists, albums, fetched lyrics), works offline')
+
+    backup = parser.add_argument_group('backup', 'playlist_name is action: create* | list | diff | restore')
+    backup.add_argument('--backup-target', default='likes', metavar='TARGET',
+                        help='"likes" or user playlist kind for diff/restore. Default: %(default)r')
+    backup.add_argument('--revision', type=int, action='append', default=[], metavar='REV',
+                        help='revision to restore or to diff (specify twice for from and to)')
+
+    cache = parser.add_argument_group('cache', 'playlist_name is action: verify* | tier')
+    cache.add_argument('--cold-days', type=int, default=365, metavar='N',
+                       help='tier: tracks not played (or modified, if never played) for %(metavar)s days are cold. '
+                            'Default: %(default)s')
+    cache.add_argument('--cold-folder', type=Path, metavar='PATH',
+                       help='where cold tracks are kept, they are brought back when requested. '
+                            'Default: CACHE_FOLDER/cold')
+    cache.add_argument('--tier-method', choices=('xz', 'reencode'), default='xz',
+                       help='tier: xz (lossless) or reencode (ffmpeg, smaller). Default: %(default)s')
+    cache.add_argument('--tier-bitrate', type=int, default=96, metavar='KBPS',
+                       help='tier: reencode bitrate. Default: %(default)s')
+
+    parser.add_argument_group('sync', 'download new tracks of daily playlists at low priority, for cron or ymc. '
+                                      'playlist_name is comma separated names. Default: '
+                                      + ','.join(SYNC_PLAYLISTS))
+
+    export = parser.add_argument_group('export', 'write a track list from local data only (backup snapshots, '
+                                                 'stored playlists, cache index). playlist_name is source: likes* | '
+                                                 'playlist kind (backup) | auto playlist name or uid:kind (played '
+                                                 'or synced) | all (backups and stored auto playlists)')
+    export.add_argument('--export-format', choices=('m3u8', 'jsonl'), default='m3u8',
+                        help='m3u8: cached files only, jsonl: every track with metadata and path. Default: %(default)s')
+    export.add_argument('--export-to', metavar='PATH',
+                        help='output file, - for stdout, a folder for all. Default: export folder in cache folder')
+    export.add_argument('--export-relative', action='store_true',
+                        help='m3u8: file paths relative to the output folder (for copies on other devices)')
+
+    faults = parser.add_argument_group('faults', 'local API stand-in with injected faults. '
+                                                 'playlist_name is action: bench* | serve')
+    faults.add_argument('--scenario', action='append', default=[], metavar='NAME',
+                        help='fault mix: clean | bad-gateway | limited | ssl | truncate | unauthorized | slow | mixed. '
+                             'bench: can be specified multiple times, default all. serve: default mixed')
+    faults.add_argument('--bench-tracks', type=int, default=20, metavar='N',
+                        help='tracks per scenario. Default: %(default)s')
+    faults.add_argument('--fault-port', type=int, default=0, metavar='PORT',
+                        help='serve: API port. Default: any free')
+
+    status = parser.add_argument_group('status', 'now playing and scrobbles, sent in the background. '
+                                                 'Also see --no-send-status')
+    status.add_argument('--webhook-url', metavar='URL',
+                        help='POST play events as JSON to %(metavar)s')
+    status.add_argument('--lastfm-key', metavar='KEY',
+                        help='Last.fm API key, scrobbling needs --lastfm-secret and --lastfm-session too')
+    status.add_argument('--lastfm-secret', metavar='SECRET',
+                        help='Last.fm API shared secret')
+    status.add_argument('--lastfm-session', metavar='SK',
+                        help='Last.fm session key (auth.getMobileSession)')
+    status.add_argument('--lastfm-url', metavar='URL',
+                        help='Last.fm compatible API (Libre.fm, `faults serve`). Default: Last.fm')
+    status.add_argument('--status-queue', type=int, default=100, metavar='N',
+                        help='events kept per destination while it is slow or down, oldest are dropped. '
+                             'Default: %(default)s')
+
+    stats = parser.add_argument_group('stats', 'playlist_name is query: top* | never-played | skips | push')
+    stats.add_argument('--year', type=int, metavar='YYYY',
+                       help='year for top. Default: all time')
+    stats.add_argument('--top', type=int, default=100, metavar='N',
+                       help='show %(metavar)s rows. Default: %(default)s')
+
+    parser.add_argument('--no-stats', dest='stats', action='store_false',
+                        help='do not record plays in local play log')
     parser.add_argument('--no-send-status', dest='send_status', action='store_false',
                         help='do not send playing status')
     parser.add_argument('--batch-like', action='store_true',
                         help='like all tracks in list')
     parser.add_argument('--batch-remove-like', action='store_true',
                         help='remove like from all tracks in list')
+    parser.add_argument('--batch-chunk-size', metavar='N', type=positive_int, default=LIKES_CHUNK_SIZE,
+                        help='track ids per batch like request. Default: %(default)s')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=4,
+                        help='max concurrent API requests. Default: %(default)s')
     parser.add_argument('--list', '-l', action='store_true',
                         help='only show tracks')
     parser.add_argument('--skip', '-s', metavar='N', type=int, default=0,
@@ -79,10 +206,21 @@ def handle_args() -> argparse.Namespace:
                         help='show skipped tracks')
     parser.add_argument('--shuffle', action='store_true',
                         help='randomize tracks order')
+    parser.add_argument('--seed', type=seed_int, metavar='N',
+                        help='seed for --shuffle (same seed, same order). Default: random')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue last session of this source at the next track, in the same order')
+    parser.add_argument('--sync-queue', action='store_true',
+                        help='queue mode: keep server queue position in sync with playback and resume')
     parser.add_argument('--reverse', '-r', action='store_true',
                         help='reverse tracks order')
     parser.add_argument('--show-id', action='store_true',
                         help='show track_id')
+    parser.add_argument('--format', metavar='TEMPLATE',
+                        help='track line template, str.format syntax. Fields: {n} {total} {id} {type} {type_tag} '
+                             '{artist} {artists} {album} {albums} {album_id} {year} {name} {version} {title} '
+                             '{duration} {seconds} {cached} (cached, cold or empty). '
+                             'Default: "' + DEFAULT_FORMAT.replace('%', '%%') + '"')
     parser.add_argument('--export-list', action='store_true',
                         help='print comma separated track_id list of playlist and exit')
     parser.add_argument('--log-api', action='store_true',
@@ -100,15 +238,38 @@ def handle_args() -> argparse.Namespace:
                         help='args for --audio-player (can be specified multiple times)')
     parser.add_argument('--ignore-retcode', action=argparse.BooleanOptionalAction, default=os.name == 'nt',
                         help='ignore audio player return code. Default on Windows')
+    parser.add_argument('--tags', action=argparse.BooleanOptionalAction, default=False,
+                        help='write ID3 tags to downloaded tracks (needs mutagen). Default: %(default)s')
+    parser.add_argument('--save-covers', action=argparse.BooleanOptionalAction, default=False,
+                        help='save album covers next to cached tracks and embed them in tags. Default: %(default)s')
+    parser.add_argument('--max-bandwidth', type=parse_rate, default=0, metavar='RATE',
+                        help='download rate limit in bytes/s for the whole process (a daemon\'s covers its sessions), '
+                             'K and M suffixes are allowed. Default: unlimited')
+    parser.add_argument('--prefetch', type=int, default=1, metavar='N',
+                        help='download next %(metavar)s tracks while playing. Default: %(default)s')
+    parser.add_argument('--preflight', type=int, default=100, metavar='N',
+                        help='check availability and cache paths of the next %(metavar)s tracks at once before '
+                             'playing them, unplayable ones are skipped. 0: off. '
+                             f'At most {HYDRATE_CACHE_SIZE} (metadata kept in memory). Default: %(default)s')
     parser.add_argument('--skip-long-path', action=argparse.BooleanOptionalAction, default=os.name == 'nt',
                         help='skip track if file path is over MAX_PATH. Default on Windows')
     parser.add_argument('--report-new-fields', action='store_true',
                         help='report new fields from API')
+    parser.add_argument('--base-url', metavar='URL',
+                        help='API base URL, e.g. of `faults serve`. Default: YM API')
     parser.add_argument('--ignore-ssl', action='store_true',
-                        help='ignore SSL errors')
+                        help='don\'t verify TLS certificates')
+    parser.add_argument('--http-pool-size', type=int, default=10, metavar='N',
+                        help='keep-alive connections per host. Default: %(default)s')
+    parser.add_argument('--keep-alive', action=argparse.BooleanOptionalAction, default=True,
+                        help='reuse HTTP connections. Default: %(default)s')
+    parser.add_argument('--connect-timeout', type=float, default=5, metavar='SECONDS',
+                        help='HTTP connect timeout. Default: %(default)s')
+    parser.add_argument('--read-timeout', type=float, default=15, metavar='SECONDS',
+                        help='HTTP read timeout, between received chunks for downloads. Default: %(default)s')
     parser.add_argument('--print-args', action='store_true',
                         help='print arguments (with resolved default values) and exit')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.audio_player is parser.get_default('audio_player') \
             and args.audio_player_arg is parser.get_default('audio_player_arg'):
@@ -153,6 +314,21 @@ def handle_args() -> argparse.Namespace:
     if args.mode != 'auto' or args.playlist_name != 'origin':
         args.alice = False
 
+    if args.mode == 'backup' and not args.playlist_name:
+        args.playlist_name = 'create'
+
+    if args.mode == 'stats' and not args.playlist_name:
+        args.playlist_name = 'top'
+
+    if args.mode == 'cache' and not args.playlist_name:
+        args.playlist_name = 'verify'
+
+    if args.mode == 'faults' and not args.playlist_name:
+        args.playlist_name = 'bench'
+
+    if args.mode == 'export' and not args.playlist_name:
+        args.playlist_name = 'likes'
+
     if args.mode == 'auto' and not args.playlist_name:
         print('playlist_name is not set. Assuming "playlistOfTheDay".')
         args.playlist_name = 'playlistOfTheDay'
@@ -161,7 +337,9 @@ def handle_args() -> argparse.Namespace:
         print(args)
         sys.exit()
 
-    if type(args.token) is str and len(args.token) == 39 and re.match(r'^\w{39}$', args.token, re.ASCII):
+    if not load_token or args.mode in ('faults', 'export'):  # daemon session: client is there / fake API / local
+        pass
+    elif type(args.token) is str and len(args.token) == 39 and re.match(r'^\w{39}$', args.token, re.ASCII):
         if not args.no_save_token:
             args.cache_folder.mkdir(parents=True, exist_ok=True)
             (args.cache_folder / CONFIG_FILE_NAME).write_text(args.token)
@@ -220,14 +398,14 @@ def show_attributes(obj: Union[YandexMusicObject, list, None], ignored: set[str]
     pprint(attributes(obj, ignored))
 
 
-def getTracksFromQueue(client: Client) -> tuple[int, list[TrackShort]]:
+def getTracksFromQueue(client: Client, playlist_name: Optional[str]) -> tuple[int, TrackList, tuple[str, int]]:
     # queue queues_list
     queues = client.queues_list()
     print(len(queues), 'queues')
-    if not args.playlist_name:
+    if not playlist_name:
         for qi in queues: show_attributes(qi)
         sys.exit(1)
-    name_icase: str = args.playlist_name.casefold()
+    name_icase: str = playlist_name.casefold()
     for qi in queues:
         assert qi.context
         assert qi.context.description
@@ -244,15 +422,33 @@ def getTracksFromQueue(client: Client) -> tuple[int, list[TrackShort]]:
     assert queue.id == qi.id  # just check
     assert queue.modified == qi.modified
     return (len(queue.tracks),
-        [TrackShort(t.track_id or t.id or 0, '', str(t.album_id), client=client)
-            for t in queue.tracks[queue.current_index:]])
+        TrackList(client, (TrackShort(t.track_id or t.id or 0, '', str(t.album_id), client=client)
+            for t in queue.tracks[queue.current_index:])),
+        (queue.id, queue.current_index))
 
 
-def getTracksFromFeed(client: Client) -> tuple[int, list[Track]]:
-    feed = client.feed()
+def getTracksFromFeed(client: Client, playlist_name: Optional[str], cache_folder: Path, store: 'LocalStore',
+                      executor: ThreadPoolExecutor) -> tuple[int, TrackList]:
+    feed = cached_response(cache_folder, 'feed', client.feed, lambda data: Feed.de_json(data, client))
     assert feed
     show_attributes(feed, {'client', 'generated_playlists', 'days'})
 
+    if playlist_name:
+        # resolve generated playlists in background while looking for the one to play
+        prefetched = {gp.type: executor.submit(fetch_playlist_tracks, client, store, gp.data)
+                      for gp in feed.generated_playlists if gp.data}
+        playlist_name_icase = playlist_name.casefold()
+        for gp in feed.generated_playlists:
+            pl = gp.data
+            if pl and (gp.type == playlist_name or (pl.title and playlist_name_icase in pl.title.casefold())):
+                tracks = prefetched[gp.type].result()
+                total_tracks = pl.track_count or len(tracks)
+                show_playing_playlist(pl, total_tracks)
+                return total_tracks, TrackList(client, tracks, store)
+        print(f'generated playlist "{playlist_name}" not found.'
+              f' Available: {[gp.type for gp in feed.generated_playlists]}')
+        sys.exit(1)
+
     for gp in feed.generated_playlists:
         assert gp.data
         if gp.type not in {'playlistOfTheDay', 'origin', 'neverHeard', 'recentTracks', 'missedLikes', 'kinopoisk'}:
@@ -296,18 +492,84 @@ def getTracksFromFeed(client: Client) -> tuple[int, list[Track]]:
     # for i, t in enumerate(day.tracks_to_play):
     #     assert t.track_id == day.tracks_to_play_with_ads[i].track.track_id  # type: ignore
 
-    return len(day.tracks_to_play), day.tracks_to_play
+    return len(day.tracks_to_play), TrackList(client, day.tracks_to_play, store)
 
 
-def getSearchTracks(client: Client, playlist_name: str, search_type: str, search_x: int,
-                    search_no_correct: bool, search_count: int, show_id: bool
-                   ) -> tuple[int, Union[list[Track], list[TrackShort]]]:
+def getSearchTracks(client: Client, store: 'LocalStore', playlist_name: str, search_type: str, search_x: int,
+                    search_no_correct: bool, search_count: int, show_id: bool, cache_folder: Path, local: bool,
+                    fmt: TrackFormat) -> tuple[int, TrackList]:
+    if local:
+        if not playlist_name:
+            print('--local needs a query')
+            sys.exit(1)
+        return getLocalSearchTracks(client, store, playlist_name, search_count, fmt)
+
     if not playlist_name:
-        print('Specify search term (playlist-name)')
-        sys.exit(1)
+        from isearch import SearchCache, interactive_search
+        cache = SearchCache(cache_folder)
+        try:
+            restype, res = interactive_search(
+                client, cache, search_no_correct,
+                lambda search: show_search_results(search, search_count, show_id, fmt))
+        finally:
+            cache.save()
+        total_tracks, tracks = getSearchResultTracks(client, res, restype, show_id)
+        return total_tracks, TrackList(client, tracks, store)
+
     search = client.search(playlist_name, playlist_in_best=False,
                            nocorrect=search_no_correct, type_=search_type)
     assert search
+    if search.tracks and search.tracks.results:
+        rank_by_local(search.tracks.results, store, playlist_name)
+        store.put_tracks([(str(t.id), t.to_dict()) for t in search.tracks.results])  # index for --local
+    show_search_results(search, search_count, show_id, fmt)
+
+    if search.best:  # 'all'
+        res = search.best.result
+        restype = search.best.type
+        print(f'Best match: [{restype}]')
+    else:
+        searchres: SearchResult
+        if search_type == 'all'\
+            or (searchres := search[search_type + 's']) is None\
+            or len(searchres.results) == 0:
+            print(f'Nothing found for "{search.text}", type={search.type_}')
+            show_attributes(search)
+            sys.exit(1)
+
+        restype = searchres.type
+        res = searchres.results[search_x - 1]
+        print(f'Selecting {search_x} [{restype}]')
+
+    total_tracks, tracks = getSearchResultTracks(client, res, restype, show_id)
+    return total_tracks, TrackList(client, tracks, store)
+
+
+def getLocalSearchTracks(client: Client, store: 'LocalStore', query: str, search_count: int, fmt: TrackFormat
+                         ) -> tuple[int, TrackList]:
+    if not store.fts:
+        print('sqlite3 has no FTS5, local search is not available')
+        sys.exit(1)
+    start = monotonic()
+    ids = store.search(query, LOCAL_SEARCH_LIMIT)
+    found = store.get_tracks(ids)
+    tracks = [cast(Track, Track.de_json(found[id], client)) for id in ids if id in found]  # lyrics only: not fetched
+    print(f'Local results for "{query}": {len(tracks)} track{plural(len(tracks))} '
+          f'in {(monotonic() - start) * 1000:.0f} ms')
+    if not tracks:
+        sys.exit(1)
+    for i, track in enumerate(tracks[:search_count], 1):
+        show_playing_track(i, len(tracks), track, fmt)
+    return len(tracks), TrackList(client, tracks)
+
+
+def rank_by_local(tracks: list[Track], store: 'LocalStore', query: str) -> None:
+    """Moves online results that also match locally (played, liked, cached) to the front, keeps API order otherwise"""
+    local = {id: n for n, id in enumerate(store.search(query, LOCAL_SEARCH_LIMIT))}
+    tracks.sort(key=lambda t: local.get(str(t.id), len(local)))
+
+
+def show_search_results(search: Search, search_count: int, show_id: bool, fmt: TrackFormat) -> None:
     print('Search results for',
           f'"{search.text}"' if not search.misspell_corrected
           else f'"{search.misspell_original}"=>"{search.misspell_result}"')
@@ -319,6 +581,12 @@ def getSearchTracks(client: Client, playlist_name: str, search_type: str, search
         print(f'{cat.type}s: {cat.total} match(es)')
         cat_type = cat.type.replace('_', '-')
         for (i, r) in enumerate(cat.results, 1):                                           # TODO: maybe Protocol?
+            if isinstance(r, Track) and not fmt.notes:  # --format given, the search line below otherwise
+                show_playing_track(i, cat.total, r, fmt)
+                if i >= search_count:
+                    break
+                continue
+
             if isinstance(r, Artist):
                 w = 18 if show_id else 8
                 print(f'{i}. {r.id:<{w}} {r.name}', end='')
@@ -359,23 +627,9 @@ def getSearchTracks(client: Client, playlist_name: str, search_type: str, search
             if i >= search_count:
                 break
 
-    if search.best:  # 'all'
-        res = search.best.result
-        restype = search.best.type
-        print(f'Best match: [{restype}]')
-    else:
-        searchres: SearchResult
-        if search_type == 'all'\
-            or (searchres := search[search_type + 's']) is None\
-            or len(searchres.results) == 0:
-            print(f'Nothing found for "{search.text}", type={search.type_}')
-            show_attributes(search)
-            sys.exit(1)
-
-        restype = searchres.type
-        res = searchres.results[search_x - 1]
-        print(f'Selecting {search_x} [{restype}]')
 
+def getSearchResultTracks(client: Client, res: YandexMusicObject, restype: str, show_id: bool
+                         ) -> tuple[int, Union[list[Track], list[TrackShort]]]:
     if restype == 'artist':
         # artists artists_tracks artists_direct_albums
         artist = cast(Artist, res)
@@ -464,6 +718,98 @@ def getSearchTracks(client: Client, playlist_name: str, search_type: str, search
     return total_tracks, tracks
 
 
+def getIdTracks(client: Client, store: 'LocalStore', id_list: str, jobs: int) -> tuple[int, TrackList]:
+    # prefixes: none or t - track, b - album, p - playlist ([owner:]kind), a - artist, u - user likes
+    ids = [id for id in id_list.split(',') if len(id)]
+    items = list[tuple[str, str]]()
+    for id in ids:
+        prefix = id[0]
+        if prefix.isdigit():
+            items.append(('t', id))
+            continue
+        if prefix not in 'tbpau':
+            raise Exception('Unknown prefix ' + prefix)
+        items.append((prefix, id[1:]))
+
+    def get_tracks(track_ids: list[str]) -> dict[str, Track]:
+        return {str(t.id): t for t in client.tracks(track_ids)}
+
+    def get_album(album_id: str) -> list[Track]:
+        album = client.albums_with_tracks(album_id)
+        assert album and album.volumes
+        return flatten(album.volumes)
+
+    def get_playlists(ownerid: Optional[str], kinds: list[str]) -> dict[str, Playlist]:
+        if len(kinds) > 1:
+            playlists = cast(list[Playlist], client.users_playlists(kinds, ownerid))
+        else:
+            playlists = [cast(Playlist, client.users_playlists(kinds[0], ownerid))]
+        return {str(pl.kind): pl for pl in playlists}
+
+    def get_playlist_tracks(playlist: Playlist) -> list[TrackShort]:
+        return playlist.tracks or playlist.fetch_tracks()
+
+    def get_artist(artist_id: str) -> list[Track]:
+        tracks = list[Track]()
+        page = 0
+        while True:
+            artist_tracks = client.artists_tracks(artist_id, page, ARTIST_TRACKS_PAGE_SIZE)
+            assert artist_tracks
+            tracks.extend(artist_tracks.tracks)
+            page += 1
+            if not artist_tracks.tracks or page * ARTIST_TRACKS_PAGE_SIZE >= artist_tracks.pager.total:
+                return tracks
+
+    def get_user_likes(user_id: str) -> list[TrackShort]:
+        likes = client.users_likes_tracks(user_id)
+        assert likes
+        return likes.tracks
+
+    track_ids = list(dict.fromkeys(id.split(':')[0] for p, id in items if p == 't'))
+    playlist_kinds = dict[Optional[str], list[str]]()
+    for p, id in items:
+        if p == 'p':
+            ownerid, kind = id.split(':', 1) if ':' in id else (None, id)
+            playlist_kinds.setdefault(ownerid, []).append(kind)
+
+    # independent requests run concurrently, then results are put back in argument order
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        tracks_futures = [executor.submit(get_tracks, track_ids[i:i + TRACKS_CHUNK_SIZE])
+                          for i in range(0, len(track_ids), TRACKS_CHUNK_SIZE)]
+        playlist_futures = {ownerid: executor.submit(get_playlists, ownerid, kinds)
+                            for ownerid, kinds in playlist_kinds.items()}
+        getters = {'b': get_album, 'a': get_artist, 'u': get_user_likes}
+        futures = {(p, id): executor.submit(getters[p], id)
+                   for p, id in dict.fromkeys(items) if p in getters}
+        # one request per owner for the playlists, then tracks of every playlist concurrently
+        playlist_tracks = {(ownerid, kind): executor.submit(get_playlist_tracks, pl)
+                           for ownerid, f in playlist_futures.items() for kind, pl in f.result().items()}
+
+        tracks_by_id = dict[str, Track]()
+        for f in tracks_futures:
+            tracks_by_id.update(f.result())
+
+        tracks = TrackList(client, store=store)
+        for p, id in items:
+            if p == 't':
+                track = tracks_by_id.get(id.split(':')[0])
+                if track is None:
+                    print('track not found:', id)
+                    continue
+                tracks.append(track)
+            elif p == 'p':
+                ownerid, kind = id.split(':', 1) if ':' in id else (None, id)
+                tracks_future = playlist_tracks.get((ownerid, kind))
+                if tracks_future is None:
+                    print('playlist not found:', id)
+                    continue
+                tracks.extend(tracks_future.result())
+            else:
+                tracks.extend(futures[p, id].result())
+
+    return len(tracks), tracks
+
+
 def getAlbumTracks(album: Album) -> tuple[int, list[Track]]:
     if not album.volumes:
         album = album.with_tracks()  # type: ignore
@@ -497,44 +843,36 @@ def show_album(volumes: list[list[Track]]) -> None:
                 duration_str(track.duration_ms))
 
 
-def getAutoTracks(client: Client, playlist_name: str, playlist_type: str) -> tuple[int, list[TrackShort]]:
-    id = None
-    if playlist_type == 'personal-playlists':
-        # well-known names
-        if playlist_name == 'playlistOfTheDay':
-            id = '503646255:26954868'
-        elif playlist_name == 'origin':
-            id = '940441070:17870614'
-        elif playlist_name == 'neverHeard':
-            id = '692528232:114169885'
-        elif playlist_name == 'recentTracks':
-            id = '692529388:111791060'
-        elif playlist_name == 'missedLikes':
-            id = '460141773:108134812'
-        elif playlist_name == 'kinopoisk':
-            id = '1087766963:2441326'
-
+def getAutoTracks(client: Client, playlist_name: str, playlist_type: str, cache_folder: Path, store: 'LocalStore',
+                  executor: ThreadPoolExecutor) -> tuple[int, TrackList]:
+    id = WELL_KNOWN_PLAYLISTS.get(playlist_name) if playlist_type == 'personal-playlists' else None
     if id is not None:
-        playlist = client.playlists_list(id)[0]
+        playlist = client.playlists_list([id])[0]  # no tracks, only revision check
+        tracks = fetch_playlist_tracks(client, store, playlist)
     else:
-        playlist = show_and_search_auto_blocks(client, playlist_name, playlist_type)
+        playlist, tracks_future = show_and_search_auto_blocks(client, playlist_name, playlist_type,
+                                                              cache_folder, store, executor)
+        tracks = tracks_future.result()
 
-    tracks = playlist.tracks or playlist.fetch_tracks()
     total_tracks = playlist.track_count or len(tracks)
     show_playing_playlist(playlist, total_tracks)
 
-    return total_tracks, tracks
+    return total_tracks, TrackList(client, tracks, store)
 
 
-def show_and_search_auto_blocks(client: Client, playlist_name: str, playlist_type: str) -> Playlist:
+def show_and_search_auto_blocks(client: Client, playlist_name: str, playlist_type: str, cache_folder: Path,
+                                store: 'LocalStore', executor: ThreadPoolExecutor
+                                ) -> tuple[Playlist, 'Future[list[TrackShort]]']:
     # new-releases: list[Album]
     # new-playlists: list[Playlist]
     # personal-playlists: list[GeneratedPlaylist]
     # 'personal-playlists, new-releases, new-playlists'
-    landings = client.landing(playlist_type)
+    landings = cached_response(cache_folder, f'landing_{playlist_type}', lambda: client.landing(playlist_type),
+                               lambda data: Landing.de_json(data, client))
     # landings = client.landing('personal-playlists')  # same as 'personalplaylists'
     assert landings
     playlist: Optional[Playlist] = None
+    tracks_future: Optional[Future[list[TrackShort]]] = None
     playlist_name_icase = playlist_name.casefold()
     print(f'Blocks: ({playlist_type})')
     for block in landings.blocks:
@@ -622,12 +960,67 @@ def show_and_search_auto_blocks(client: Client, playlist_name: str, playlist_typ
             if (genPl and genPl.type == playlist_name) or pl.id_for_from == playlist_name \
                     or (pl.title and playlist_name_icase in pl.title.casefold()):
                 playlist = pl
+                tracks_future = executor.submit(fetch_playlist_tracks, client, store, pl)
+            elif genPl:  # likely choice next time, resolve in background
+                executor.submit(fetch_playlist_tracks, client, store, pl)
 
-    if playlist is None:
+    if playlist is None or tracks_future is None:
         print(f'auto playlist "{playlist_name}" not found')
         sys.exit(1)
 
-    return playlist
+    return playlist, tracks_future
+
+
+def fetch_playlist_tracks(client: Client, store: 'LocalStore', playlist: Playlist) -> list[TrackShort]:
+    """Tracks of the playlist, fetched only if its revision is not in the local store.
+
+    Playlists without uid or revision (some landing and generated ones) are fetched and not cached.
+    """
+    if playlist.uid is None or playlist.revision is None:
+        return playlist.tracks or playlist.fetch_tracks()
+    stored = store.get_playlist_tracks(playlist.uid, playlist.kind, playlist.revision)
+    if stored is not None:
+        return [TrackShort(id, timestamp, album_id, client=client) for id, album_id, timestamp in stored]
+
+    tracks = playlist.tracks or playlist.fetch_tracks()
+    store.put_playlist_tracks(playlist.uid, playlist.kind, playlist.revision,
+                              [(str(t.id), t.album_id, t.timestamp) for t in tracks])
+    full_tracks = [t.track for t in tracks if t.track]  # they come with the list, keep for hydration
+    if full_tracks:
+        store.put_tracks([(str(t.id), t.to_dict()) for t in full_tracks])
+    return tracks
+
+
+def load_cached_response(cache_folder: Path, name: str, ttl: int = RESPONSE_CACHE_TTL) -> Any:
+    path = cache_folder / 'responses' / f'{name}.json'
+    try:
+        entry = json.loads(path.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+    if time() - entry['ts'] >= ttl:
+        path.unlink(True)
+        return None
+    return entry['data']
+
+
+def save_cached_response(cache_folder: Path, name: str, data: Any) -> None:
+    path = cache_folder / 'responses' / f'{name}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps({'ts': time(), 'data': data}, ensure_ascii=False, separators=(',', ':')),
+                   encoding='utf-8')
+    tmp.replace(path)
+
+
+def cached_response(cache_folder: Path, name: str, fetch: Callable[[], Optional[T]],
+                    de_json: Callable[[Any], Optional[T]], ttl: int = RESPONSE_CACHE_TTL) -> Optional[T]:
+    data = load_cached_response(cache_folder, name, ttl)
+    if data is not None:
+        return de_json(data)
+    res = fetch()
+    if res is not None:
+        save_cached_response(cache_folder, name, cast(YandexMusicObject, res).to_dict())
+    return res
 
 
 def show_playing_playlist(playlist: Playlist, total_tracks: int) -> None:
@@ -650,20 +1043,8 @@ def plural(count: int) -> str:
     return 's' if count != 1 else ''
 
 
-def duration_str(duration_ms: Optional[int]) -> str:
-    if duration_ms:
-        sec = duration_ms // 1000
-        min = sec // 60
-        if min > 60:
-            return f'{min // 60}:{min % 60:02}:{sec % 60:02}'
-        else:
-            return f'{min}:{sec % 60:02}'
-    else:
-        return '-:--'
-
-
-def getPlaylistTracks(client: Client, playlist_name: str) -> tuple[int, list[TrackShort]]:
-    user_playlists = client.users_playlists_list()
+def getPlaylistTracks(client: Client, store: 'LocalStore', playlist_name: str) -> tuple[int, TrackList]:
+    user_playlists = client.users_playlists_list()  # revisions, without tracks
 
     playlist = next((p for p in user_playlists if p.title == playlist_name), None) if playlist_name else None
     if playlist is None:
@@ -674,24 +1055,55 @@ def getPlaylistTracks(client: Client, playlist_name: str) -> tuple[int, list[Tra
         print(' Available:', [p.title for p in user_playlists])
         sys.exit(1)
 
-    tracks = playlist.tracks or playlist.fetch_tracks()
+    tracks = fetch_playlist_tracks(client, store, playlist)
     total_tracks = playlist.track_count or len(tracks)
     show_playing_playlist(playlist, total_tracks)
 
-    return total_tracks, tracks
+    return total_tracks, TrackList(client, tracks, store)
 
 
-def show_alice_shot(client: Client, track: Union[TrackShort, Track]) -> None:
-    ev = client.after_track(track.track_id, '940441070:17870614')  # origin
+def fetch_alice_shot(client: Client, track_id: str) -> list[str]:
+    ev = client.after_track(track_id, WELL_KNOWN_PLAYLISTS['origin'])
     if not ev:
-        print('Can\'t fetch after_track')
-        return
+        return ['Can\'t fetch after_track']
+    lines = []
     for shot in ev.shots:
         d = shot.shot_data
         assert shot.order == 0 and shot.status == 'ready', ev  # just check
         assert d.shot_type.id == 'alice' and d.shot_type.title == 'Шот от Алисы', ev
         # d.mds_url
-        print(ev.event_id, d.shot_text)
+        lines.append(f'{ev.event_id} {d.shot_text}')
+    return lines
+
+
+def prefetch_alice_shots(client: Client, executor: ThreadPoolExecutor, shots: dict[str, 'Future[list[str]]'],
+                         tracks: TrackList, start: int) -> None:
+    """Requests shots for positions [start, start + ALICE_PREFETCH) that are not in `shots` yet"""
+    for n in range(start, min(start + ALICE_PREFETCH, len(tracks))):
+        track_id = tracks.track_id(n)
+        if track_id not in shots:
+            shots[track_id] = executor.submit(fetch_alice_shot, client, track_id)
+
+
+def alice_shot_lines(shot: 'Union[Future[list[str]], asyncio.Future[list[str]]]', prefix: str = '') -> list[str]:
+    try:
+        lines = shot.result()
+    except Exception as e:
+        lines = [f'Can\'t fetch after_track: {type(e).__name__} {e}']
+    return [prefix + line for line in lines]
+
+
+def show_alice_shot(shot: 'asyncio.Future[list[str]]') -> None:
+    """Done callback on the event loop, so the shot is printed by the main thread between other output"""
+    print(''.join(f'{line}\n' for line in alice_shot_lines(shot)), end='', flush=True)
+
+
+def write_alice_shots(pending: 'deque[tuple[str, Future[list[str]]]]', out: LineWriter, wait: bool = False) -> None:
+    """Writes shots of listed lines in list order: the ones that have arrived, all of them with `wait`"""
+    while pending and (wait or pending[0][1].done()):
+        prefix, shot = pending.popleft()
+        for line in alice_shot_lines(shot, prefix):
+            out.line(line)
 
 
 def slugify(value: str) -> str:
@@ -774,9 +1186,11 @@ def get_cache_path_for_track(track: Track, cache_folder: Path) -> Path:
     return cache_folder / artist_dir / album_dir / filename
 
 
-def download_track(track: Track, cache_folder: Path, skip_long_path: bool) -> Optional[Path]:
+def download_track(track: Track, cache_folder: Path, skip_long_path: bool,
+                   downloader: 'DownloadGroup', store: Optional['LocalStore'] = None) -> Optional[Path]:
+    from preflight import MAX_PATH
     file_path = get_cache_path_for_track(track, cache_folder)
-    if skip_long_path and len(str(file_path)) >= 260:
+    if skip_long_path and len(str(file_path)) >= MAX_PATH:
         print('path is too long (MAX_PATH):', file_path)
         return None
     # vlc doesn't recognize \\?\ prefix :(
@@ -786,21 +1200,271 @@ def download_track(track: Track, cache_folder: Path, skip_long_path: bool) -> Op
     if file_path.exists():
         return file_path
 
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    print('Downloading...', end='', flush=True)  # flush before stderr in retry
-    file_path_tmp = file_path.parent / file_path.stem
-    err = retry(lambda: track.download(str(file_path_tmp)))
-    if err:
+    print('Downloading...', end='', flush=True)
+    from downloader import FOREGROUND
+    future = downloader.request(track, file_path, FOREGROUND)
+    if store:  # tagged after it was played, the player has it open now
+        watch_download(future, track, store, None)
+    if future.result() is None:
         print(f'Error while downloading track_id: {track.track_id}'
             + f' real_id: {track.real_id}' if track.id != track.real_id else '')
-        file_path_tmp.unlink(True)
         return None
 
-    file_path_tmp.rename(file_path)
     print('ok')
     return file_path
 
 
+def watch_download(future: 'Future[Optional[Path]]', track: Track, store: 'LocalStore',
+                   post_processor: Optional['PostProcessor']) -> None:
+    """Indexes the file in the store when the download is done, post-processes it if enabled"""
+    def done(f: 'Future[Optional[Path]]') -> None:
+        path = f.result()
+        if path is None:
+            return
+        if post_processor:
+            post_processor.submit(track, path)
+        else:
+            store.put_file(str(track.id), str(track.albums[0].id) if track.albums else None, path, False, None)
+    future.add_done_callback(done)
+
+
+def create_post_processor(args: argparse.Namespace, store: 'LocalStore') -> Optional['PostProcessor']:
+    if not (args.tags or args.save_covers):
+        return None
+    from postprocess import PostProcessor
+    return PostProcessor(store, args.tags, args.save_covers, args.jobs)
+
+
+def tier_cache(args: argparse.Namespace, store: 'LocalStore') -> None:
+    from stats import PlayStats
+    from tier import ColdStorage
+    play_stats = PlayStats(args.cache_folder)
+    try:
+        last_played = play_stats.last_played() if play_stats.log_path.exists() else {}
+    finally:
+        play_stats.close()
+    cold = ColdStorage(args.cache_folder, args.cold_folder)
+    files, before, after = cold.freeze(store, last_played, args.cold_days, args.tier_method, args.tier_bitrate,
+                                       args.jobs)
+    print(f'{files} cold track{plural(files)} moved to {cold.folder}: '
+          f'{before / 1024 / 1024:.1f} MiB -> {after / 1024 / 1024:.1f} MiB')
+
+
+def resolve_tracks(client: Client, store: 'LocalStore', track_ids: list[str]) -> list[Track]:
+    """Full tracks for `id[:album_id]` ids: from the local store, the rest from the API in batches"""
+    tracks = {id: cast(Track, Track.de_json(data, client))
+              for id, data in store.get_tracks([t.split(':')[0] for t in track_ids]).items()}
+    missing = [t for t in track_ids if t.split(':')[0] not in tracks]
+    for i in range(0, len(missing), TRACKS_CHUNK_SIZE):
+        fetched = client.tracks(missing[i:i + TRACKS_CHUNK_SIZE])
+        store.put_tracks([(str(t.id), t.to_dict()) for t in fetched])
+        tracks.update((str(t.id), t) for t in fetched)
+    return [tracks[id] for t in track_ids if (id := t.split(':')[0]) in tracks]
+
+
+def download_tracks(client: Client, store: 'LocalStore', track_ids: list[str], cache_folder: Path,
+                    downloader: 'DownloadScheduler', post_processor: Optional['PostProcessor'] = None) -> int:
+    """Downloads tracks missing in cache at background priority, returns number of failures"""
+    from downloader import BACKGROUND, DownloadGroup
+    from preflight import unavailable
+    paths = list[tuple[Track, Path]]()
+    for t in resolve_tracks(client, store, track_ids):
+        if reason := unavailable(t):  # no download attempts and retries for these
+            print(f'{t.track_id}: {reason}, skipped')
+        else:
+            paths.append((t, get_cache_path_for_track(t, cache_folder)))
+    missing = [(t, path) for t, path in paths if not path.exists()]
+    if not missing:
+        print(f'{len(paths)} track{plural(len(paths))} already cached')
+        return 0
+    print(f'Downloading {len(missing)} track{plural(len(missing))}, {len(paths) - len(missing)} already cached')
+    downloads = DownloadGroup(downloader)  # yields to playback sharing the scheduler
+    try:
+        futures = [downloads.request(t, path, BACKGROUND) for t, path in missing]
+        for (t, _), f in zip(missing, futures):
+            watch_download(f, t, store, post_processor)
+        failed = sum(f.result() is None for f in futures)
+    finally:
+        downloads.close()
+    print(f'{len(futures) - failed} downloaded, {failed} failed')
+    return failed
+
+
+def sync_playlists(client: Client, store: 'LocalStore', names: list[str], cache_folder: Path,
+                   downloader: 'DownloadScheduler', post_processor: Optional['PostProcessor'] = None) -> int:
+    """Downloads new tracks of well-known generated playlists, returns number of failures.
+
+    One request checks all revisions; track lists are fetched only for changed revisions.
+    """
+    ids = [WELL_KNOWN_PLAYLISTS[name] for name in names]
+    playlists = {f'{p.uid}:{p.kind}': p for p in client.playlists_list(ids)}
+    track_ids = dict[str, None]()  # ordered set
+    for name, id in zip(names, ids):
+        playlist = playlists.get(id)
+        if playlist is None:
+            print(f'{name}: not available')
+            continue
+        unchanged = playlist.uid is not None and playlist.revision is not None \
+            and store.get_playlist_tracks(playlist.uid, playlist.kind, playlist.revision) is not None
+        tracks = fetch_playlist_tracks(client, store, playlist)
+        print(f'{name}: revision {playlist.revision}{" (unchanged)" if unchanged else ""}, '
+              f'{len(tracks)} track{plural(len(tracks))}')
+        track_ids.update((t.track_id, None) for t in tracks)
+    return download_tracks(client, store, list(track_ids), cache_folder, downloader, post_processor)
+
+
+def export_sources(args: argparse.Namespace, store: 'LocalStore'
+                   ) -> list[tuple[str, str, list[tuple[str, Optional[str], str]]]]:
+    """file name, title, entries of each list to export, from backups and the local store"""
+    from backup import LIKES_TARGET, Backup
+    backup = Backup(args.cache_folder)
+    every = args.playlist_name == 'all'
+    names = backup.targets() + list(WELL_KNOWN_PLAYLISTS) if every else [args.playlist_name]
+    sources = []
+    for name in names:
+        if name in WELL_KNOWN_PLAYLISTS or ':' in name:
+            uid, kind = (WELL_KNOWN_PLAYLISTS.get(name) or name).split(':')
+            stored = store.get_playlist_tracks(int(uid), int(kind), None)
+            if stored is None:
+                if every:
+                    continue
+                print(f'{name}: not in the local store, play or sync it first')
+                sys.exit(1)
+            sources.append((slugify(name.replace(':', '_')), name, stored))
+            continue
+
+        snapshots = backup.store(name)
+        if not snapshots.revisions():
+            print(f'{name}: no backup, run backup first')
+            sys.exit(1)
+        state, meta = snapshots.state()
+        entries = [(id, album_id or None, timestamp) for id, (album_id, timestamp) in state.items()]
+        if name == LIKES_TARGET:
+            entries.sort(key=lambda e: e[2], reverse=True)  # newest first, same as users_likes_tracks
+            sources.append((name, 'Likes', entries))
+        else:
+            title = meta.get('title') or name
+            sources.append((slugify(f'{title}_{name}'), title, entries))
+    return sources
+
+
+def run_export(args: argparse.Namespace) -> None:
+    from export import export_tracks
+    from store import LocalStore
+    store = LocalStore(args.cache_folder)
+    try:
+        sources = export_sources(args, store)
+        if not sources:
+            print('Nothing to export')
+            sys.exit(1)
+        to_stdout = args.export_to == '-'
+        if to_stdout and len(sources) > 1:
+            print('--export-to - needs a single source')
+            sys.exit(1)
+        folder = Path(args.export_to) if args.export_to and len(sources) > 1 else args.cache_folder / 'export'
+        for file_name, title, entries in sources:
+            if to_stdout:
+                relative_to = Path.cwd() if args.export_relative else None
+                export_tracks(store, entries, args.export_format, sys.stdout, title, args.cache_folder,
+                              relative_to)
+                continue
+            path = Path(args.export_to) if args.export_to and len(sources) == 1 \
+                else folder / f'{file_name}.{args.export_format}'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + '.tmp')
+            try:
+                with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+                    written, missing = export_tracks(store, entries, args.export_format, f, title, args.cache_folder,
+                                                     path.parent.resolve() if args.export_relative else None)
+                tmp.replace(path)
+            finally:
+                tmp.unlink(True)
+            print(f'{title}: {written} track{plural(written)} to {path}'
+                  + (f', {missing} not cached' if missing else ''))
+    finally:
+        store.close()
+
+
+def run_faults(args: argparse.Namespace, downloader: 'DownloadScheduler') -> None:
+    from faultserver import SCENARIOS, FaultServer
+    names = args.scenario or (list(SCENARIOS) if args.playlist_name == 'bench' else ['mixed'])
+    for name in names:
+        if name not in SCENARIOS:
+            print('Unknown scenario:', name)
+            sys.exit(1)
+
+    if args.playlist_name == 'serve':
+        with FaultServer(SCENARIOS[names[0]], args.bench_tracks, port=args.fault_port) as server:
+            print(f'Serving {names[0]!r} faults, tracks {server.track_ids[0]}..{server.track_ids[-1]}. Use:')
+            print(f' --base-url {server.base_url} --ignore-ssl --token {"0" * 39} --no-save-token')
+            print(f' --webhook-url {server.base_url}/sink --lastfm-url {server.base_url}/2.0/ '
+                  '--lastfm-key k --lastfm-secret s --lastfm-session s')
+            try:
+                while True:
+                    sleep(3600)
+            except KeyboardInterrupt:
+                return
+    if args.playlist_name != 'bench':
+        print('Unknown faults action:', args.playlist_name)
+        sys.exit(1)
+
+    results = [bench_scenario(args, name, downloader) for name in names]
+    print()
+    for r in results:
+        print(r)
+
+
+def bench_scenario(args: argparse.Namespace, name: str, downloader: 'DownloadScheduler') -> 'BenchResult':
+    """Plays the fault server's tracks like `main_loop` does, without the player: fetch with `retry`, download"""
+    from collections import Counter
+    from tempfile import TemporaryDirectory
+    from downloader import DownloadGroup
+    from faultserver import SCENARIOS, BenchResult, FaultServer
+    from transport import Transport, TransportRequest
+    print(f'== {name}')
+    with FaultServer(SCENARIOS[name], args.bench_tracks) as server, TemporaryDirectory() as tmp:
+        transport = Transport(args.http_pool_size, args.connect_timeout, args.read_timeout, args.keep_alive,
+                              verify=False)
+        client = Client('0', fetch_account_status=False, base_url=server.base_url,
+                        request=TransportRequest(transport), report_new_fields=False)
+        downloads = DownloadGroup(downloader)
+        ok = 0
+        useful = 0
+        recover = list[float]()
+        start = monotonic()
+        try:
+            for track_id in server.track_ids:
+                t0 = monotonic()
+                tracks = retry(lambda: client.tracks([track_id]))
+                file_path = None
+                if not isinstance(tracks, Exception) and tracks:
+                    file_path = download_track(tracks[0], Path(tmp), False, downloads)
+                t1 = monotonic()
+                if file_path:
+                    ok += 1
+                    useful += file_path.stat().st_size
+                faulted = [t for t, _ in server.faults if t0 <= t <= t1]
+                if faulted and file_path:
+                    recover.append(t1 - faulted[0])
+        finally:
+            downloads.close()
+            transport.close()
+        return BenchResult(name, len(server.track_ids), ok, monotonic() - start, recover,
+                           server.cdn_bytes - useful, Counter(f for _, f in server.faults))
+
+
+def prefetch_track(track_or_short: Union[Track, TrackShort], cache_folder: Path, skip_long_path: bool,
+                   downloader: 'DownloadGroup', store: 'LocalStore',
+                   post_processor: Optional['PostProcessor']) -> None:
+    from downloader import NEXT
+    from preflight import MAX_PATH
+    track = track_or_short if isinstance(track_or_short, Track) \
+        else track_or_short.track or track_or_short.fetch_track()
+    file_path = get_cache_path_for_track(track, cache_folder)
+    if not (skip_long_path and len(str(file_path)) >= MAX_PATH) and not file_path.exists():
+        watch_download(downloader.request(track, file_path, NEXT), track, store, post_processor)
+
+
 # class MyProtocol(asyncio.SubprocessProtocol):
 #     def __init__(self, exit_future: asyncio.Future[bool]) -> None:
 #         self.exit_future = exit_future
@@ -811,36 +1475,59 @@ def download_track(track: Track, cache_folder: Path, skip_long_path: bool) -> Op
 
 
 class AsyncInput:
-    __slots__ = ('_loop', '_inp_future')
+    __slots__ = ('_loop', '_inp_future', '_stdin', '_eof')
     def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
         self._loop = loop
         self._inp_future = None
+        # daemon sessions replace sys.stdin with a per-thread proxy, but readline runs on executor threads
+        self._stdin = getattr(sys.stdin, 'local', sys.stdin)
+        if hasattr(self._stdin, 'attach_loop'):
+            self._stdin.attach_loop(loop)
+        self._eof = False
 
     def readline(self) -> asyncio.Future[str]:
         if not self._inp_future or self._inp_future.done():
-            self._inp_future = self._read_line_async()
+            if self._eof:  # nothing more to read, don't spin on ''
+                self._inp_future = self._loop.create_future()
+            else:
+                self._inp_future = self._read_line_async()
         return self._inp_future
 
     def _read_line_async(self) -> asyncio.Future[str]:
-        return self._loop.run_in_executor(None, sys.stdin.readline)  # TODO: daemon thread
+        def readline() -> str:
+            line = self._stdin.readline()
+            if not line:
+                self._eof = True
+            return line
+        return self._loop.run_in_executor(None, readline)  # TODO: daemon thread
+
 
+class PlayResult(NamedTuple):
+    track: Track
+    file_path: Path
+    played_seconds: int
+    skipped: bool
 
-async def play_track(i: int, total_tracks: int, track_or_short: Union[Track, TrackShort],
+
+async def play_track(i: int, total_tracks: int, track: Track,
                     cache_folder: Path, player_cmd: list[str], async_input: AsyncInput,
-                    show_id: bool, ignore_retcode: bool, skip_long_path: bool) -> Optional[Track]:
-    track = track_from_short(track_or_short)
-    show_playing_track(i, total_tracks, track, show_id)
+                    fmt: TrackFormat, ignore_retcode: bool, skip_long_path: bool,
+                    supplement: 'Future[Optional[Supplement]]', downloader: 'DownloadGroup',
+                    store: Optional['LocalStore'] = None) -> Optional[PlayResult]:
+    show_playing_track(i, total_tracks, track, fmt)
 
-    file_path = download_track(track, cache_folder, skip_long_path)
+    file_path = download_track(track, cache_folder, skip_long_path, downloader, store)
     if file_path is None:
         return None
 
     liked = False
+    skipped = False
     player_cmd[-1] = str(file_path)
 
     # exit_future = asyncio.Future(loop=loop)
     # proc, myprot = await loop.subprocess_exec(lambda: MyProtocol(exit_future), *player_cmd)
     proc = await asyncio.create_subprocess_exec(*player_cmd, stderr=asyncio.subprocess.DEVNULL)
+    started = monotonic()
     exit_future = asyncio.create_task(proc.wait())
     try:
         inp_future = async_input.readline()
@@ -856,6 +1543,7 @@ async def play_track(i: int, total_tracks: int, track_or_short: Union[Track, Tra
                 assert f == inp_future
                 inp = cast(str, f.result()).strip()
                 if inp == 's' or inp == 'skip':
+                    skipped = True
                     break
                 elif inp == 'i' or inp == 'id':
                     print('id', track.track_id)
@@ -875,7 +1563,12 @@ async def play_track(i: int, total_tracks: int, track_or_short: Union[Track, Tra
                             print('like error')
 
                 elif inp == 't' or inp == 'text':
-                    sup = track.get_supplement()
+                    try:
+                        sup = await asyncio.wrap_future(supplement)  # usually prefetched already
+                    except YandexMusicError as e:
+                        print('supplement error:', type(e).__name__, e)
+                        inp_future = async_input.readline()
+                        continue
                     if sup and sup.description:
                         print(sup.description)
                     if not sup or not sup.lyrics:
@@ -921,7 +1614,21 @@ async def play_track(i: int, total_tracks: int, track_or_short: Union[Track, Tra
             if rc:
                 raise Exception(f'Command {player_cmd} returned non-zero exit status {rc}.')
 
-    return track
+    return PlayResult(track, file_path, int(monotonic() - started), skipped)
+
+
+def fetch_supplement(client: Client, store: 'LocalStore', track_id: str) -> Optional[Supplement]:
+    data = store.get_supplement(track_id)
+    if data is not None:  # works offline
+        return Supplement.de_json(data, client) if data else None
+    try:
+        sup = client.track_supplement(track_id)
+    except YMNetworkError as e:
+        if not str(e).startswith('not-found'):
+            raise
+        sup = None
+    store.put_supplement(track_id, sup.to_dict() if sup else {})  # a miss is remembered too
+    return sup
 
 
 def track_from_short(track_or_short: Union[Track, TrackShort]) -> Track:
@@ -939,32 +1646,65 @@ def track_from_short(track_or_short: Union[Track, TrackShort]) -> Track:
     return track
 
 
-def show_playing_track(n: int, total_tracks: int, track: Track, show_id: bool) -> None:
+def track_format(args: argparse.Namespace) -> TrackFormat:
+    template = args.format or (DEFAULT_FORMAT_ID if args.show_id else DEFAULT_FORMAT)
+    try:
+        return TrackFormat(template, lambda track: cache_status(track, args.cache_folder, args.cold_folder),
+                           notes=not args.format)
+    except ValueError as e:
+        print('--format:', e)
+        sys.exit(1)
+
+
+def cache_status(track: Track, cache_folder: Path, cold_folder: Optional[Path]) -> str:
+    from tier import ColdStorage
+    path = get_cache_path_for_track(track, cache_folder)
+    return 'cached' if path.exists() else 'cold' if ColdStorage(cache_folder, cold_folder).has(path) else ''
+
+
+def show_playing_track(n: int, total_tracks: int, track: Track, fmt: TrackFormat,
+                       out: Optional[LineWriter] = None) -> None:
     # assert track.albums  # not available tracks doesn't have album: 4101273:4218688 Tilman Sillescu [] ~ No Escape
-    track_type = f'({track.type}) ' if track.type and track.type != 'music' and track.type != 'podcast-episode' else ''
-    track_id = f'{track.track_id:<18} ' if show_id else ''
-    print(f'{n:>2}/{total_tracks}:',
-          track_id + track_type +  # no space if omitted
-          '|'.join(track.artists_name()),
-          f"[{'|'.join((a.title or str(a.id)) if not a.version else f'{a.title} @ {a.version}' for a in track.albums)}]",
-          '~', track.title if not track.version else f'{track.title} @ {track.version}',
-          duration_str(track.duration_ms))
-    if track.short_description:
-        print(track.short_description)
+    write = out.line if out else print
+    write(fmt.render(n, total_tracks, track))
+    if fmt.notes and track.short_description:
+        write(track.short_description)
+
+
+def create_sinks(args: argparse.Namespace, client: Client) -> 'SinkHub':
+    """Needs a running event loop"""
+    from sinks import LASTFM_URL, LastFmSink, Sink, SinkHub, WebhookSink, YandexSink
+    from transport import Transport
+    lastfm = (args.lastfm_key, args.lastfm_secret, args.lastfm_session)
+    if any(lastfm) and not all(lastfm):
+        print('Last.fm needs --lastfm-key, --lastfm-secret and --lastfm-session')
+        sys.exit(1)
+    sinks = list[Sink]()
+    if args.send_status:
+        sinks.append(YandexSink(client, generate_play_id))
+    if args.webhook_url or all(lastfm):  # own connections, not shared with the API and downloads
+        transport = Transport(2, args.connect_timeout, args.read_timeout, args.keep_alive, verify=not args.ignore_ssl)
+        if args.webhook_url:
+            sinks.append(WebhookSink(args.webhook_url, transport))
+        if all(lastfm):
+            sinks.append(LastFmSink(args.lastfm_url or LASTFM_URL, *lastfm, transport))
+    return SinkHub(sinks, args.status_queue)
 
 
 def generate_play_id() -> str:
     return f"{int(random() * 1000)}-{int(random() * 1000)}-{int(random() * 1000)}"
 
 
-def main(args: argparse.Namespace) -> None:
-    if args.log_api:
-        import logging
-        logging.basicConfig(level=logging.DEBUG,
-                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
+def create_client(args: argparse.Namespace, online: bool = True) -> Client:
+    """online=False: no account requests, for modes that may run without network"""
+    from transport import Transport, TransportRequest
     Client.notice_displayed = True
-    client = Client.from_token(args.token, report_new_fields=args.report_new_fields)
+    transport = Transport(args.http_pool_size, args.connect_timeout, args.read_timeout, args.keep_alive,
+                          verify=not args.ignore_ssl)
+    client = Client.from_token(args.token, fetch_account_status=online, base_url=args.base_url,
+                               request=TransportRequest(transport), report_new_fields=args.report_new_fields)
+    if not online:
+        return client
 
     assert client.me and client.me.account
     acc = client.me.account
@@ -979,23 +1719,160 @@ def main(args: argparse.Namespace) -> None:
             print(a)
         print('==================')
 
-    if args.mode == 'playlist':
-        total_tracks, tracks = getPlaylistTracks(client, args.playlist_name)
+    return client
+
+
+def main(args: argparse.Namespace, client: Optional[Client] = None, executor: Optional[ThreadPoolExecutor] = None,
+         downloader: Optional['DownloadScheduler'] = None) -> None:
+    if args.log_api:
+        import logging
+        logging.basicConfig(level=logging.DEBUG,
+                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.mode == 'backup' and args.playlist_name != 'create':
+        from backup import Backup
+        backup = Backup(args.cache_folder)
+        if args.playlist_name == 'list':
+            backup.show_list()
+            return
+        elif args.playlist_name == 'diff':
+            # single revision: diff with the previous one
+            rev_from, rev_to = (None, args.revision[0]) if len(args.revision) == 1 \
+                else (args.revision + [None, None])[:2]
+            backup.diff(args.backup_target, rev_from, rev_to)
+            return
+        elif args.playlist_name == 'restore' and args.export_list:  # fully local
+            tracks = backup.restore(args.backup_target, args.revision[0] if args.revision else None, None)
+            print(','.join(t.track_id for t in tracks))
+            return
+        elif args.playlist_name != 'restore':
+            print('Unknown backup action:', args.playlist_name)
+            sys.exit(1)
+
+    if args.mode == 'stats' and args.playlist_name != 'push' \
+            and (args.playlist_name != 'never-played' or (args.cache_folder / 'backup' / 'likes').exists()):
+        show_stats(args)
+        return
+
+    if executor is not None and downloader is not None:  # daemon session: the daemon owns them
+        run_mode(args, client, executor, downloader)
+        return
+    from downloader import DownloadScheduler
+    from tier import ColdStorage
+    executor = ThreadPoolExecutor(max(1, args.jobs), thread_name_prefix='prefetch')
+    downloader = DownloadScheduler(args.max_bandwidth, ColdStorage(args.cache_folder, args.cold_folder).restore)
+    try:
+        run_mode(args, client, executor, downloader)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)  # exit doesn't wait for queued background prefetches
+        downloader.shutdown()
+
+
+def run_mode(args: argparse.Namespace, client: Optional[Client], executor: ThreadPoolExecutor,
+             downloader: 'DownloadScheduler') -> None:
+    """Everything that may go online. One executor and one download scheduler per process"""
+    if args.mode == 'cache':
+        from cachecheck import verify_cache
+        from store import LocalStore
+        if args.playlist_name not in ('verify', 'tier'):
+            print('Unknown cache action:', args.playlist_name)
+            sys.exit(1)
+        store = LocalStore(args.cache_folder)
+        try:
+            if args.playlist_name == 'tier':
+                tier_cache(args, store)
+                return
+            broken = [b.track_id for b in verify_cache(args.cache_folder, store, args.jobs) if b.track_id]
+            if broken:
+                post_processor = create_post_processor(args, store)
+                try:
+                    download_tracks(client or create_client(args), store, broken, args.cache_folder, downloader,
+                                    post_processor)
+                finally:
+                    if post_processor:
+                        post_processor.shutdown()
+        finally:
+            store.close()
+        return
+
+    if args.mode == 'faults':
+        run_faults(args, downloader)
+        return
+
+    if args.mode == 'export':
+        run_export(args)
+        return
+
+    if client is None:
+        client = create_client(args, online=not (args.mode == 'search' and args.local))
+
+    if args.mode == 'sync':
+        from store import LocalStore
+        names = args.playlist_name.split(',') if args.playlist_name else list(SYNC_PLAYLISTS)
+        for name in names:
+            if name not in WELL_KNOWN_PLAYLISTS:
+                print('Unknown playlist:', name, 'known:', ', '.join(WELL_KNOWN_PLAYLISTS))
+                sys.exit(1)
+        store = LocalStore(args.cache_folder)
+        post_processor = create_post_processor(args, store)
+        try:
+            failed = sync_playlists(client, store, names, args.cache_folder, downloader, post_processor)
+        finally:
+            if post_processor:
+                post_processor.shutdown()
+            store.close()
+        if failed:
+            sys.exit(1)  # let cron report it
+        return
+
+    if args.mode == 'daemon':
+        from daemon import serve
+        warm_client, warm_executor, warm_downloader = client, executor, downloader
+        serve(args.cache_folder, lambda argv: handle_args(argv, load_token=False),
+              lambda session_args: main(session_args, warm_client, warm_executor, warm_downloader))
+        return
+
+    from store import LocalStore
+    store = LocalStore(args.cache_folder)
+    try:
+        play_mode(args, client, executor, downloader, store)
+    finally:
+        store.close()
+
+
+def play_mode(args: argparse.Namespace, client: Client, executor: ThreadPoolExecutor,
+              downloader: 'DownloadScheduler', store: 'LocalStore') -> None:
+    """Builds the track list of the mode, then lists, exports or plays it"""
+    from session import Session
+    source = session_source(args)
+    resumed = Session.load(args.cache_folder, source) if args.resume else None
+    resumed_ids = resumed.load_track_ids() if resumed else None
+    queue_pos = resumed.queue if resumed else None
+
+    if resumed and resumed_ids is not None:  # no need to fetch the list again
+        tracks = TrackList.from_track_ids(client, resumed_ids)
+        total_tracks = resumed.total or len(tracks)
+        print(f'Restored {len(tracks)} track{plural(len(tracks))} of last session')
+
+    elif args.mode == 'playlist':
+        total_tracks, tracks = getPlaylistTracks(client, store, args.playlist_name)
 
     elif args.mode == 'likes':
         tracks_list = client.users_likes_tracks()  # TODO: if_modified_since_revision tracks_list.revision
         assert tracks_list
-        tracks = tracks_list.tracks
+        tracks = TrackList(client, tracks_list.tracks)
+        del tracks_list
         total_tracks = len(tracks)
         print(f'Playing liked tracks. {total_tracks} track{plural(total_tracks)}.')
 
     elif args.mode == 'search':
         total_tracks, tracks = getSearchTracks(
-            client, args.playlist_name, args.search_type, args.search_x, args.search_no_correct,
-            args.search_count, args.show_id)
+            client, store, args.playlist_name, args.search_type, args.search_x, args.search_no_correct,
+            args.search_count, args.show_id, args.cache_folder, args.local, track_format(args))
 
     elif args.mode == 'auto':
-        total_tracks, tracks = getAutoTracks(client, args.playlist_name, args.auto_type)
+        total_tracks, tracks = getAutoTracks(client, args.playlist_name, args.auto_type, args.cache_folder, store,
+                                             executor)
 
     elif args.mode == 'radio':
         if args.playlist_name is None or args.playlist_name == 'd' or args.playlist_name == 'dashboard':
@@ -1014,88 +1891,221 @@ def main(args: argparse.Namespace) -> None:
         sys.exit(3)
 
     elif args.mode == 'queue':
-        total_tracks, tracks = getTracksFromQueue(client)
+        total_tracks, tracks, queue_pos = getTracksFromQueue(client, args.playlist_name)
 
     elif args.mode == 'feed':
-        total_tracks, tracks = getTracksFromFeed(client)
+        total_tracks, tracks = getTracksFromFeed(client, args.playlist_name, args.cache_folder, store, executor)
+
+    elif args.mode == 'backup':
+        from backup import Backup
+        backup = Backup(args.cache_folder)
+        if args.playlist_name == 'create':
+            backup.create(client, args.jobs)
+            return
+        tracks = TrackList(client, backup.restore(args.backup_target, args.revision[0] if args.revision else None,
+                                                  client))
+        total_tracks = len(tracks)
+
+    elif args.mode == 'stats':
+        from stats import PlayStats
+        play_stats = PlayStats(args.cache_folder)
+        try:
+            if args.playlist_name == 'push':
+                print(f'pushed {play_stats.push(client, generate_play_id)} play(s)')
+            else:  # never-played without local likes backup
+                likes = client.users_likes_tracks()
+                assert likes
+                show_never_played(play_stats, [t.track_id for t in likes.tracks])
+        finally:
+            play_stats.close()
+        return
 
     elif args.mode == 'id':
         if not args.playlist_name:
             print('Specify comma (",") separated track id list')
             sys.exit(1)
-        ids = [id for id in args.playlist_name.split(',') if len(id)]  # type: list[str]
-
-        d = { 't': list[str](), 'b': list[str](), 'p': list[str]() }
-
-        for id in ids:
-            prefix = id[0]
-            if prefix.isdigit():
-                d['t'].append(id)
-                continue
-            if prefix not in d:
-                raise Exception('Unknown prefix ' + prefix)
-            d[prefix].append(id[1:])
-
-        tracks = list[Union[Track, TrackShort]]()
-        total_tracks = 0
-
-        tracks_ids = d['t']
-        if tracks_ids:
-            tracks.extend(client.tracks(tracks_ids))  # type: ignore
-            total_tracks += len(tracks)
-
-        albums_ids = d['b']
-        if albums_ids:
-            for id in albums_ids:
-                album = client.albums_with_tracks(id)
-                assert album and album.volumes
-                album_tracks = flatten(album.volumes)
-                tracks.extend(album_tracks)
-                total_tracks += len(album_tracks)
-
-        playlist_ids = d['p']
-        if playlist_ids:
-            for id in playlist_ids:
-                if id.find(':'):
-                    ownerid, kind = id.split(':', 2)
-                else:
-                    ownerid, kind = None, id
-
-                playlist: Playlist = client.users_playlists(kind, ownerid)  # type: ignore
-                tracks.extend(playlist.tracks)
-                total_tracks += len(playlist.tracks)
+        total_tracks, tracks = getIdTracks(client, store, args.playlist_name, args.jobs)
 
     else:  # unreachable
         sys.exit(3)
 
+    if args.resume:
+        if resumed is None:
+            print('No session to resume, starting from the beginning')
+        else:
+            if resumed.length != len(tracks):
+                print(f'Warning: list has changed since last session ({resumed.length} -> {len(tracks)} tracks)')
+            if resumed.end and resumed.position >= resumed.end or resumed.position >= len(tracks):
+                print('Last session is finished')
+                return
+            args.shuffle, args.seed, args.reverse = resumed.seed is not None, resumed.seed, resumed.reverse
+            args.skip = resumed.position
+            if args.sync_queue and queue_pos and not args.shuffle and not args.reverse:
+                args.skip = sync_queue_position(client, queue_pos, args.skip)
+            args.count = resumed.end - args.skip if resumed.end else 0
+            args.show_skipped = False
+            print(f'Resuming from {args.skip + 1}/{len(tracks)}')
+
+    tracks.store = store  # listing hydrates through the store too
+    seed = None
     if args.shuffle:
-        from random import shuffle
-        shuffle(tracks)
+        seed = tracks.shuffle(args.seed)
+        print('Shuffle seed:', seed)
 
     if args.reverse:
         tracks.reverse()
 
     if args.export_list:
-        print(','.join(t.track_id for t in tracks))
+        print(tracks.export())
         return
 
     if args.batch_remove_like:
-        if client.users_likes_tracks_remove([t.track_id for t in tracks]):
+        if batch_likes(client, list(tracks.track_ids()), True,
+                       args.cache_folder, args.batch_chunk_size, args.jobs):
             print('removed likes')
         else:
             print('error users_likes_tracks_remove')
 
     if args.batch_like:
-        if client.users_likes_tracks_add([t.track_id for t in tracks]):
+        if batch_likes(client, list(tracks.track_ids()), False,
+                       args.cache_folder, args.batch_chunk_size, args.jobs):
             print('liked')
         else:
             print('error users_likes_tracks_add')
 
     if args.list or args.skip >= sys.maxsize:  # no need for async runtime
-        skip_all_loop(args, client, total_tracks, tracks, args.skip, args.count)
+        skip_all_loop(args, client, total_tracks, tracks, args.skip, args.count, executor)
         return
 
-    asyncio.run(async_main(args, client, total_tracks, tracks))
+    session = Session(args.cache_folder, source, seed, args.reverse, len(tracks), total_tracks, args.skip,
+                      args.skip + args.count if args.count else 0, resumed.played if resumed else None,
+                      queue_pos if not args.shuffle and not args.reverse else None)
+    if resumed_ids is None:
+        session.save_track_ids(tracks.stored_track_ids())
+    asyncio.run(async_main(args, client, total_tracks, tracks, store, executor, session, downloader))
+
+
+def session_source(args: argparse.Namespace) -> str:
+    type_ = args.auto_type if args.mode == 'auto' else args.search_type if args.mode == 'search' else ''
+    return json.dumps([args.mode, type_, args.playlist_name], ensure_ascii=False)
+
+
+def sync_queue_position(client: Client, queue_pos: tuple[str, int], position: int) -> int:
+    queue_id, offset = queue_pos
+    qi = next((qi for qi in client.queues_list() if qi.id == queue_id), None)
+    if qi is None:
+        print('Queue is gone on server, not syncing')
+        return position
+    queue = qi.fetch_queue()
+    assert queue
+    server_position = queue.current_index - offset
+    if server_position > position:  # played further on another device
+        print(f'Server queue is ahead by {server_position - position} track{plural(server_position - position)}')
+        return server_position
+    return position
+
+
+def batch_likes(client: Client, track_ids: list[str], remove: bool,
+                cache_folder: Path, chunk_size: int, jobs: int) -> bool:
+    op = 'remove' if remove else 'add'
+    checkpoint_path = cache_folder / BATCH_LIKES_CHECKPOINT
+    # over the id set: a reshuffled or reversed list resumes the same batch
+    digest = hashlib.sha1(f'{op}:{",".join(sorted(set(track_ids)))}'.encode()).hexdigest()
+
+    pending: Optional[list[str]] = None
+    try:
+        checkpoint = json.loads(checkpoint_path.read_text())
+        if checkpoint['digest'] == digest:
+            pending = cast(list[str], checkpoint['pending'])
+            print(f'Resuming batch {op}: {len(pending)} track{plural(len(pending))} left')
+    except (FileNotFoundError, JSONDecodeError, KeyError):
+        pass
+
+    if pending is None:
+        # diff against current likes, so only changes are sent
+        likes = client.users_likes_tracks()
+        assert likes
+        liked = {str(t.id) for t in likes.tracks}
+        seen = set[str]()
+        pending = []
+        for track_id in track_ids:
+            id = track_id.split(':')[0]
+            if id in seen or (id in liked) != remove:
+                continue
+            seen.add(id)
+            pending.append(track_id)
+        skipped = len(track_ids) - len(pending)
+        if skipped:
+            print(f'{skipped} track{plural(skipped)} skipped (duplicate or already {"not liked" if remove else "liked"})')
+
+    if not pending:
+        checkpoint_path.unlink(True)
+        return True
+
+    func = client.users_likes_tracks_remove if remove else client.users_likes_tracks_add
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    left = set(pending)
+    lock = Lock()
+
+    def save_checkpoint() -> None:
+        cache_folder.mkdir(parents=True, exist_ok=True)
+        tmp = checkpoint_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'digest': digest, 'pending': [id for id in pending if id in left]}))
+        tmp.replace(checkpoint_path)
+
+    def send(chunk: list[str]) -> bool:
+        res = retry(lambda: func(chunk))
+        if res is not True:
+            return False
+        with lock:
+            left.difference_update(chunk)
+            save_checkpoint()
+            print(f'{op} {len(pending) - len(left)}/{len(pending)}')
+        return True
+
+    with lock:
+        save_checkpoint()
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        ok = all(list(executor.map(send, chunks)))
+
+    if ok:
+        checkpoint_path.unlink(True)
+    return ok
+
+
+def show_stats(args: argparse.Namespace) -> None:
+    from stats import PlayStats
+    play_stats = PlayStats(args.cache_folder)
+    try:
+        query = args.playlist_name
+        if query == 'top':
+            rows = play_stats.top(args.year, args.top)
+            print(f'Top {len(rows)} track{plural(len(rows))} {args.year or "of all time"}:')
+            for i, (track_id, artists, title, plays, seconds) in enumerate(rows, 1):
+                id = f'{track_id:<10} ' if args.show_id else ''
+                print(f'{i:>3}. {id}{plays:>4}x {duration_str(seconds * 1000):>8} {artists} ~ {title}')
+
+        elif query == 'skips':
+            for artist_id, name, plays, skips in play_stats.skip_rates(args.top):
+                id = f'{artist_id:<10} ' if args.show_id else ''
+                print(f'{skips * 100 // plays:>3}% {id}{name} ({skips}/{plays})')
+
+        elif query == 'never-played':
+            from backup import Backup, LIKES_TARGET
+            likes = Backup(args.cache_folder).restore(LIKES_TARGET, None, None)
+            show_never_played(play_stats, [t.track_id for t in likes])
+
+        else:
+            print('Unknown stats query:', query)
+            sys.exit(1)
+    finally:
+        play_stats.close()
+
+
+def show_never_played(play_stats: 'PlayStats', track_ids: list[str]) -> None:
+    never = play_stats.never_played(track_ids)
+    print(f'{len(never)} of {len(track_ids)} liked track{plural(len(track_ids))} never played')
+    print(','.join(never))
 
 
 def show_station_result(sr: 'StationResult'):
@@ -1120,62 +2130,142 @@ def show_station_result(sr: 'StationResult'):
 
 
 async def async_main(args: argparse.Namespace, client: Client,
-                     total_tracks: int, tracks: Union[list[TrackShort], list[Track], list[Union[Track, TrackShort]]]
-                    ) -> None:
+                     total_tracks: int, tracks: TrackList,
+                     store: 'LocalStore', executor: ThreadPoolExecutor, session: 'Session',
+                     downloader: 'DownloadScheduler') -> None:
+    from downloader import DownloadGroup
     my_input = AsyncInput(asyncio.get_event_loop())
+    downloads = DownloadGroup(downloader)
+    post_processor = create_post_processor(args, store)
+    hub = create_sinks(args, client)
+    supplements: dict[int, Future[Optional[Supplement]]] = {}
+    play_stats = None
+    if args.stats:
+        from stats import PlayStats
+        play_stats = PlayStats(args.cache_folder)
     try:
-        return await main_loop(args, client, total_tracks, tracks, my_input)
+        return await main_loop(args, client, total_tracks, tracks, my_input, store, executor, session,
+                               downloads, hub, supplements, post_processor, play_stats)
     except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
         print('Goodbye.')
     except BaseException as e:
         handle_exception(e)
+    finally:
+        await hub.close()  # queued events get a few seconds
+        for f in supplements.values():
+            f.cancel()
+        wait(supplements.values())  # running ones write to the store
+        downloads.close()
+        if post_processor:
+            post_processor.shutdown()  # let pending tags finish
+        if play_stats:
+            play_stats.close()
 
 
 async def main_loop(args: argparse.Namespace, client: Client,
-                    total_tracks: int, tracks: Union[list[TrackShort], list[Track], list[Union[Track, TrackShort]]],
-                    async_input: AsyncInput) -> None:
-    for (i, track_or_short) in enumerate(tracks, 1):
+                    total_tracks: int, tracks: TrackList,
+                    async_input: AsyncInput, store: 'LocalStore', executor: ThreadPoolExecutor, session: 'Session',
+                    downloader: 'DownloadGroup', hub: 'SinkHub',
+                    supplements: dict[int, 'Future[Optional[Supplement]]'],
+                    post_processor: Optional['PostProcessor'] = None,
+                    play_stats: Optional['PlayStats'] = None) -> None:
+    from sinks import NOW_PLAYING, PLAYED, PlayEvent
+    source = f'{args.mode}:{args.playlist_name}' if args.playlist_name else args.mode
+    shots: dict[str, Future[list[str]]] = {}
+    played = set(session.played)
+    fmt = track_format(args)
+    blocked = set[str]()  # by pre-flight
+    checked = 0
+
+    for i in range(1 if args.show_skipped else args.skip + 1, len(tracks) + 1):
+        if args.count and args.skip + args.count < i:  # before the checks below, they skip positions
+            break
+
+        if args.skip < i and played and tracks.track_id(i - 1) in played:  # resumed, already played
+            session.save(i)
+            continue
+
+        if args.preflight > 0 and args.skip < i and checked < i:
+            from preflight import check_tracks
+            checked = min(len(tracks), i - 1 + min(args.preflight, HYDRATE_CACHE_SIZE))  # checked ones stay cached
+            result = check_tracks(tracks, i - 1, checked, lambda t: get_cache_path_for_track(t, args.cache_folder),
+                                  args.skip_long_path)
+            if result.problems:
+                print(result)
+            blocked |= result.blocked
+        if tracks.track_id(i - 1) in blocked:
+            session.save(i)
+            continue
+
+        track_or_short = tracks[i - 1]  # fetches metadata of the next batch when needed
         if args.skip >= i:
-            if args.show_skipped:
-                track = track_from_short(track_or_short)
-                show_playing_track(i, total_tracks, track, args.show_id)
+            track = track_from_short(track_or_short)
+            show_playing_track(i, total_tracks, track, fmt)
             continue
 
         if args.alice:
-            show_alice_shot(client, track_or_short)
+            prefetch_alice_shots(client, executor, shots, tracks, i - 1)
+            asyncio.wrap_future(shots[tracks.track_id(i - 1)]).add_done_callback(show_alice_shot)
 
-        track = await play_track(i, total_tracks, track_or_short,
+        session.save(i - 1)  # interrupted track is played again on resume
+        if args.sync_queue and session.queue:
+            executor.submit(client.queue_update_position, session.queue[0], session.queue[1] + i - 1)
+
+        for n in range(i, min(i + SUPPLEMENT_PREFETCH, len(tracks) + 1)):
+            if n not in supplements and tracks.track_id(n - 1) not in blocked:
+                supplements[n] = executor.submit(fetch_supplement, client, store, tracks.id(n - 1))
+
+        for n in range(i + 1, min(i + 1 + args.prefetch, len(tracks) + 1)):
+            if tracks.track_id(n - 1) in blocked:  # never plays, no download and retries for it
+                continue
+            # the next one may be opened by the player any moment, it is tagged after it was played
+            executor.submit(prefetch_track, tracks[n - 1], args.cache_folder, args.skip_long_path, downloader,
+                            store, post_processor if n > i + 1 else None)
+
+        track = track_from_short(track_or_short)
+        started = time()
+        hub.publish(PlayEvent(NOW_PLAYING, track, started, source=source))
+        res = await play_track(i, total_tracks, track,
               args.cache_folder, args.player_cmd, async_input,
-              args.show_id, args.ignore_retcode, args.skip_long_path)
-
-        if args.send_status and track:
-            now = f'{datetime.now().isoformat()}Z'
-            played_seconds = (track.duration_ms or 0) // 1000
-            ret = client.play_audio(track.id, "termYM", track.albums[0].id or 0 if track.albums else 0,
-                              track_length_seconds=played_seconds,
-                              end_position_seconds=played_seconds,
-                              total_played_seconds=played_seconds,
-                              #   playlist_id,
-                              play_id=generate_play_id(), timestamp=now, client_now=now)
-            assert ret
-
-        if args.count and args.skip + args.count <= i:
-            break
+              fmt, args.ignore_retcode, args.skip_long_path, supplements[i], downloader, store)
+        supplements.pop(i)  # kept until here, so exit can wait for it
+
+        if res:  # queued, a slow endpoint never delays the next track
+            reported = None
+            if play_stats:  # marked sent only once YandexSink delivers it, `stats push` sends the rest
+                offset = play_stats.record(res.track, res.played_seconds, source, res.skipped)
+                reported = partial(play_stats.mark_sent, offset)
+            hub.publish(PlayEvent(PLAYED, res.track, started, res.played_seconds, res.skipped, source, reported))
+
+        if post_processor and res:  # player has released the file; later prefetched ones are done already
+            post_processor.submit(res.track, res.file_path)
+
+        session.save(i, tracks.track_id(i - 1) if res else None)
 
 
 def skip_all_loop(args: argparse.Namespace, client: Client,
-                  total_tracks: int, tracks: Union[list[TrackShort], list[Track], list[Union[Track, TrackShort]]],
-                  skip: int, count: int) -> None:
-    for (i, track_or_short) in enumerate(tracks, 1):
-        if skip >= i:
-            continue
-        track = track_from_short(track_or_short)
-        show_playing_track(i, total_tracks, track, args.show_id)
-        if args.alice:
-            show_alice_shot(client, track_or_short)
+                  total_tracks: int, tracks: TrackList,
+                  skip: int, count: int, executor: ThreadPoolExecutor) -> None:
+    shots: dict[str, Future[list[str]]] = {}
+    pending = deque[tuple[str, Future[list[str]]]]()  # shots of listed lines, not written yet
+    fmt = track_format(args)
+    with LineWriter() as out:
+        for i in range(skip + 1, len(tracks) + 1):
+            if args.alice:
+                prefetch_alice_shots(client, executor, shots, tracks, i - 1)
+            track_or_short = tracks[i - 1]
+            track = track_from_short(track_or_short)
+            show_playing_track(i, total_tracks, track, fmt, out)
+            if args.alice:  # after its line if it is there, otherwise after a later one
+                pending.append((f'{i:>2}: ', shots[tracks.track_id(i - 1)]))
+                write_alice_shots(pending, out)
+
+            if count and skip + count <= i:
+                break
+        write_alice_shots(pending, out, wait=True)
 
-        if count and skip + count <= i:
-            break
+    for shot in shots.values():  # prefetched beyond the last listed line, never written
+        shot.cancel()
 
 
 def handle_exception(e: BaseException) -> None:
@@ -1192,13 +2282,7 @@ def handle_exception(e: BaseException) -> None:
 
 if __name__ == '__main__':
     try:
-        args = handle_args()
-        if args.ignore_ssl:
-            from no_ssl_ctx import no_ssl_verification
-            with no_ssl_verification():
-                main(args)
-        else:
-            main(args)
+        main(handle_args())
     except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
         pass
     except Exception as e:
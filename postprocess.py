@@ -0,0 +1,118 @@
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Final, Optional
+
+from store import LocalStore
+
+if TYPE_CHECKING:
+    from yandex_music import Track
+    from yandex_music.album.album import Album
+
+COVER_FILE_NAME: Final = 'cover.jpg'
+COVER_SIZE: Final = '400x400'
+
+
+class PostProcessor:
+    """Tags downloaded files and saves album covers on its own worker pool, off the playback path.
+
+    Covers are downloaded once per album folder, concurrent requests for the same album share one download.
+    Downloads are submitted when they finish. Files must not be open in the player while tagging, so the one
+    playing and the next one are submitted after they were played. A file is processed once per run.
+    """
+    __slots__ = ('store', 'tags', 'covers', '_executor', '_covers', '_seen', '_lock', '_id3')
+
+    def __init__(self, store: LocalStore, tags: bool, covers: bool, jobs: int) -> None:
+        self.store = store
+        self.covers = covers
+        self._executor = ThreadPoolExecutor(max(1, jobs), thread_name_prefix='postprocess')
+        self._covers: dict[Path, Future[Optional[Path]]] = {}
+        self._seen = set[Path]()
+        self._lock = threading.Lock()
+        self._id3 = None
+        if tags:
+            try:
+                from mutagen import id3
+                self._id3 = id3
+            except ImportError:
+                print('mutagen is not installed, ID3 tagging is disabled (pip install mutagen)')
+        self.tags = self._id3 is not None
+
+    def submit(self, track: 'Track', file_path: Path) -> Optional['Future[None]']:
+        """None if the file was submitted already"""
+        with self._lock:
+            if file_path in self._seen:
+                return None
+            self._seen.add(file_path)
+        return self._executor.submit(self._process, track, file_path)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _process(self, track: 'Track', file_path: Path) -> None:
+        try:
+            album = track.albums[0] if track.albums else None
+            cover = self._cover(album, file_path.parent).result() if album and self.covers else None
+            tagged = self.tags and self._tag(track, file_path, cover)
+            self.store.put_file(str(track.id), str(album.id) if album else None, file_path, tagged, cover)
+        except Exception:
+            print(f'post-processing {track.id} failed:')
+            traceback.print_exc()
+
+    def _cover(self, album: 'Album', album_dir: Path) -> 'Future[Optional[Path]]':
+        path = album_dir / COVER_FILE_NAME
+        with self._lock:
+            future = self._covers.get(path)
+            if future is None:
+                future = self._covers[path] = Future()
+                start = True
+            else:
+                start = False
+        if start:
+            try:
+                if not path.exists() and album.cover_uri:
+                    tmp = path.with_suffix('.tmp')
+                    album.download_cover(str(tmp), COVER_SIZE)
+                    tmp.replace(path)
+                future.set_result(path if path.exists() else None)
+            except Exception as e:
+                print(f'cover for album {album.id}: {type(e).__name__} {e}')
+                future.set_result(None)
+        return future
+
+    def _tag(self, track: 'Track', file_path: Path, cover: Optional[Path]) -> bool:
+        id3 = self._id3
+        assert id3
+        try:
+            tags = id3.ID3(file_path)
+        except id3.ID3NoHeaderError:
+            tags = id3.ID3()
+
+        title = track.title or ''
+        if track.version and not track.version.isspace():
+            title = f'{title} ({track.version})'
+        tags.setall('TIT2', [id3.TIT2(encoding=3, text=title)])
+        tags.setall('TPE1', [id3.TPE1(encoding=3, text=[a.name for a in track.artists if a.name])])
+        if track.albums:
+            album = track.albums[0]
+            album_title = album.title or ''
+            if album.version and not album.version.isspace():
+                album_title = f'{album_title} ({album.version})'
+            tags.setall('TALB', [id3.TALB(encoding=3, text=album_title)])
+            if album.artists:
+                tags.setall('TPE2', [id3.TPE2(encoding=3, text=[a.name for a in album.artists if a.name])])
+            year = album.year or album.original_release_year
+            if year:
+                tags.setall('TDRC', [id3.TDRC(encoding=3, text=str(year))])
+            if album.genre:
+                tags.setall('TCON', [id3.TCON(encoding=3, text=album.genre)])
+            tp = album.track_position
+            if tp:
+                tags.setall('TRCK', [id3.TRCK(encoding=3, text=str(tp.index))])
+                tags.setall('TPOS', [id3.TPOS(encoding=3, text=str(tp.volume))])
+        tags.setall('TXXX:YM_TRACK_ID', [id3.TXXX(encoding=3, desc='YM_TRACK_ID', text=track.track_id)])
+        if cover and not tags.getall('APIC'):
+            tags.add(id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover.read_bytes()))
+        tags.save(file_path)
+        return True
@@ -0,0 +1,85 @@
+from pathlib import Path
+from typing import Callable, Final, NamedTuple, Optional
+
+from yandex_music import Track
+
+from tracklist import TrackList
+
+MAX_PATH: Final = 260  # Windows limit, players do not take \\?\ paths
+
+
+class Problem(NamedTuple):
+    n: int  # position in the list, 1-based
+    track_id: str
+    reason: str
+    fatal: bool  # can never play: skipped without a download attempt
+
+
+class PreflightResult(NamedTuple):
+    start: int
+    stop: int
+    cached: int
+    problems: list[Problem]
+
+    @property
+    def blocked(self) -> set[str]:
+        return {p.track_id for p in self.problems if p.fatal}
+
+    def __str__(self) -> str:
+        checked = self.stop - self.start
+        blocked = sum(p.fatal for p in self.problems)
+        notices = len(self.problems) - blocked
+        lines = [f'Pre-flight {self.start + 1}..{self.stop}: {checked} track{"" if checked == 1 else "s"}, '
+                 f'{self.cached} cached, {blocked} skipped, {notices} notice{"" if notices == 1 else "s"}']
+        lines.extend(f'{p.n:>4}: {p.track_id} {p.reason}' + (' (skipped)' if p.fatal else '') for p in self.problems)
+        return '\n'.join(lines)
+
+
+def unavailable(track: Track) -> Optional[str]:
+    """Why the track can not be downloaded, None if it can"""
+    if track.error:
+        return f'error: {track.error}'
+    if track.available is False:
+        return 'not available' + (f' (regions: {",".join(track.regions)})' if track.regions else '')
+    if not track.albums and track.type in (None, 'music'):  # delisted, download info fails
+        return 'no albums'
+    return None
+
+
+def check_tracks(tracks: TrackList, start: int, stop: int, cache_path: Callable[[Track], Path],
+                 skip_long_path: bool) -> PreflightResult:
+    """Checks tracks [start, stop) before they are played: metadata is fetched in `TrackList` batches.
+
+    Unavailable tracks are replaced by their catalogue match if that one plays, blocked otherwise.
+    Cache paths are computed here, too long ones are blocked with `skip_long_path`.
+    """
+    cached = 0
+    problems = list[Problem]()
+    for i in range(start, stop):
+        track = tracks[i]
+        track_id = tracks.track_id(i)
+        if not isinstance(track, Track):  # no client, nothing to check
+            continue
+        if reason := unavailable(track):
+            match = track.matched_track
+            if match is not None and unavailable(match) is None:
+                tracks.pin(i, match)
+                problems.append(Problem(i + 1, track_id, f'{reason}, plays {match.track_id} instead', False))
+                track = match
+            else:
+                problems.append(Problem(i + 1, track_id, reason, True))
+                continue
+        if track.substituted is not None:
+            problems.append(Problem(i + 1, track_id, f'substitutes {track.substituted.track_id}', False))
+        elif track.real_id and str(track.real_id) != str(track.id):
+            problems.append(Problem(i + 1, track_id, f'real_id {track.real_id}', False))
+
+        path = cache_path(track)
+        if skip_long_path and len(str(path)) >= MAX_PATH:
+            problems.append(Problem(i + 1, track_id, f'path is too long (MAX_PATH): {path}', True))
+            continue
+        try:
+            cached += path.exists()
+        except OSError as e:  # ENAMETOOLONG: a file name over the file system limit
+            problems.append(Problem(i + 1, track_id, f'bad cache path: {e.strerror}', True))
+    return PreflightResult(start, stop, cached, problems)
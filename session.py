@@ -0,0 +1,88 @@
+import hashlib
+import json
+from pathlib import Path
+from time import time
+from typing import Final, Iterable, Optional
+
+SESSIONS_FOLDER_NAME: Final = 'sessions'
+
+
+class Session:
+    """Checkpoint of a playback session, one per track source, so `--resume` continues it.
+
+    `<hash>.json` holds order, position and filters and is rewritten after every track,
+    `<hash>.played` gets a line per played track, `<hash>.ids` holds the track list (storage order)
+    and is written once.
+    """
+    __slots__ = ('path', 'source', 'seed', 'reverse', 'length', 'total', 'position', 'end', 'played', 'queue',
+                 'updated', '_append')
+
+    def __init__(self, cache_folder: Path, source: str, seed: Optional[int], reverse: bool, length: int,
+                 total: int, position: int = 0, end: int = 0, played: Optional[list[str]] = None,
+                 queue: Optional[tuple[str, int]] = None, updated: float = 0) -> None:
+        self.path = Session.path_for(cache_folder, source)
+        self.source = source
+        self.seed = seed
+        self.reverse = reverse
+        self.length = length
+        self.total = total
+        self.position = position  # tracks done
+        self.end = end  # stop after this position, 0: play all
+        self.played = played if played is not None else []
+        self._append = False  # first save writes the whole played file
+        self.queue = queue  # server queue id and index of the first track
+        self.updated = updated
+
+    @staticmethod
+    def path_for(cache_folder: Path, source: str) -> Path:
+        return cache_folder / SESSIONS_FOLDER_NAME / f'{hashlib.sha1(source.encode()).hexdigest()[:16]}.json'
+
+    @classmethod
+    def load(cls, cache_folder: Path, source: str) -> Optional['Session']:
+        try:
+            data = json.loads(Session.path_for(cache_folder, source).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('source') != source:
+            return None
+        played = data.get('played', [])  # kept in the json before
+        try:
+            played += Session.path_for(cache_folder, source).with_suffix('.played').read_text().split()
+        except FileNotFoundError:
+            pass
+        queue = data.get('queue')
+        return cls(cache_folder, source, data['seed'], data['reverse'], data['length'], data.get('total', 0),
+                   data['position'], data.get('end', 0), played, tuple(queue) if queue else None,
+                   data.get('updated', 0))
+
+    def save_track_ids(self, track_ids: Iterable[str]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(','.join(track_ids), encoding='utf-8')
+        tmp.replace(self.path.with_suffix('.ids'))
+
+    def load_track_ids(self) -> Optional[list[str]]:
+        try:
+            text = self.path.with_suffix('.ids').read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        ids = text.split(',') if text else []
+        return ids if len(ids) == self.length else None
+
+    def save(self, position: int, played_id: Optional[str] = None) -> None:
+        self.position = position
+        self.updated = time()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if played_id is not None:
+            self.played.append(played_id)
+        if played_id is not None or not self._append:
+            with open(self.path.with_suffix('.played'), 'a' if self._append else 'w') as f:
+                f.writelines(f'{id}\n' for id in (self.played[-1:] if self._append else self.played))
+            self._append = True
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'source': self.source, 'seed': self.seed, 'reverse': self.reverse,
+                                   'length': self.length, 'total': self.total, 'position': position,
+                                   'end': self.end, 'queue': self.queue, 'updated': self.updated},
+                                  ensure_ascii=False),
+                       encoding='utf-8')
+        tmp.replace(self.path)
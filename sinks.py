@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Final, NamedTuple, Optional
+
+import requests
+from yandex_music.exceptions import BadRequest, Unauthorized, YandexMusicError
+
+if TYPE_CHECKING:
+    from yandex_music import Client, Track
+    from transport import Transport
+
+QUEUE_SIZE: Final = 100  # events per sink, the oldest are dropped when full
+MAX_ATTEMPTS: Final = 5  # per batch
+BACKOFF: Final = 2  # seconds, doubles per attempt
+MAX_BACKOFF: Final = 60  # seconds
+CLOSE_TIMEOUT: Final = 5  # seconds to deliver what is queued on exit
+LASTFM_URL: Final = 'https://ws.audioscrobbler.com/2.0/'
+LASTFM_MIN_SECONDS: Final = 30  # shorter tracks are not scrobbled
+LASTFM_MAX_WAIT: Final = 4 * 60  # played this long or half of the track: scrobble
+
+NOW_PLAYING: Final = 'now-playing'
+PLAYED: Final = 'played'
+
+
+class PlayEvent(NamedTuple):
+    kind: str  # NOW_PLAYING | PLAYED
+    track: 'Track'
+    started: float  # unix time
+    played_seconds: int = 0
+    skipped: bool = False
+    source: str = ''
+    reported: Optional[Callable[[], None]] = None  # called once YandexSink has delivered it
+
+
+class SinkError(Exception):
+    """Delivery failed. retry=False: the batch is dropped at once (bad credentials, rejected request)"""
+
+    def __init__(self, message: str, retry: bool = True) -> None:
+        super().__init__(message)
+        self.retry = retry
+
+
+class Sink(ABC):
+    """Destination of play events. `send` runs on the sink's own thread and raises on failure"""
+    __slots__ = ()
+    name = 'sink'
+    kinds: tuple[str, ...] = (NOW_PLAYING, PLAYED)  # others are not queued
+    batch_size = 1
+
+    @abstractmethod
+    def send(self, events: list[PlayEvent]) -> None:
+        ...
+
+    def split(self, events: list[PlayEvent]) -> list[list[PlayEvent]]:
+        """Parts of a batch that are sent and retried on their own"""
+        return [events]
+
+
+class YandexSink(Sink):
+    """Play status for YM recommendations, as the playback loop used to send it inline"""
+    __slots__ = ('client', 'play_id')
+    name = 'yandex'
+    kinds = (PLAYED,)
+
+    def __init__(self, client: 'Client', play_id: Callable[[], str]) -> None:
+        self.client = client
+        self.play_id = play_id
+
+    def send(self, events: list[PlayEvent]) -> None:
+        for e in events:
+            track = e.track
+            now = f'{datetime.now().isoformat()}Z'
+            played_seconds = (track.duration_ms or 0) // 1000
+            try:
+                ok = self.client.play_audio(track.id, 'termYM', track.albums[0].id or 0 if track.albums else 0,
+                                            track_length_seconds=played_seconds,
+                                            end_position_seconds=played_seconds,
+                                            total_played_seconds=played_seconds,
+                                            play_id=self.play_id(), timestamp=now, client_now=now)
+            except (Unauthorized, BadRequest) as ex:
+                raise SinkError(f'{type(ex).__name__} {ex}', retry=False)
+            except YandexMusicError as ex:  # network, 5xx, rate limit
+                raise SinkError(f'{type(ex).__name__} {ex}')
+            if not ok:
+                raise SinkError('play-audio was not accepted', retry=False)
+            if e.reported:
+                e.reported()
+
+
+def _post(transport: 'Transport', url: str, **kwargs) -> requests.Response:  # type: ignore[no-untyped-def]
+    try:
+        resp = transport.request('POST', url, **kwargs)
+    except requests.RequestException as e:
+        raise SinkError(f'{type(e).__name__} {e}')
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise SinkError(f'HTTP {resp.status_code}')
+    if resp.status_code >= 400:
+        raise SinkError(f'HTTP {resp.status_code} {resp.text[:200]}', retry=False)
+    return resp
+
+
+def event_json(e: PlayEvent) -> dict:
+    track = e.track
+    album = track.albums[0] if track.albums else None
+    return {'event': e.kind, 'track_id': track.track_id, 'title': track.title, 'version': track.version,
+            'artists': track.artists_name(), 'album': album.title if album else None,
+            'duration_ms': track.duration_ms, 'played_seconds': e.played_seconds, 'skipped': e.skipped,
+            'source': e.source, 'started': datetime.fromtimestamp(e.started, timezone.utc).isoformat()}
+
+
+class WebhookSink(Sink):
+    """POSTs `{"events": [...]}` JSON to any URL"""
+    __slots__ = ('url', 'transport')
+    name = 'webhook'
+    batch_size = 20
+
+    def __init__(self, url: str, transport: 'Transport') -> None:
+        self.url = url
+        self.transport = transport
+
+    def send(self, events: list[PlayEvent]) -> None:
+        _post(self.transport, self.url, json={'events': [event_json(e) for e in events]})
+
+
+class LastFmSink(Sink):
+    """Last.fm API 2.0 scrobbling (also Libre.fm and other compatible servers).
+
+    session_key: from auth.getMobileSession or the web auth flow. A now-playing update is sent only if it is
+    still current, i.e. the last event of its batch; played tracks are scrobbled by Last.fm rules.
+    """
+    __slots__ = ('url', 'api_key', 'secret', 'session_key', 'transport')
+    name = 'lastfm'
+    batch_size = 50  # track.scrobble limit
+
+    def __init__(self, url: str, api_key: str, secret: str, session_key: str, transport: 'Transport') -> None:
+        self.url = url
+        self.api_key = api_key
+        self.secret = secret
+        self.session_key = session_key
+        self.transport = transport
+
+    def split(self, events: list[PlayEvent]) -> list[list[PlayEvent]]:
+        """Scrobbles and the now-playing update: a failed update must not send the scrobbles again"""
+        scrobbles = [e for e in events if e.kind == PLAYED and self._scrobbled(e)]
+        now_playing = [events[-1]] if events and events[-1].kind == NOW_PLAYING else []
+        return [unit for unit in (scrobbles, now_playing) if unit]
+
+    def send(self, events: list[PlayEvent]) -> None:
+        if events[0].kind == NOW_PLAYING:
+            self._call({'method': 'track.updateNowPlaying', **self._track_params(events[0])})
+            return
+        params = {'method': 'track.scrobble'}
+        for n, e in enumerate(events):  # at most batch_size
+            params.update({f'{k}[{n}]': v for k, v in self._track_params(e).items()})
+            params[f'timestamp[{n}]'] = str(int(e.started))
+        self._call(params)
+
+    @staticmethod
+    def _scrobbled(e: PlayEvent) -> bool:
+        seconds = (e.track.duration_ms or 0) // 1000
+        return seconds > LASTFM_MIN_SECONDS and e.played_seconds >= min(seconds // 2, LASTFM_MAX_WAIT)
+
+    @staticmethod
+    def _track_params(e: PlayEvent) -> dict[str, str]:
+        track = e.track
+        params = {'artist': ', '.join(track.artists_name()) or 'Unknown',
+                  'track': track.title if not track.version else f'{track.title} ({track.version})'}
+        if track.albums and track.albums[0].title:
+            params['album'] = track.albums[0].title
+        if track.duration_ms:
+            params['duration'] = str(track.duration_ms // 1000)
+        return params
+
+    def _call(self, params: dict[str, str]) -> None:
+        params.update(api_key=self.api_key, sk=self.session_key)
+        sig = ''.join(k + params[k] for k in sorted(params)) + self.secret
+        params.update(api_sig=hashlib.md5(sig.encode()).hexdigest(), format='json')
+        resp = _post(self.transport, self.url, data=params)
+        try:
+            error = resp.json().get('error')
+        except ValueError:
+            raise SinkError(f'not json: {resp.text[:200]}')
+        if error:
+            # 11 service offline, 16 temporarily unavailable, 29 rate limit; others are permanent
+            raise SinkError(f'error {error}: {resp.json().get("message")}', retry=error in (11, 16, 29))
+
+
+class SinkHub:
+    """Fans play events out to sinks, off the playback path.
+
+    Each sink has a bounded queue and a worker task on the running event loop that batches queued events and
+    sends them on the sink's own thread, each part of a batch (`Sink.split`) retried with exponential backoff.
+    A slow or dead endpoint only fills its own queue, then its oldest events are dropped; `publish` never waits.
+    """
+    __slots__ = ('sinks', '_queues', '_tasks', '_executors', 'dropped')
+
+    def __init__(self, sinks: list[Sink], queue_size: int = QUEUE_SIZE) -> None:
+        self.sinks = sinks
+        self._queues = [asyncio.Queue[PlayEvent](max(1, queue_size)) for _ in sinks]
+        self._executors = [ThreadPoolExecutor(1, thread_name_prefix=f'sink-{s.name}') for s in sinks]
+        self._tasks = [asyncio.create_task(self._worker(s, q, x))
+                       for s, q, x in zip(sinks, self._queues, self._executors)]
+        self.dropped = Counter[str]()
+
+    def publish(self, event: PlayEvent) -> None:
+        for sink, queue in zip(self.sinks, self._queues):
+            if event.kind not in sink.kinds:
+                continue
+            if queue.full():
+                queue.get_nowait()
+                queue.task_done()
+                self.dropped[sink.name] += 1
+            queue.put_nowait(event)
+
+    async def close(self, timeout: float = CLOSE_TIMEOUT) -> None:
+        """Waits up to `timeout` for queued events, drops the rest"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for sink, queue, task in zip(self.sinks, self._queues, self._tasks):
+            task.cancel()
+            self.dropped[sink.name] += queue.qsize()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for x in self._executors:
+            x.shutdown(wait=False)
+        for name, n in self.dropped.items():
+            if n:
+                print(f'{name}: {n} play event{"" if n == 1 else "s"} not delivered')
+
+    async def _worker(self, sink: Sink, queue: 'asyncio.Queue[PlayEvent]', executor: ThreadPoolExecutor) -> None:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < sink.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                for unit in sink.split(batch):
+                    await self._send(sink, unit, executor)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _send(self, sink: Sink, events: list[PlayEvent], executor: ThreadPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await loop.run_in_executor(executor, sink.send, events)
+                return
+            except SinkError as e:
+                if not e.retry or attempt == MAX_ATTEMPTS:
+                    print(f'{sink.name}: {e}, {len(events)} play event{"" if len(events) == 1 else "s"} dropped')
+                    self.dropped[sink.name] += len(events)
+                    return
+                await asyncio.sleep(min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1)))
+            except Exception as e:  # a bug in a sink must not stop the others
+                print(f'{sink.name}: {type(e).__name__} {e}')
+                self.dropped[sink.name] += len(events)
+                return
@@ -0,0 +1,175 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from time import time
+from typing import TYPE_CHECKING, Callable, Final, Iterable, Optional
+
+if TYPE_CHECKING:
+    from yandex_music import Client, Track
+
+LOG_FILE_NAME: Final = 'plays.jsonl'
+INDEX_FILE_NAME: Final = 'index.sqlite3'
+
+SCHEMA: Final = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS track (
+    track_id TEXT PRIMARY KEY, album_id TEXT, title TEXT, artists TEXT,
+    plays INTEGER NOT NULL, skips INTEGER NOT NULL, seconds INTEGER NOT NULL,
+    first_ts INTEGER NOT NULL, last_ts INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS track_year (
+    track_id TEXT NOT NULL, year INTEGER NOT NULL,
+    plays INTEGER NOT NULL, skips INTEGER NOT NULL, seconds INTEGER NOT NULL,
+    PRIMARY KEY (track_id, year)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS artist (
+    artist_id TEXT PRIMARY KEY, name TEXT, plays INTEGER NOT NULL, skips INTEGER NOT NULL);
+'''
+
+
+class PlayStats:
+    """Append-only play log with a compacted SQLite aggregate index.
+
+    The log (one JSON object per line) is the source of truth and is only appended to.
+    The index is rebuilt incrementally from the byte offset it was last compacted at,
+    so queries never scan the whole history. Pushing to the server uses its own offset.
+    A play reported to the server later gets a `{"sent": <offset of its entry>}` line.
+    """
+    __slots__ = ('folder', 'log_path', '_db', '_lock')
+
+    def __init__(self, cache_folder: Path) -> None:
+        self.folder = cache_folder / 'stats'
+        self.log_path = self.folder / LOG_FILE_NAME
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # plays are recorded by the playback loop, marked sent by a sink thread
+
+    def record(self, track: 'Track', played_seconds: int, source: str, skipped: bool) -> int:
+        """Appends a not yet sent play, returns its offset for `mark_sent`"""
+        entry = {
+            'ts': int(time()),
+            'id': str(track.id),
+            'album': str(track.albums[0].id) if track.albums else '',
+            'title': track.title if not track.version else f'{track.title} @ {track.version}',
+            'artists': [[str(a.id), a.name] for a in track.artists],
+            'sec': played_seconds,
+            'len': (track.duration_ms or 0) // 1000,
+            'src': source,
+            'skip': skipped,
+            'sent': False,  # older versions: True if reported by play_audio right away
+        }
+        return self._append(entry)
+
+    def mark_sent(self, offset: int) -> None:
+        self._append({'sent': offset})
+
+    def _append(self, entry: dict) -> int:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.log_path, 'ab') as f:
+            offset = f.tell()
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode() + b'\n')
+        return offset
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.folder / INDEX_FILE_NAME)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _offset(self, key: str) -> int:
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _read_log(self, offset: int) -> Iterable[tuple[int, dict]]:
+        """Yields (offset after entry, entry) for complete lines starting at `offset`."""
+        if not self.log_path.exists():
+            return
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):  # partially written
+                    break
+                offset += len(line)
+                yield offset, json.loads(line)
+
+    def compact(self) -> int:
+        db = self.db
+        offset = self._offset('compacted')
+        count = 0
+        with db:
+            for offset, e in self._read_log(offset):
+                if 'id' not in e:  # sent mark
+                    continue
+                skip = int(e['skip'])
+                db.execute('''INSERT INTO track VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                              ON CONFLICT (track_id) DO UPDATE SET album_id = excluded.album_id,
+                                title = excluded.title, artists = excluded.artists,
+                                plays = plays + 1, skips = skips + excluded.skips,
+                                seconds = seconds + excluded.seconds, last_ts = excluded.last_ts''',
+                           (e['id'], e['album'], e['title'], '|'.join(name for _, name in e['artists']),
+                            skip, e['sec'], e['ts'], e['ts']))
+                db.execute('''INSERT INTO track_year VALUES (?, ?, 1, ?, ?)
+                              ON CONFLICT (track_id, year) DO UPDATE SET plays = plays + 1,
+                                skips = skips + excluded.skips, seconds = seconds + excluded.seconds''',
+                           (e['id'], datetime.fromtimestamp(e['ts']).year, skip, e['sec']))
+                for artist_id, name in e['artists']:
+                    db.execute('''INSERT INTO artist VALUES (?, ?, 1, ?)
+                                  ON CONFLICT (artist_id) DO UPDATE SET name = excluded.name,
+                                    plays = plays + 1, skips = skips + excluded.skips''',
+                               (artist_id, name, skip))
+                count += 1
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('compacted', offset))
+        return count
+
+    def top(self, year: Optional[int], limit: int) -> list[tuple[str, str, str, int, int]]:
+        self.compact()
+        if year is None:
+            return self.db.execute('''SELECT track_id, artists, title, plays, seconds FROM track
+                                      ORDER BY plays DESC, seconds DESC LIMIT ?''', (limit,)).fetchall()
+        return self.db.execute('''SELECT y.track_id, t.artists, t.title, y.plays, y.seconds
+                                  FROM track_year y JOIN track t USING (track_id) WHERE y.year = ?
+                                  ORDER BY y.plays DESC, y.seconds DESC LIMIT ?''', (year, limit)).fetchall()
+
+    def never_played(self, track_ids: Iterable[str]) -> list[str]:
+        self.compact()
+        played = {r[0] for r in self.db.execute('SELECT track_id FROM track')}
+        return [id for id in track_ids if id.split(':')[0] not in played]
+
+    def skip_rates(self, limit: int) -> list[tuple[str, str, int, int]]:
+        self.compact()
+        return self.db.execute('''SELECT artist_id, name, plays, skips FROM artist
+                                  ORDER BY CAST(skips AS REAL) / plays DESC, plays DESC LIMIT ?''',
+                               (limit,)).fetchall()
+
+    def last_played(self) -> dict[str, int]:
+        self.compact()
+        return dict(self.db.execute('SELECT track_id, last_ts FROM track'))
+
+    def push(self, client: 'Client', generate_play_id: Callable[[], str]) -> int:
+        """Sends not yet synced log entries to the server. Stops at the first failure."""
+        db = self.db
+        count = 0
+        start = self._offset('synced')
+        entries = list(self._read_log(start))
+        sent = {e['sent'] for _, e in entries if 'id' not in e}  # marks come after their entries
+        for offset, e in entries:
+            if 'id' in e and not e['sent'] and start not in sent:
+                now = datetime.fromtimestamp(e['ts'], timezone.utc).isoformat()
+                ok = client.play_audio(e['id'], 'termYM', e['album'] or 0,
+                                       track_length_seconds=e['len'],
+                                       end_position_seconds=e['sec'],
+                                       total_played_seconds=e['sec'],
+                                       play_id=generate_play_id(), timestamp=now, client_now=now)
+                if not ok:
+                    break
+                count += 1
+            with db:
+                db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('synced', offset))
+            start = offset
+        return count
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
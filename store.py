@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+from time import time
+from typing import Final, Optional
+
+STORE_FILE_NAME: Final = 'store.sqlite3'
+QUERY_CHUNK_SIZE: Final = 500
+MISS_TTL: Final = 7 * 24 * 60 * 60  # seconds, a track without supplement is asked for again after that
+SEARCH_WEIGHTS: Final = '10.0, 5.0, 3.0, 1.0'  # bm25 weights of title, artists, album, lyrics
+
+SCHEMA: Final = '''
+CREATE TABLE IF NOT EXISTS files (
+    track_id TEXT PRIMARY KEY, album_id TEXT, path TEXT NOT NULL, size INTEGER NOT NULL,
+    tagged INTEGER NOT NULL DEFAULT 0, cover TEXT, updated INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS files_album ON files (album_id);
+CREATE TABLE IF NOT EXISTS supplements (track_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS tracks (track_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS playlists (
+    uid INTEGER NOT NULL, kind INTEGER NOT NULL, revision INTEGER NOT NULL, tracks TEXT NOT NULL,
+    updated INTEGER NOT NULL, PRIMARY KEY (uid, kind));
+'''
+SEARCH_SCHEMA: Final = '''
+CREATE TABLE IF NOT EXISTS search_ids (track_id TEXT PRIMARY KEY);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+    title, artists, album, lyrics, tokenize = 'unicode61 remove_diacritics 0');
+'''  # search.rowid = search_ids.rowid
+
+
+def fold(text: str) -> str:
+    """Same normalization as `slugify` plus casefold, for the index and for queries"""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def _search_fields(data: dict) -> tuple[str, str, str]:
+    title = data.get('title') or ''
+    if data.get('version'):
+        title = f"{title} {data['version']}"
+    artists = ' '.join(a['name'] for a in data.get('artists') or () if a.get('name'))
+    album = ' '.join(f"{a.get('title') or ''} {a.get('version') or ''}" for a in data.get('albums') or ())
+    return fold(title), fold(artists), fold(album)
+
+
+class LocalStore:
+    """Local index of cached files and metadata (SQLite in the cache folder). Safe to use from worker threads."""
+    __slots__ = ('path', 'fts', '_db', '_lock')
+
+    def __init__(self, cache_folder: Path) -> None:
+        cache_folder.mkdir(parents=True, exist_ok=True)
+        self.path = cache_folder / STORE_FILE_NAME
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(SEARCH_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:  # sqlite without FTS5
+            self.fts = False
+        if self.fts and not self._db.execute('SELECT 1 FROM search LIMIT 1').fetchone():
+            self._reindex()
+
+    def _reindex(self) -> None:
+        """Index metadata that was stored before the search index existed"""
+        with self._lock, self._db:
+            for id, data in self._db.execute('SELECT track_id, data FROM tracks').fetchall():
+                self._index_track(id, json.loads(data))
+            for id, data in self._db.execute('SELECT track_id, data FROM supplements').fetchall():
+                self._index_lyrics(id, json.loads(data))
+
+    def _search_row(self, track_id: str) -> tuple[int, bool]:
+        """rowid of the track in the index, True if it is new"""
+        row = self._db.execute('SELECT rowid FROM search_ids WHERE track_id = ?', (track_id,)).fetchone()
+        if row:
+            return row[0], False
+        return self._db.execute('INSERT INTO search_ids VALUES (?)', (track_id,)).lastrowid, True
+
+    def _index_track(self, track_id: str, data: dict) -> None:
+        rowid, new = self._search_row(track_id)
+        if new:
+            self._db.execute("INSERT INTO search (rowid, title, artists, album, lyrics) VALUES (?, ?, ?, ?, '')",
+                             (rowid, *_search_fields(data)))
+        else:
+            self._db.execute('UPDATE search SET title = ?, artists = ?, album = ? WHERE rowid = ?',
+                             (*_search_fields(data), rowid))
+
+    def _index_lyrics(self, track_id: str, data: dict) -> None:
+        lyrics = (data.get('lyrics') or {}).get('full_lyrics')
+        if not lyrics:
+            return
+        rowid, new = self._search_row(track_id)
+        if new:
+            self._db.execute("INSERT INTO search (rowid, title, artists, album, lyrics) VALUES (?, '', '', '', ?)",
+                             (rowid, fold(lyrics)))
+        else:
+            self._db.execute('UPDATE search SET lyrics = ? WHERE rowid = ?', (fold(lyrics), rowid))
+
+    def put_file(self, track_id: str, album_id: Optional[str], path: Path, tagged: bool,
+                 cover: Optional[Path]) -> None:
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (track_id, album_id, str(path), path.stat().st_size, int(tagged),
+                              str(cover) if cover else None, int(time())))
+
+    def get_file(self, track_id: str) -> Optional[tuple[Path, int, bool]]:
+        with self._lock:
+            row = self._db.execute('SELECT path, size, tagged FROM files WHERE track_id = ?',
+                                   (track_id,)).fetchone()
+        return (Path(row[0]), row[1], bool(row[2])) if row else None
+
+    def files(self) -> list[tuple[str, Path, int]]:
+        """track_id, path, size of all recorded files"""
+        with self._lock:
+            rows = self._db.execute('SELECT track_id, path, size FROM files').fetchall()
+        return [(track_id, Path(path), size) for track_id, path, size in rows]
+
+    def get_files(self, track_ids: list[str]) -> dict[str, Path]:
+        """Recorded file paths by track id, missing ids are left out"""
+        res = {}
+        for i in range(0, len(track_ids), QUERY_CHUNK_SIZE):
+            chunk = track_ids[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            with self._lock:
+                rows = self._db.execute(f'SELECT track_id, path FROM files WHERE track_id IN ({placeholders})',
+                                        chunk).fetchall()
+            res.update((id, Path(path)) for id, path in rows)
+        return res
+
+    def delete_file(self, track_id: str) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files WHERE track_id = ?', (track_id,))
+
+    def put_supplement(self, track_id: str, data: dict) -> None:
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO supplements VALUES (?, ?, ?)',
+                             (track_id, json.dumps(data, ensure_ascii=False), int(time())))
+            if self.fts:
+                self._index_lyrics(track_id, data)
+
+    def get_supplement(self, track_id: str) -> Optional[dict]:
+        """{}: the track has none (stored as {} by `put_supplement`), None: not known"""
+        with self._lock:
+            row = self._db.execute('SELECT data, updated FROM supplements WHERE track_id = ?',
+                                   (track_id,)).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0])
+        return None if not data and time() - row[1] >= MISS_TTL else data
+
+    def put_tracks(self, tracks: list[tuple[str, dict]]) -> None:
+        now = int(time())
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?)',
+                                 ((id, json.dumps(data, ensure_ascii=False), now) for id, data in tracks))
+            if self.fts:
+                for id, data in tracks:
+                    self._index_track(id, data)
+
+    def search(self, query: str, limit: int) -> list[str]:
+        """Track ids of indexed tracks matching all words of `query` (as prefixes), best first"""
+        words = fold(query).split()
+        if not self.fts or not words:
+            return []
+        match = ' '.join('"{}"*'.format(w.replace('"', '""')) for w in words)
+        with self._lock:
+            rows = self._db.execute(f'SELECT i.track_id FROM search JOIN search_ids i ON i.rowid = search.rowid '
+                                    f'WHERE search MATCH ? ORDER BY bm25(search, {SEARCH_WEIGHTS}) LIMIT ?',
+                                    (match, limit)).fetchall()
+        return [id for id, in rows]
+
+    def get_tracks(self, track_ids: list[str]) -> dict[str, dict]:
+        """Cached track metadata (`Track.to_dict()`) by track id, missing ids are left out"""
+        return {id: json.loads(data) for id, data in self.get_tracks_json(track_ids).items()}
+
+    def get_tracks_json(self, track_ids: list[str]) -> dict[str, str]:
+        """Same as `get_tracks`, as stored JSON text (to write it out without decoding)"""
+        res = {}
+        for i in range(0, len(track_ids), QUERY_CHUNK_SIZE):  # sqlite limits number of parameters
+            chunk = track_ids[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            with self._lock:
+                rows = self._db.execute(f'SELECT track_id, data FROM tracks WHERE track_id IN ({placeholders})',
+                                        chunk).fetchall()
+            res.update(rows)
+        return res
+
+    def put_playlist_tracks(self, uid: int, kind: int, revision: int,
+                            tracks: list[tuple[str, Optional[str], str]]) -> None:
+        """Track list of a playlist revision as (id, album_id, timestamp), replaces older revisions"""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?)',
+                             (uid, kind, revision, json.dumps(tracks, separators=(',', ':')), int(time())))
+
+    def get_playlist_tracks(self, uid: int, kind: int, revision: Optional[int]
+                            ) -> Optional[list[tuple[str, Optional[str], str]]]:
+        """revision None: the stored one, whatever it is"""
+        query = 'SELECT tracks FROM playlists WHERE uid = ? AND kind = ?'
+        params: tuple[int, ...] = (uid, kind)
+        if revision is not None:
+            query += ' AND revision = ?'
+            params += (revision,)
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        return [tuple(t) for t in json.loads(row[0])] if row else None  # type: ignore[misc]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+from yandex_music import TrackShort
+
+from backup import SnapshotStore
+
+
+def short(id: int, timestamp: str = 't') -> TrackShort:
+    return TrackShort(id, timestamp, str(id * 10))
+
+
+def test_first_snapshot_is_full(tmp_path: Path) -> None:
+    store = SnapshotStore(tmp_path)
+    assert store.save(1, [short(1), short(2)]) == (2, 0)
+    state, meta = store.state()
+    assert state == {'1': ['10', 't'], '2': ['20', 't']}
+    assert meta['revision'] == 1
+
+
+def test_deltas_hold_changes_only(tmp_path: Path) -> None:
+    store = SnapshotStore(tmp_path)
+    store.save(1, [short(1), short(2), short(3)])
+    assert store.save(2, [short(1), short(3), short(4)]) == (1, 1)
+    snapshot = store.read(2)
+    assert snapshot['added'] == [['4', '40', 't']]
+    assert snapshot['removed'] == ['2']
+    assert 'order' not in snapshot  # replaying gives the same order
+    assert list(store.state()[0]) == ['1', '3', '4']
+
+
+def test_changed_timestamp_is_added_again(tmp_path: Path) -> None:
+    store = SnapshotStore(tmp_path)
+    store.save(1, [short(1)])
+    assert store.save(2, [short(1, 'u')]) == (1, 0)
+    assert store.state()[0] == {'1': ['10', 'u']}
+
+
+def test_moved_tracks_keep_order(tmp_path: Path) -> None:
+    store = SnapshotStore(tmp_path)
+    store.save(1, [short(1), short(2)])
+    store.save(2, [short(3), short(2), short(1)])
+    assert store.read(2)['order'] == ['3', '2', '1']
+    assert list(store.state()[0]) == ['3', '2', '1']
+
+
+def test_state_at_revision(tmp_path: Path) -> None:
+    store = SnapshotStore(tmp_path)
+    store.save(1, [short(1)])
+    store.save(5, [short(1), short(2)])
+    store.save(9, [short(2)])
+    assert store.revisions() == [1, 5, 9]
+    assert list(store.state(5)[0]) == ['1', '2']
+    assert list(store.state()[0]) == ['2']
+    with pytest.raises(KeyError):
+        store.state(3)
@@ -0,0 +1,57 @@
+import pytest
+
+from cachecheck import is_temp, scan_mp3
+
+FRAME = b'\xff\xfb\x90\x00'.ljust(417, b'\0')  # MPEG-1 layer III, 128 kbps, 44100 Hz: 1152 samples
+ID3 = b'ID3\x04\x00\x00\x00\x00\x00\x05' + b'\0' * 5  # empty tag with 5 bytes of padding
+
+
+def test_scan_frames() -> None:
+    scan = scan_mp3(ID3 + FRAME * 10)
+    assert (scan.frames, scan.problem) == (10, None)
+    assert scan.seconds == pytest.approx(10 * 1152 / 44100)
+
+
+@pytest.mark.parametrize('tail', [b'TAG'.ljust(128, b'x'), b'APETAGEX' + b'x' * 24, b'\0' * 10])
+def test_scan_tags_after_frames(tail: bytes) -> None:
+    assert scan_mp3(FRAME * 3 + tail).problem is None
+
+
+def test_scan_truncated() -> None:
+    assert scan_mp3(FRAME * 3 + FRAME[:100]) == (3, pytest.approx(3 * 1152 / 44100), 'truncated in frame 4')
+
+
+def test_scan_garbage() -> None:
+    assert scan_mp3(FRAME * 2 + b'garbage').problem == '7 bytes of garbage after frame 2'
+
+
+@pytest.mark.parametrize('data', [b'', b'not an mp3 at all', ID3])
+def test_scan_no_frames(data: bytes) -> None:
+    assert scan_mp3(data).problem == 'no mp3 frames'
+
+
+@pytest.mark.parametrize('name', [
+    '1-3_Mr. Brightside_123.mp3.part',
+    '1-3_Mr. Brightside_123.part',
+    '1-3_Title_123.mp3.tmp',
+    '1-3_Title_123',
+    '1-3_Mr. Brightside_123',
+    '_Podcast episode_456',
+    '_My upload_2cdf7f2a-1b3c-4d5e-8f90-a1b2c3d4e5f6',
+])
+def test_temp_names(name: str) -> None:
+    assert is_temp(name)
+
+
+@pytest.mark.parametrize('name', [
+    '1-3_Title_123.mp3',
+    '1-3_Title_123.mp3.lossy',
+    'cover.jpg',
+    'cover',
+    'notes_v2',
+    'folder_art',
+    '1-3_Title_abc',
+    'README_1',
+])
+def test_kept_names(name: str) -> None:
+    assert not is_temp(name)
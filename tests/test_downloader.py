@@ -0,0 +1,67 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import downloader
+from downloader import BACKGROUND, DownloadScheduler, TokenBucket
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.slept = list[float]()
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(downloader, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(downloader, 'sleep', clock.sleep)
+    return clock
+
+
+def test_unlimited(clock: Clock) -> None:
+    bucket = TokenBucket(0)
+    bucket.consume(10 ** 9)
+    assert clock.slept == []
+
+
+def test_burst_then_rate(clock: Clock) -> None:
+    bucket = TokenBucket(1000)
+    bucket.consume(1000)  # one second burst
+    assert clock.slept == []
+    bucket.consume(500)
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_refill_is_capped(clock: Clock) -> None:
+    bucket = TokenBucket(1000)
+    clock.now += 60  # idle time does not build up more than the burst
+    bucket.consume(1500)
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_debt_is_slept_off(clock: Clock) -> None:
+    bucket = TokenBucket(1000)
+    bucket.consume(3000)
+    assert clock.slept == [pytest.approx(2.0)]
+    bucket.consume(1000)
+    assert clock.slept[-1] == pytest.approx(1.0)
+
+
+def test_shutdown_resolves_queued_jobs(tmp_path: Path) -> None:
+    scheduler = DownloadScheduler(limits={BACKGROUND: 0})  # no workers, jobs stay queued
+    track = SimpleNamespace(track_id='1')
+    future = scheduler.request(track, tmp_path / 'a.mp3', BACKGROUND)  # type: ignore[arg-type]
+    scheduler.shutdown()
+    assert future.result(timeout=0) is None
+    scheduler.release(tmp_path / 'a.mp3', future)
+    assert scheduler.request(track, tmp_path / 'b.mp3', BACKGROUND).result(timeout=0) is None  # type: ignore
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+from yandex_music import Album, Artist, Track
+
+from stats import PlayStats
+
+
+class FakeClient:
+    def __init__(self, fail_at: int = -1) -> None:
+        self.sent = list[str]()
+        self.fail_at = fail_at
+
+    def play_audio(self, track_id: str, *args, **kwargs) -> bool:  # type: ignore[no-untyped-def]
+        if len(self.sent) == self.fail_at:
+            return False
+        self.sent.append(track_id)
+        return True
+
+
+def track(id: int) -> Track:
+    return Track(id, f'Song {id}', artists=[Artist(1, name='A')], albums=[Album(2, title='LP')], duration_ms=60_000,
+                 type_='music')
+
+
+@pytest.fixture
+def stats(tmp_path: Path):  # type: ignore[no-untyped-def]
+    play_stats = PlayStats(tmp_path)
+    yield play_stats
+    play_stats.close()
+
+
+def test_push_skips_entries_marked_sent(stats: PlayStats) -> None:
+    stats.record(track(1), 30, 'test', False)
+    stats.mark_sent(stats.record(track(2), 60, 'test', False))
+    stats.record(track(3), 5, 'test', True)
+    client = FakeClient()
+    assert stats.push(client, lambda: 'play') == 2  # type: ignore[arg-type]
+    assert client.sent == ['1', '3']
+
+
+def test_push_resumes_after_failure(stats: PlayStats) -> None:
+    for id in (1, 2, 3):
+        stats.record(track(id), 30, 'test', False)
+    client = FakeClient(fail_at=1)
+    assert stats.push(client, lambda: 'play') == 1  # type: ignore[arg-type]
+    client.fail_at = -1
+    assert stats.push(client, lambda: 'play') == 2  # type: ignore[arg-type]
+    assert client.sent == ['1', '2', '3']
+    assert stats.push(client, lambda: 'play') == 0  # type: ignore[arg-type]
+
+
+def test_mark_after_push_is_ignored(stats: PlayStats) -> None:
+    offset = stats.record(track(1), 30, 'test', False)
+    client = FakeClient()
+    stats.push(client, lambda: 'play')  # type: ignore[arg-type]
+    stats.mark_sent(offset)  # late delivery report of an entry pushed already
+    stats.record(track(2), 30, 'test', False)
+    assert stats.push(client, lambda: 'play') == 1  # type: ignore[arg-type]
+    assert client.sent == ['1', '2']
+
+
+def test_index_counts_plays_not_marks(stats: PlayStats) -> None:
+    stats.mark_sent(stats.record(track(1), 30, 'test', False))
+    stats.record(track(1), 10, 'test', True)
+    assert stats.top(None, 10) == [('1', 'A', 'Song 1', 2, 40)]
+    assert stats.skip_rates(10) == [('1', 'A', 2, 1)]
@@ -0,0 +1,50 @@
+import io
+
+import pytest
+from yandex_music import Album, Artist, Track
+
+from trackformat import DEFAULT_FORMAT, LineWriter, TrackFormat, duration_str
+
+
+def track(**kwargs) -> Track:  # type: ignore[no-untyped-def]
+    return Track(7, 'Song', artists=[Artist(1, name='A'), Artist(2, name='B')],
+                 albums=[Album(3, title='LP', year=1999)], duration_ms=185_000, type_='music', **kwargs)
+
+
+def test_default_format() -> None:
+    assert TrackFormat(DEFAULT_FORMAT).render(3, 12, track()) == ' 3/12: A|B [LP] ~ Song 3:05'
+
+
+def test_fields_specs_and_conversions() -> None:
+    fmt = TrackFormat('{{{id}}} {artist!r} {year} {seconds:>5} {title:.2}|{version}')
+    assert fmt.render(1, 1, track(version='live')) == "{7:3} 'A' 1999   185 So|live"
+
+
+def test_cached_field_uses_callback() -> None:
+    fmt = TrackFormat('{cached}{name}', cache_status=lambda t: f'[{t.id}] ')
+    assert fmt.render(1, 1, track()) == '[7] Song'
+
+
+@pytest.mark.parametrize('template, error', [
+    ('{nope}', 'unknown field {nope}'),
+    ('{title!x}', 'unknown conversion !x'),
+    ('{title:{n}}', 'unsupported format spec'),
+    ('{title:d}', "in '{title:d}'"),  # spec that does not fit the value fails up front
+])
+def test_invalid_templates(template: str, error: str) -> None:
+    with pytest.raises(ValueError, match=error.replace('{', r'\{').replace('}', r'\}')):
+        TrackFormat(template)
+
+
+@pytest.mark.parametrize('ms, text', [(None, '-:--'), (59_999, '0:59'), (61_000, '1:01'), (3_723_000, '1:02:03')])
+def test_duration_str(ms: int, text: str) -> None:
+    assert duration_str(ms) == text
+
+
+def test_line_writer_buffers() -> None:
+    out = io.StringIO()
+    with LineWriter(out) as writer:
+        writer.line('a')
+        writer.line('b')
+        assert out.getvalue() == ''
+    assert out.getvalue() == 'a\nb\n'
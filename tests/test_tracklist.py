@@ -0,0 +1,23 @@
+import pytest
+
+from tracklist import Permutation
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7, 16, 100, 257])
+def test_permutation_is_bijective(n: int) -> None:
+    assert sorted(Permutation(n, 42)) == list(range(n))
+
+
+def test_permutation_same_seed_same_order() -> None:
+    assert list(Permutation(500, 7)) == list(Permutation(500, 7))
+    assert list(Permutation(500, 7)) != list(Permutation(500, 8))
+
+
+@pytest.mark.parametrize('seed', [0, (1 << 64) - 1])
+def test_permutation_seed_range(seed: int) -> None:
+    assert sorted(Permutation(10, seed)) == list(range(10))
+
+
+def test_permutation_index_range() -> None:
+    with pytest.raises(IndexError):
+        Permutation(5, 1)[5]
@@ -0,0 +1,140 @@
+import lzma
+import re
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import time
+from typing import Final, Optional
+
+from cachecheck import LOSSY_SUFFIX, track_id_from_path
+from store import LocalStore
+
+COLD_FOLDER_NAME: Final = 'cold'
+XZ_SUFFIX: Final = '.xz'
+XZ_PRESET: Final = 6
+DAY: Final = 24 * 60 * 60
+
+
+def _compress(src: Path, dst: Path) -> int:
+    """xz into `dst`.xz, or a plain copy into `dst` if mp3 does not get smaller. Returns bytes written"""
+    data = src.read_bytes()
+    packed = lzma.compress(data, preset=XZ_PRESET)
+    if len(packed) < len(data):
+        dst = dst.with_name(dst.name + XZ_SUFFIX)
+    else:
+        packed = data
+    tmp = dst.with_name(dst.name + '.tmp')
+    tmp.write_bytes(packed)
+    tmp.replace(dst)
+    return len(packed)
+
+
+def _reencode(src: Path, dst: Path, bitrate: int) -> int:
+    """ffmpeg into `dst`.lossy, or a plain copy into `dst` if the file is at or below the profile already"""
+    tmp = dst.with_name(dst.stem + '.tmp.mp3')  # ffmpeg picks the muxer by extension
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', str(src), '-map', '0:a', '-map_metadata', '0',
+                    '-id3v2_version', '3', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', str(tmp)],
+                   check=True, stdin=subprocess.DEVNULL)
+    if tmp.stat().st_size >= src.stat().st_size:
+        tmp.unlink()
+        shutil.copyfile(src, tmp)
+    else:
+        dst = dst.with_name(dst.name + LOSSY_SUFFIX)
+    tmp.replace(dst)
+    return dst.stat().st_size
+
+
+def _keep_lossy(src: Path, dst: Path) -> int:
+    """Copy of a track restored from a re-encoded one, it stays marked as such"""
+    dst = dst.with_name(dst.name + LOSSY_SUFFIX)
+    shutil.copyfile(src, dst)
+    return dst.stat().st_size
+
+
+class ColdStorage:
+    """Second tier of the track cache: rarely played files live compressed or re-encoded in another folder
+    (possibly on a cheaper volume) under the same relative path, and are moved back when requested again.
+
+    A re-encoded file comes back with a `.lossy` marker next to it, `cache verify` downloads the original again.
+    """
+    __slots__ = ('cache_folder', 'folder')
+
+    def __init__(self, cache_folder: Path, folder: Optional[Path] = None) -> None:
+        self.cache_folder = cache_folder
+        self.folder = folder or cache_folder / COLD_FOLDER_NAME
+
+    def _cold_path(self, path: Path) -> Path:
+        return self.folder / path.relative_to(self.cache_folder)
+
+    def has(self, path: Path) -> bool:
+        cold = self._cold_path(path)
+        return any(cold.with_name(cold.name + suffix).exists() for suffix in ('', XZ_SUFFIX, LOSSY_SUFFIX))
+
+    def restore(self, path: Path) -> bool:
+        """Brings a cold file back to `path`, False if it is not in the cold tier"""
+        if not path.is_relative_to(self.cache_folder):
+            return False
+        cold = self._cold_path(path)
+        xz = cold.with_name(cold.name + XZ_SUFFIX)
+        lossy = cold.with_name(cold.name + LOSSY_SUFFIX)
+        src_path = next((p for p in (xz, cold, lossy) if p.exists()), None)
+        if src_path is None:
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        if src_path is xz:
+            with lzma.open(xz) as src, open(tmp, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            shutil.copyfile(src_path, tmp)
+        if src_path is lossy:
+            path.with_name(path.name + LOSSY_SUFFIX).touch()
+        tmp.replace(path)
+        src_path.unlink()
+        return True
+
+    def freeze(self, store: LocalStore, last_played: dict[str, int], cold_days: int, method: str, bitrate: int,
+               jobs: int) -> tuple[int, int, int]:
+        """Moves tracks not played (or modified, if never played) for `cold_days` to the cold tier in a process pool.
+
+        method: 'xz' (lossless, small gain for mp3) or 'reencode' (ffmpeg, `bitrate` kbps).
+        Tracks restored from a re-encoded copy go back as they are, still marked.
+        Returns number of files, bytes before, bytes after.
+        """
+        if method == 'reencode' and not shutil.which('ffmpeg'):
+            raise RuntimeError('ffmpeg is needed for --tier-method reencode')
+        cutoff = time() - cold_days * DAY
+        cold = list[tuple[Path, Optional[str], int]]()
+        for path in self.cache_folder.glob('*/*/*.mp3'):  # artist/album/file
+            if not re.search(r'_\d+$', path.parent.name):  # not an album folder
+                continue
+            track_id = track_id_from_path(path)
+            st = path.stat()
+            used = last_played.get(track_id.split(':')[0]) if track_id else None
+            if (used or st.st_mtime) < cutoff:  # atime is not it, `cache verify` reads every file
+                cold.append((path, track_id, st.st_size))
+        if not cold:
+            return 0, 0, 0
+
+        for path, _, _ in cold:
+            self._cold_path(path).parent.mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(max(1, jobs)) as executor:
+            futures = [executor.submit(_keep_lossy, path, self._cold_path(path))
+                       if path.with_name(path.name + LOSSY_SUFFIX).exists()
+                       else executor.submit(_reencode, path, self._cold_path(path), bitrate) if method == 'reencode'
+                       else executor.submit(_compress, path, self._cold_path(path)) for path, _, _ in cold]
+            before = after = files = 0
+            for (path, track_id, size), future in zip(cold, futures):
+                try:
+                    after += future.result()
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f'{type(e).__name__} {e}: {path}')
+                    continue
+                path.unlink()
+                path.with_name(path.name + LOSSY_SUFFIX).unlink(True)
+                if track_id:
+                    store.delete_file(track_id.split(':')[0])
+                before += size
+                files += 1
+        return files, before, after
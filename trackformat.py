@@ -0,0 +1,130 @@
+import re
+import string
+import sys
+from typing import TYPE_CHECKING, Callable, Final, Optional, TextIO
+
+if TYPE_CHECKING:
+    from yandex_music import Track
+    from yandex_music.album.album import Album
+
+DEFAULT_FORMAT: Final = '{n:>2}/{total}: {type_tag}{artists} [{albums}] ~ {title} {duration}'
+DEFAULT_FORMAT_ID: Final = '{n:>2}/{total}: {id:<18} {type_tag}{artists} [{albums}] ~ {title} {duration}'
+BUFFER_SIZE: Final = 64 * 1024  # characters
+
+
+def duration_str(duration_ms: Optional[int]) -> str:
+    if duration_ms:
+        sec = duration_ms // 1000
+        min = sec // 60
+        if min > 60:
+            return f'{min // 60}:{min % 60:02}:{sec % 60:02}'
+        else:
+            return f'{min}:{sec % 60:02}'
+    else:
+        return '-:--'
+
+
+def _album(a: 'Album') -> str:
+    return f'{a.title} @ {a.version}' if a.version else a.title or str(a.id)
+
+
+def _type_tag(t: 'Track') -> str:
+    return f'({t.type}) ' if t.type and t.type != 'music' and t.type != 'podcast-episode' else ''
+
+
+# field -> expression of track `t`, inlined into the compiled renderer
+FIELDS: Final = {
+    'n': 'n',
+    'total': 'total',
+    'id': 't.track_id',
+    'type': "(t.type or '')",
+    'type_tag': '_type_tag(t)',
+    'artist': "(t.artists[0].name if t.artists else '')",
+    'artists': "'|'.join(t.artists_name())",
+    'album': "(_album(t.albums[0]) if t.albums else '')",
+    'albums': "'|'.join([_album(a) for a in t.albums])",
+    'album_id': "(t.albums[0].id if t.albums else '')",
+    'year': "((t.albums[0].year or '') if t.albums else '')",
+    'name': "(t.title or '')",
+    'version': "(t.version or '')",
+    'title': "(t.title if not t.version else f'{t.title} @ {t.version}')",
+    'duration': 'duration_str(t.duration_ms)',
+    'seconds': '((t.duration_ms or 0) // 1000)',
+    'cached': '_cache_status(t)',  # cached, cold or empty
+}
+_UNSAFE_SPEC: Final = re.compile(r'["\\{}\n]')
+
+
+def _sample_track() -> 'Track':
+    from yandex_music import Album, Artist, Track
+    return Track(1, 'title', artists=[Artist(1, name='artist')], albums=[Album(1, title='album', year=2000)],
+                 version='version', duration_ms=1000, type_='music')
+
+
+class TrackFormat:
+    """`str.format` template for track lines, compiled once into a single f-string function:
+    a line evaluates only the fields the template has, with no per-line parsing or dict building.
+
+    cache_status(track): value of {cached} (costs a stat per track, so only with that field).
+    notes: also emit track short descriptions (default format, user formats are one line per track).
+    """
+    __slots__ = ('template', 'notes', 'render')
+
+    def __init__(self, template: str, cache_status: Optional[Callable[['Track'], str]] = None,
+                 notes: bool = False) -> None:
+        parts = list[str]()
+        for literal, name, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                parts.append(repr(literal))  # adjacent literals and f-strings join at compile time
+            if name is None:
+                continue
+            if name not in FIELDS:
+                raise ValueError(f'unknown field {{{name}}}, known: {", ".join(FIELDS)}')
+            if conversion and conversion not in 'rsa':
+                raise ValueError(f'unknown conversion !{conversion} of {{{name}}}')
+            if spec and _UNSAFE_SPEC.search(spec):
+                raise ValueError(f'unsupported format spec in {{{name}:{spec}}}')
+            parts.append(f'f"{{{FIELDS[name]}{"!" + conversion if conversion else ""}{":" + spec if spec else ""}}}"')
+        self.template = template
+        self.notes = notes
+        source = f'lambda n, total, t: {" ".join(parts) or repr("")}'
+        names = {'_album': _album, '_type_tag': _type_tag, 'duration_str': duration_str}
+        try:  # a spec that does not fit the value ({title:d}) fails here, not in the middle of a listing
+            eval(source, {**names, '_cache_status': lambda t: ''})(1, 1, _sample_track())
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'{e} in {template!r}') from e
+        self.render: Callable[[int, int, 'Track'], str] = eval(source, {**names, '_cache_status': cache_status})
+
+
+class LineWriter:
+    """Output lines joined and written in big chunks instead of one print (write + flush) per line.
+
+    Writes through on a terminal, where a listing should show up as it goes.
+    """
+    __slots__ = ('_stream', '_lines', '_size', '_through')
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        self._stream = stream or sys.stdout
+        self._lines = list[str]()
+        self._size = 0
+        self._through = self._stream.isatty()
+
+    def line(self, s: str) -> None:
+        self._lines.append(s)
+        self._size += len(s) + 1
+        if self._through or self._size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            self._lines.append('')
+            self._stream.write('\n'.join(self._lines))
+            self._lines.clear()
+            self._size = 0
+        self._stream.flush()
+
+    def __enter__(self) -> 'LineWriter':
+        return self
+
+    def __exit__(self, *_) -> None:  # type: ignore[no-untyped-def]
+        self.flush()
@@ -0,0 +1,218 @@
+import hashlib
+from array import array
+from collections import OrderedDict
+from secrets import randbits
+from typing import TYPE_CHECKING, Final, Iterable, Iterator, Optional, Union, cast
+
+from yandex_music import Client, Track, TrackShort
+
+if TYPE_CHECKING:
+    from store import LocalStore
+
+HYDRATE_BATCH: Final = 50     # tracks per client.tracks() request
+HYDRATE_CACHE_SIZE: Final = 256
+PINNED_SIZE: Final = 256      # full tracks kept from the list itself, the rest go to the local store
+FEISTEL_ROUNDS: Final = 4
+
+
+class Permutation:
+    """Seeded random permutation of range(n), computed per index without materializing it.
+
+    Feistel network over the smallest even-bit domain that fits n, cycle walking back into range.
+    Same seed and n always give the same order.
+    """
+    __slots__ = ('n', 'seed', '_half_bits', '_mask', '_keys')
+
+    def __init__(self, n: int, seed: int) -> None:
+        self.n = n
+        self.seed = seed
+        self._half_bits = max(1, ((n - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half_bits) - 1
+        self._keys = [seed.to_bytes(8, 'little') + bytes((r,)) for r in range(FEISTEL_ROUNDS)]
+
+    def _round(self, r: int, x: int) -> int:
+        digest = hashlib.blake2b(x.to_bytes(8, 'little'), digest_size=8, key=self._keys[r]).digest()
+        return int.from_bytes(digest, 'little') & self._mask
+
+    def _encrypt(self, x: int) -> int:
+        left, right = x >> self._half_bits, x & self._mask
+        for r in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(r, right)
+        return (left << self._half_bits) | right
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> int:
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        x = self._encrypt(i)
+        while x >= self.n:  # domain is < 4n, so a few steps at most on average
+            x = self._encrypt(x)
+        return x
+
+
+class TrackList:
+    """Compact track list: track and album ids in two parallel int64 arrays, metadata is fetched on demand.
+
+    Ids that are not numbers (user uploaded tracks) are stored as negative indexes into `_strs`, album id 0 means none.
+    Full tracks that came from the API with the list (search, albums, nested in playlist items) are kept up to
+    PINNED_SIZE, the rest are written to the local store (dropped without one: fetched again when needed).
+    Tracks fetched by `hydrate` live in a small LRU cache and in the store, ids the API does not return are
+    remembered. Shuffle and reverse only change how positions map to the arrays.
+    """
+    __slots__ = ('client', 'store', '_ids', '_albums', '_strs', '_pinned', '_substitutes', '_cache', '_missing',
+                 '_order', '_reversed')
+
+    def __init__(self, client: Optional[Client], tracks: Iterable[Union[Track, TrackShort]] = (),
+                 store: Optional['LocalStore'] = None) -> None:
+        self.client = client
+        self.store = store
+        self._ids = array('q')
+        self._albums = array('q')
+        self._strs = list[str]()
+        self._pinned: dict[str, Track] = {}
+        self._substitutes: OrderedDict[str, Track] = OrderedDict()
+        self._cache: OrderedDict[str, Track] = OrderedDict()
+        self._missing = set[str]()
+        self._order: Optional[Permutation] = None
+        self._reversed = False
+        self.extend(tracks)
+
+    def _encode(self, id: Union[int, str, None]) -> int:
+        try:
+            return int(id)  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            self._strs.append(str(id))
+            return -len(self._strs)
+
+    def _decode(self, n: int) -> str:
+        return str(n) if n >= 0 else self._strs[-n - 1]
+
+    def append(self, track_or_short: Union[Track, TrackShort]) -> None:
+        self.extend((track_or_short,))
+
+    def extend(self, tracks: Iterable[Union[Track, TrackShort]]) -> None:
+        assert self._order is None and not self._reversed
+        overflow = list[tuple[str, dict]]()
+        for t in tracks:
+            if isinstance(t, Track):
+                album_id = t.albums[0].id if t.albums else None
+                track: Optional[Track] = t
+            else:
+                album_id = t.album_id
+                track = t.track
+            if track is not None:  # no request for it later
+                if len(self._pinned) < PINNED_SIZE:
+                    self._pinned[str(t.id)] = track
+                elif self.store:
+                    overflow.append((str(track.id), track.to_dict()))
+                    if len(overflow) >= HYDRATE_CACHE_SIZE:
+                        self.store.put_tracks(overflow)
+                        overflow.clear()
+            self._ids.append(self._encode(t.id))
+            self._albums.append(int(album_id) if album_id else 0)
+        if overflow and self.store:
+            self.store.put_tracks(overflow)
+
+    @classmethod
+    def from_track_ids(cls, client: Optional[Client], track_ids: Iterable[str]) -> 'TrackList':
+        tracks = cls(client)
+        for track_id in track_ids:
+            id, _, album_id = track_id.partition(':')
+            tracks._ids.append(tracks._encode(id))
+            tracks._albums.append(int(album_id) if album_id else 0)
+        return tracks
+
+    def stored_track_ids(self) -> Iterator[str]:
+        """Track ids in storage order, ignoring shuffle and reverse"""
+        for id, album_id in zip(self._ids, self._albums):
+            yield f'{self._decode(id)}:{album_id}' if album_id else self._decode(id)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _at(self, i: int) -> int:
+        if not 0 <= i < len(self._ids):
+            raise IndexError(i)
+        if self._reversed:
+            i = len(self._ids) - 1 - i
+        return self._order[i] if self._order else i
+
+    def id(self, i: int) -> str:
+        return self._decode(self._ids[self._at(i)])
+
+    def track_id(self, i: int) -> str:
+        """`id:album_id` like `Track.track_id` / `TrackShort.track_id`"""
+        n = self._at(i)
+        album_id = self._albums[n]
+        return f'{self._decode(self._ids[n])}:{album_id}' if album_id else self._decode(self._ids[n])
+
+    def track_ids(self) -> Iterator[str]:
+        return (self.track_id(i) for i in range(len(self._ids)))
+
+    def export(self) -> str:
+        return ','.join(self.track_ids())
+
+    def __getitem__(self, i: int) -> Union[Track, TrackShort]:
+        """Full track if known or fetched, `TrackShort` (fetches itself) otherwise"""
+        id = self.id(i)
+        track = self._substitutes.get(id) or self._pinned.get(id) or self._cached(id)
+        if track is None and self.client is not None and id not in self._missing:
+            self.hydrate(i)
+            track = self._cached(id)
+        if track is not None:
+            return track
+        album_id = self._albums[self._at(i)]
+        return TrackShort(id, '', str(album_id) if album_id else None, client=self.client)
+
+    def pin(self, i: int, track: Track) -> None:
+        """`track` is returned for position i from now on (a substitute), ids of the list stay the same.
+
+        The last HYDRATE_CACHE_SIZE substitutes are kept, older ones belong to tracks played already.
+        """
+        self._substitutes[self.id(i)] = track
+        while len(self._substitutes) > HYDRATE_CACHE_SIZE:
+            self._substitutes.popitem(last=False)
+
+    def __iter__(self) -> Iterator[Union[Track, TrackShort]]:
+        for i in range(len(self._ids)):
+            yield self[i]
+
+    def _cached(self, id: str) -> Optional[Track]:
+        track = self._cache.get(id)
+        if track is not None:
+            self._cache.move_to_end(id)
+        return track
+
+    def hydrate(self, start: int, count: int = HYDRATE_BATCH) -> None:
+        """Fetch metadata of tracks [start, start + count) that are not known yet in one request"""
+        assert self.client
+        track_ids = [self.track_id(i) for i in range(start, min(start + count, len(self._ids)))
+                     if self.id(i) not in self._pinned and self.id(i) not in self._cache
+                     and self.id(i) not in self._missing]
+        if not track_ids:
+            return
+        if self.store:
+            for id, data in self.store.get_tracks([track_id.split(':')[0] for track_id in track_ids]).items():
+                self._cache[id] = cast(Track, Track.de_json(data, self.client))
+            track_ids = [track_id for track_id in track_ids if track_id.split(':')[0] not in self._cache]
+        if track_ids:
+            tracks = self.client.tracks(track_ids)
+            for track in tracks:
+                self._cache[str(track.id)] = track
+            self._missing.update(id for track_id in track_ids if (id := track_id.split(':')[0]) not in self._cache)
+            if self.store:
+                self.store.put_tracks([(str(track.id), track.to_dict()) for track in tracks])
+        while len(self._cache) > HYDRATE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def shuffle(self, seed: Optional[int] = None) -> int:
+        """Lazy seeded shuffle, returns the seed to get the same order again"""
+        if seed is None:
+            seed = randbits(63)
+        self._order = Permutation(len(self._ids), seed)
+        return seed
+
+    def reverse(self) -> None:
+        self._reversed = not self._reversed
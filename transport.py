@@ -0,0 +1,213 @@
+import ipaddress
+import socket
+import ssl
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING, Final
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.ssl_ import resolve_cert_reqs
+from yandex_music.exceptions import BadRequest, CaptchaRequired, CaptchaWrong, NetworkError, TimedOut, Unauthorized
+from yandex_music.utils.captcha_response import CaptchaResponse
+from yandex_music.utils.request import USER_AGENT, Request
+
+if TYPE_CHECKING:
+    from yandex_music import Client
+
+POOL_SIZE: Final = 10  # keep-alive connections per host
+CONNECT_TIMEOUT: Final = 5  # seconds
+READ_TIMEOUT: Final = 15  # seconds
+DNS_TTL: Final = 5 * 60  # seconds
+# connection classes below override urllib3 internals (`_dns_host`, `_new_conn`, `_validate_conn`),
+# checked against 1.26 and 2.x. Other versions get the stock pools: no DNS cache
+URLLIB3_VERSIONS: Final = ((1, 26), (3, 0))
+
+
+class DnsCache:
+    """host -> addresses, so new connections to the API and CDN hosts skip the resolver.
+
+    All addresses are kept, the one that failed last goes to the end (a host with broken IPv6 still connects).
+    """
+    __slots__ = ('ttl', '_entries', '_lock')
+
+    def __init__(self, ttl: float = DNS_TTL) -> None:
+        self.ttl = ttl
+        self._entries: dict[tuple[str, int], tuple[list[str], float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> list[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[1] > monotonic():
+            return entry[0]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))  # resolver order, no duplicates
+        with self._lock:
+            self._entries[key] = (addresses, monotonic() + self.ttl)
+        return addresses
+
+    def failed(self, host: str, port: int, address: str) -> None:
+        """Moves `address` to the end, new connections try the others first"""
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and address in entry[0]:
+                self._entries[host, port] = ([a for a in entry[0] if a != address] + [address], entry[1])
+
+    def forget(self, host: str, port: int) -> None:
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+DNS_CACHE: Final = DnsCache()
+
+
+class _CachedDnsMixin:
+    def _new_conn(self):  # type: ignore[no-untyped-def]
+        # connect to a cached address, `host` stays the name for SNI and certificate checks
+        host, port = self._dns_host, self.port  # type: ignore[attr-defined]
+        try:
+            addresses = DNS_CACHE.resolve(host, port)
+        except OSError as e:  # socket.gaierror: wrapped as urllib3 does, requests makes it a ConnectionError
+            raise NewConnectionError(self, f'Failed to establish a new connection: {e}') from e
+        try:
+            for address in addresses[:-1]:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()  # type: ignore[misc]
+                except Exception:
+                    DNS_CACHE.failed(host, port, address)
+            self._dns_host = addresses[-1]
+            try:
+                return super()._new_conn()  # type: ignore[misc]
+            except Exception:
+                DNS_CACHE.forget(host, port)  # every address failed, they may be stale
+                raise
+        finally:
+            self._dns_host = host
+
+
+class _HTTPConnection(_CachedDnsMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CachedDnsMixin, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+    def _validate_conn(self, conn):  # type: ignore[no-untyped-def]
+        if resolve_cert_reqs(self.cert_reqs) != ssl.CERT_NONE:
+            return super()._validate_conn(conn)
+        # verification is off on purpose (`verify=False`): no InsecureRequestWarning on every request
+        HTTPConnectionPool._validate_conn(self, conn)
+        if not getattr(conn, 'sock', None):
+            conn.connect()
+
+
+def _supported_urllib3() -> bool:
+    version = tuple(int(part) for part in urllib3.__version__.split('.')[:2] if part.isdigit())
+    return URLLIB3_VERSIONS[0] <= version < URLLIB3_VERSIONS[1]
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):  # type: ignore[no-untyped-def]
+        super().init_poolmanager(*args, **kwargs)
+        if _supported_urllib3():
+            self.poolmanager.pool_classes_by_scheme = {'http': _HTTPConnectionPool, 'https': _HTTPSConnectionPool}
+
+
+class Transport:
+    """One `requests.Session` for API calls and CDN downloads: pooled keep-alive connections, cached DNS.
+
+    TLS verification is a setting of this session only, nothing is patched process wide
+    (its warnings are skipped by our connection pools, not by a global filter).
+    """
+    __slots__ = ('session', 'timeout', 'verify')
+
+    def __init__(self, pool_size: int = POOL_SIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, keep_alive: bool = True, verify: bool = True) -> None:
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = _Adapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:  # type: ignore[no-untyped-def]
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs['verify'] = self.verify  # per request: a session default loses to REQUESTS_CA_BUNDLE
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:  # type: ignore[no-untyped-def]
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class TransportRequest(Request):
+    """`yandex_music` request helper that sends everything through a `Transport`"""
+
+    def __init__(self, transport: Transport, client=None, headers=None, proxy_url=None) -> None:  # type: ignore
+        super().__init__(client, headers, proxy_url)
+        self.transport = transport
+
+    def _request_wrapper(self, *args, **kwargs):  # type: ignore[no-untyped-def]
+        # same as Request._request_wrapper, but on the shared session and with its timeouts
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {}
+        kwargs['headers']['User-Agent'] = USER_AGENT
+        kwargs['timeout'] = self.transport.timeout
+
+        try:
+            resp = self.transport.request(*args, **kwargs)
+        except requests.Timeout:
+            raise TimedOut()
+        except requests.RequestException as e:
+            raise NetworkError(e)
+
+        if 200 <= resp.status_code <= 299:
+            return resp
+
+        parse = self._parse(resp.content)
+        message = parse.error or 'Unknown HTTPError'
+        if 'CAPTCHA' in message:
+            exception = CaptchaWrong if 'Wrong' in message else CaptchaRequired
+            raise exception(message, CaptchaResponse.de_json(parse.result, self.client))
+        elif resp.status_code in (401, 403):
+            raise Unauthorized(message)
+        elif resp.status_code == 400:
+            raise BadRequest(message)
+        elif resp.status_code in (404, 409, 413):
+            raise NetworkError(message)
+        elif resp.status_code == 502:
+            raise NetworkError('Bad Gateway')
+        else:
+            raise NetworkError(f'{message} ({resp.status_code})')
+
+
+def transport_of(client: 'Client') -> Transport:
+    """Transport of a client made with `TransportRequest`: CDN downloads share its pool, TLS and timeout settings"""
+    request = client.request
+    if not isinstance(request, TransportRequest):
+        raise TypeError('client must be made with request=TransportRequest(transport)')
+    return request.transport
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Thin client for `main.py daemon`: same arguments as main.py, no heavy imports.
+import json
+import os
+import socket
+import sys
+import threading
+from pathlib import Path
+from typing import Final, Union
+
+SOCKET_FILE_NAME: Final = 'daemon.sock'
+PORT_FILE_NAME: Final = 'daemon.port'  # "port auth" for TCP fallback (no AF_UNIX)
+EXIT_MARKER: Final = '\0EXIT '  # followed by exit code and new line, ends session output
+
+
+def server_address(cache_folder: Path) -> tuple[int, Union[str, tuple[str, int]]]:
+    if hasattr(socket, 'AF_UNIX'):
+        return socket.AF_UNIX, str(cache_folder / SOCKET_FILE_NAME)
+    return socket.AF_INET, ('127.0.0.1', 0)
+
+
+def cache_folder(argv: list[str]) -> Path:
+    for i, arg in enumerate(argv):
+        if arg == '--cache-folder' and i + 1 < len(argv):
+            return Path(argv[i + 1])
+        if arg.startswith('--cache-folder='):
+            return Path(arg.split('=', 1)[1])
+    return Path(__file__).resolve().parent / '.YMcache'
+
+
+def connect(folder: Path) -> tuple[socket.socket, str]:
+    family, address = server_address(folder)
+    auth = ''
+    if family != socket.AF_UNIX:
+        port, auth = (folder / PORT_FILE_NAME).read_text().split()
+        address = ('127.0.0.1', int(port))
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock, auth
+
+
+def forward_stdin(sock: socket.socket) -> None:
+    # stdin EOF is not forwarded: the daemon treats a closed connection as "client is gone"
+    try:
+        for line in sys.stdin:
+            sock.sendall(line.encode('utf-8'))
+    except OSError:
+        pass
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    folder = cache_folder(argv)
+    if not folder.is_absolute():
+        folder = Path.cwd() / folder
+    try:
+        sock, auth = connect(folder)
+    except (OSError, ValueError):
+        print('Daemon is not running. Start it with: main.py daemon', file=sys.stderr)
+        return 2
+
+    with sock:
+        sock.sendall((json.dumps({'argv': argv, 'cwd': os.getcwd(), 'auth': auth}) + '\n').encode('utf-8'))
+        threading.Thread(target=forward_stdin, args=(sock,), daemon=True).start()
+
+        marker = EXIT_MARKER.encode()
+        out = sys.stdout.buffer
+        tail = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return 1  # daemon went away
+            data = tail + data
+            pos = data.find(marker)
+            if pos >= 0:
+                out.write(data[:pos])
+                out.flush()
+                rest = data[pos + len(marker):]
+                while not rest.endswith(b'\n'):
+                    more = sock.recv(64)
+                    if not more:
+                        break
+                    rest += more
+                return int(rest.strip() or 1)
+            # keep a possible partial marker for the next chunk
+            keep = len(marker) - 1
+            out.write(data[:-keep] if len(data) > keep else b'')
+            tail = data[-keep:] if len(data) > keep else data
+            out.flush()
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)